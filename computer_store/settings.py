@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -48,6 +49,8 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'store.middleware.AuditUserMiddleware',
+    'store.middleware.IdempotencyMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -78,7 +81,62 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'OPTIONS': {
+            # транзакция сразу берет блокировку записи: параллельные кассы ждут,
+            # а не получают "database is locked" при повышении блокировки
+            'transaction_mode': 'IMMEDIATE',
+        },
+    },
+    # Архив закрытых периодов (manage.py close_period); создается
+    # командой manage.py migrate --database=archive
+    'archive': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'archive.sqlite3',
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+        },
+    },
+}
+
+DATABASE_ROUTERS = ['store.routers.ArchiveRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# Бэкенд кэша фрагментов шаблонов: 'file' (общий для всех процессов каталог
+# на диске) или 'locmem' (в памяти процесса — только для одного процесса:
+# версии данных в кэше, и другие воркеры не увидели бы их изменения)
+STORE_FRAGMENT_CACHE_BACKEND = os.environ.get('STORE_FRAGMENT_CACHE_BACKEND', 'file')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'fragments': {
+        'locmem': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'store-fragments',
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        },
+        'file': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': BASE_DIR / 'cache' / 'fragments',
+            'OPTIONS': {'MAX_ENTRIES': 20000},
+        },
+    }[STORE_FRAGMENT_CACHE_BACKEND],
+}
+
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'store': {'handlers': ['console'], 'level': os.environ.get('STORE_LOG_LEVEL', 'INFO')},
+    },
 }
 
 
@@ -122,3 +180,38 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Настройки магазина
+
+# Срок резерва товара под неоплаченный счет, часов
+STORE_RESERVATION_TTL_HOURS = 72
+
+# Блокировка при записи остатков: 'optimistic' (версия строки и повтор)
+# или 'pessimistic' (select_for_update)
+STORE_STOCK_LOCKING = 'optimistic'
+STORE_STOCK_MAX_RETRIES = 5
+
+# POST-запросы, повтор которых с тем же Idempotency-Key получает
+# сохраненный ответ (имена маршрутов), и срок хранения ключей, часов
+STORE_IDEMPOTENT_VIEWS = ['create_sale_document', 'invoice_form', 'mark_invoice_paid']
+STORE_IDEMPOTENCY_TTL_HOURS = 24
+
+# Срок хранения отрисованных карточек документов и счетов в кэше, секунд;
+# при изменении документа ключ меняется за счет cache_version
+STORE_DETAIL_CACHE_TIMEOUT = 7 * 24 * 3600
+
+# Кэш фрагментов шаблонов (алиас CACHES) и срок хранения фрагмента, секунд
+STORE_FRAGMENT_CACHE = 'fragments'
+STORE_FRAGMENT_CACHE_TIMEOUT = 24 * 3600
+
+# Каталог колоночного снимка позиций документов (manage.py export_facts)
+STORE_FACTS_DIR = BASE_DIR / 'facts'
+
+# Журнал изменений пишется фоновым потоком пачками; False — сразу при
+# фиксации транзакции
+STORE_AUDIT_ASYNC = True
+
+# Прогрев при запуске (модули, URLconf, шаблоны) — для серверов с
+# предварительным форком воркеров, например gunicorn --preload
+STORE_PREWARM = os.environ.get('STORE_PREWARM') == '1'
@@ -1,14 +1,51 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.utils.functional import cached_property
+
 from .models import (
     Customer,
     Product,
+    KitComponent,
+    PriceHistory,
     Invoice,
     InvoiceItem,
     SaleDocument,
-    DocumentItem
+    DocumentItem,
+    CashRegister,
+    Shift,
+    AuditEntry,
+    Stocktake,
+    StockMovement,
 )
 
 
+class LargeTablePaginator(Paginator):
+    """Пагинатор для больших таблиц: считает строки не дальше count_limit"""
+    count_limit = 10000
+
+    @cached_property
+    def count(self):
+        # COUNT(*) по подзапросу с LIMIT не сканирует всю таблицу
+        return self.object_list.order_by()[:self.count_limit].count()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Базовый класс для списков, которые могут содержать миллионы строк"""
+    paginator = LargeTablePaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+
+class ItemAdmin(LargeTableAdmin):
+    """Позиции документов и счетов: удаляются через delete() (итоги, резервы, журнал)"""
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            for item in queryset:
+                item.delete()
+
+
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
     list_display = ('name', 'is_company', 'contact', 'created_at')
@@ -17,26 +54,49 @@ class CustomerAdmin(admin.ModelAdmin):
     ordering = ('-created_at',)
 
 
+class KitComponentInline(admin.TabularInline):
+    model = KitComponent
+    fk_name = 'kit'
+    extra = 1
+    autocomplete_fields = ('component',)
+
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'price', 'quantity', 'created_at', 'updated_at')
-    search_fields = ('name',)
+    list_display = ('name', 'sku', 'price', 'quantity', 'reserved', 'kit_available', 'created_at', 'updated_at')
+    search_fields = ('name', '=sku')
     list_filter = ('created_at', 'updated_at')
     ordering = ('name',)
-    fields = ('name', 'price', 'quantity')
+    fields = ('name', 'sku', 'price', 'quantity', 'kit_available')
+    readonly_fields = ('kit_available',)
+    inlines = [KitComponentInline]
+
+
+@admin.register(PriceHistory)
+class PriceHistoryAdmin(LargeTableAdmin):
+    list_display = ('product', 'price', 'effective_from', 'source', 'created_at')
+    list_select_related = ('product',)
+    search_fields = ('product__name', 'source')
+    list_filter = ('effective_from',)
+    autocomplete_fields = ('product',)
+    ordering = ('-effective_from', 'product')
 
 
 class InvoiceItemInline(admin.TabularInline):
     model = InvoiceItem
     extra = 1
+    autocomplete_fields = ('product',)
 
 
 @admin.register(Invoice)
-class InvoiceAdmin(admin.ModelAdmin):
+class InvoiceAdmin(LargeTableAdmin):
     list_display = ('number', 'date', 'customer', 'is_paid', 'total')
+    list_select_related = ('customer',)
     search_fields = ('number', 'customer__name')
-    list_filter = ('date', 'is_paid')
+    list_filter = ('is_paid',)
+    date_hierarchy = 'date'
     ordering = ('-date',)
+    autocomplete_fields = ('customer',)
     inlines = [InvoiceItemInline]
     readonly_fields = ('total',)
 
@@ -44,28 +104,98 @@ class InvoiceAdmin(admin.ModelAdmin):
 class DocumentItemInline(admin.TabularInline):
     model = DocumentItem
     extra = 1
+    autocomplete_fields = ('product',)
 
 
 @admin.register(SaleDocument)
-class SaleDocumentAdmin(admin.ModelAdmin):
+class SaleDocumentAdmin(LargeTableAdmin):
     list_display = ('number', 'type', 'date', 'customer', 'total')
+    list_select_related = ('customer',)
     search_fields = ('number', 'customer__name')
-    list_filter = ('type', 'date')
+    list_filter = ('type',)
+    date_hierarchy = 'date'
     ordering = ('-date',)
+    autocomplete_fields = ('customer', 'invoice', 'original_sale', 'register', 'shift')
     inlines = [DocumentItemInline]
     readonly_fields = ('total',)
 
 
 @admin.register(InvoiceItem)
-class InvoiceItemAdmin(admin.ModelAdmin):
+class InvoiceItemAdmin(ItemAdmin):
     list_display = ('invoice', 'product', 'quantity', 'price', 'created_at')
+    list_select_related = ('invoice', 'product')
     search_fields = ('invoice__number', 'product__name')
-    list_filter = ('created_at',)
-    ordering = ('-created_at',)
+    autocomplete_fields = ('invoice', 'product')
+    ordering = ('-id',)
 
 
 @admin.register(DocumentItem)
-class DocumentItemAdmin(admin.ModelAdmin):
+class DocumentItemAdmin(ItemAdmin):
     list_display = ('document', 'product', 'quantity', 'price')
+    list_select_related = ('document', 'product')
     search_fields = ('document__number', 'product__name')
-    ordering = ('document',)
+    autocomplete_fields = ('document', 'product')
+    ordering = ('-id',)
+
+
+@admin.register(CashRegister)
+class CashRegisterAdmin(admin.ModelAdmin):
+    list_display = ('code', 'name', 'last_number', 'is_active')
+    search_fields = ('code', 'name')
+    list_filter = ('is_active',)
+    readonly_fields = ('last_number',)
+
+
+@admin.register(Shift)
+class ShiftAdmin(admin.ModelAdmin):
+    list_display = ('register', 'number', 'opened_at', 'closed_at', 'sales_total', 'returns_total', 'sales_count')
+    list_select_related = ('register',)
+    search_fields = ('register__code', 'register__name')
+    list_filter = ('register',)
+    ordering = ('-opened_at',)
+    readonly_fields = ('sales_total', 'returns_total', 'sales_count', 'returns_count')
+
+
+@admin.register(AuditEntry)
+class AuditEntryAdmin(LargeTableAdmin):
+    list_display = ('created_at', 'model', 'object_id', 'action', 'user')
+    list_filter = ('model', 'action')
+    search_fields = ('=object_id', 'user')
+    ordering = ('-created_at',)
+
+    # журнал только дополняется
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Stocktake)
+class StocktakeAdmin(admin.ModelAdmin):
+    list_display = ('number', 'date', 'full', 'comment', 'posted_at')
+    search_fields = ('number', 'comment')
+    list_filter = ('full', 'date')
+    readonly_fields = ('number', 'posted_at')
+
+
+@admin.register(StockMovement)
+class StockMovementAdmin(LargeTableAdmin):
+    list_display = ('created_at', 'product', 'kind', 'quantity', 'balance', 'stocktake')
+    list_select_related = ('product', 'stocktake')
+    list_filter = ('kind',)
+    search_fields = ('product__name', '=product__sku')
+    ordering = ('-created_at',)
+
+    # движения пишутся только документами
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,209 @@
+"""Аналитика продаж по товарам.
+
+Позиции документов читаются порциями колонок (товар, дата, количество,
+цена, тип) из снимка store.facts или через values_list, а группировки,
+скользящие окна и рейтинги считаются в NumPy. Память ограничена
+размером порции плюс массивами по числу товаров и дней периода.
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.db.models import Min
+
+from .models import DocumentItem, Product
+
+TYPE_CODES = {'cash': 0, 'cashless': 1, 'return': 2}
+RETURN_CODE = TYPE_CODES['return']
+
+CHUNK_SIZE = 100_000
+
+
+def iter_item_chunks(start_date=None, end_date=None, chunk_size=CHUNK_SIZE, after_id=0):
+    """Отдает позиции документов порциями колонок NumPy.
+
+    Порции выбираются по возрастанию id позиции (keyset), поэтому
+    каждый запрос стоит одинаково независимо от глубины. after_id
+    позволяет продолжить обработку с места предыдущего запуска.
+    """
+    qs = DocumentItem.objects.all()
+    if start_date:
+        qs = qs.filter(document__date__gte=start_date)
+    if end_date:
+        qs = qs.filter(document__date__lte=end_date)
+
+    last_id = after_id
+    while True:
+        rows = list(
+            qs.filter(id__gt=last_id).order_by('id').values_list(
+                'id', 'product_id', 'document__date', 'quantity', 'price', 'document__type'
+            )[:chunk_size]
+        )
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield rows_to_columns(rows)
+
+
+def rows_to_columns(rows):
+    """Преобразует строки values_list в словарь колонок"""
+    ids, product_ids, dates, quantities, prices, types = zip(*rows)
+    count = len(rows)
+    return {
+        'id': np.fromiter(ids, dtype=np.int64, count=count),
+        'product_id': np.fromiter(product_ids, dtype=np.int64, count=count),
+        'date': np.fromiter((d.toordinal() for d in dates), dtype=np.int32, count=count),
+        'qty': np.fromiter(quantities, dtype=np.int64, count=count),
+        # цена в копейках, чтобы не терять точность на float
+        'price': np.fromiter((int(p * 100) for p in prices), dtype=np.int64, count=count),
+        'type': np.fromiter((TYPE_CODES[t] for t in types), dtype=np.int8, count=count),
+    }
+
+
+class ProductSalesAccumulator:
+    """Накапливает суммы по товарам и дням для потока порций"""
+
+    def __init__(self, start_date, end_date, window):
+        self.start = start_date.toordinal()
+        self.days = (end_date - start_date).days + 1
+        self.window_start = end_date.toordinal() - window + 1
+        self.size = 0
+        self.units = np.zeros(0)
+        self.revenue = np.zeros(0)
+        self.returned_units = np.zeros(0)
+        self.returned_amount = np.zeros(0)
+        self.recent_units = np.zeros(0)
+        self.daily_revenue = np.zeros(self.days)
+        self.daily_returns = np.zeros(self.days)
+
+    def _grow(self, size):
+        if size <= self.size:
+            return
+        for name in ('units', 'revenue', 'returned_units', 'returned_amount', 'recent_units'):
+            setattr(self, name, np.pad(getattr(self, name), (0, size - self.size)))
+        self.size = size
+
+    def add(self, columns):
+        product_id = columns['product_id']
+        if not len(product_id):
+            return
+        self._grow(int(product_id.max()) + 1)
+
+        amount = columns['qty'] * columns['price']
+        is_return = columns['type'] == RETURN_CODE
+        is_sale = ~is_return
+        day = columns['date'] - self.start
+        in_range = (day >= 0) & (day < self.days)
+
+        def by_product(mask, weights):
+            return np.bincount(product_id[mask], weights=weights[mask], minlength=self.size)
+
+        def by_day(mask, weights):
+            mask = mask & in_range
+            return np.bincount(day[mask], weights=weights[mask], minlength=self.days)
+
+        self.units += by_product(is_sale, columns['qty'])
+        self.revenue += by_product(is_sale, amount)
+        self.returned_units += by_product(is_return, columns['qty'])
+        self.returned_amount += by_product(is_return, amount)
+        self.recent_units += by_product(is_sale & (columns['date'] >= self.window_start), columns['qty'])
+        self.daily_revenue += by_day(is_sale, amount)
+        self.daily_returns += by_day(is_return, amount)
+
+
+def moving_average(values, window):
+    """Скользящее среднее; первые дни усредняются по неполному окну"""
+    if not len(values):
+        return values
+    sums = np.cumsum(values)
+    sums[window:] = sums[window:] - sums[:-window]
+    counts = np.minimum(np.arange(1, len(values) + 1), window)
+    return sums / counts
+
+
+def top_indices(values, limit):
+    """Индексы наибольших ненулевых значений по убыванию"""
+    nonzero = np.flatnonzero(values)
+    if not len(nonzero):
+        return nonzero
+    if len(nonzero) > limit:
+        nonzero = nonzero[np.argpartition(-values[nonzero], limit - 1)[:limit]]
+    # при равенстве значений — по возрастанию id товара
+    return nonzero[np.lexsort((nonzero, -values[nonzero]))]
+
+
+def to_rubles(kopecks):
+    return (Decimal(int(round(kopecks))) / 100).quantize(Decimal('0.01'))
+
+
+def product_analytics(start_date=None, end_date=None, window=30, top=20, chunks=None):
+    """Считает рейтинги товаров, скорость продаж и долю возвратов.
+
+    chunks — источник порций колонок; по умолчанию колоночный снимок
+    (store.facts) и позиции, добавленные после него.
+    """
+    from .facts import iter_fact_chunks, open_facts
+
+    end_date = end_date or date.today()
+    if not start_date:
+        facts = open_facts()
+        if facts is not None and len(facts['date']):
+            start_date = date.fromordinal(int(facts['date'].min()))
+        else:
+            start_date = DocumentItem.objects.aggregate(first=Min('document__date'))['first'] or end_date
+    # конец периода раньше первой продажи: период из одного дня end_date, без продаж
+    start_date = min(start_date, end_date)
+    window = max(1, min(window, (end_date - start_date).days + 1))
+
+    accumulator = ProductSalesAccumulator(start_date, end_date, window)
+    if chunks is None:
+        chunks = iter_fact_chunks(start_date, end_date)
+    for columns in chunks:
+        accumulator.add(columns)
+
+    acc = accumulator
+    velocity = acc.recent_units / window
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return_rate = np.where(acc.units > 0, acc.returned_units / acc.units, 0.0)
+
+    by_revenue = top_indices(acc.revenue, top)
+    by_units = top_indices(acc.units, top)
+    by_velocity = top_indices(velocity, top)
+    by_returns = top_indices(np.where(acc.returned_units > 0, return_rate, 0.0), top)
+
+    product_ids = set(np.concatenate([by_revenue, by_units, by_velocity, by_returns]).tolist())
+    names = dict(Product.objects.filter(pk__in=product_ids).values_list('id', 'name'))
+
+    def product_row(index):
+        return {
+            'product_id': int(index),
+            'name': names.get(int(index), ''),
+            'units': int(acc.units[index]),
+            'revenue': to_rubles(acc.revenue[index]),
+            'returned_units': int(acc.returned_units[index]),
+            'return_rate': round(float(return_rate[index]), 4),
+            'velocity': round(float(velocity[index]), 3),
+        }
+
+    net = acc.daily_revenue - acc.daily_returns
+    trend = moving_average(net, window)
+    daily = [
+        {
+            'date': start_date + timedelta(days=offset),
+            'revenue': to_rubles(acc.daily_revenue[offset]),
+            'returns': to_rubles(acc.daily_returns[offset]),
+            'moving_average': to_rubles(trend[offset]),
+        }
+        for offset in range(acc.days)
+    ]
+
+    return {
+        'start_date': start_date,
+        'end_date': end_date,
+        'window': window,
+        'top_by_revenue': [product_row(i) for i in by_revenue],
+        'top_by_units': [product_row(i) for i in by_units],
+        'top_by_velocity': [product_row(i) for i in by_velocity],
+        'top_by_return_rate': [product_row(i) for i in by_returns],
+        'daily': daily,
+    }
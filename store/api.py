@@ -0,0 +1,170 @@
+"""JSON API только для чтения: документы, счета, покупатели, товары.
+
+Списки отдаются страницами по курсору (id последней записи страницы),
+поэтому стоимость страницы не зависит от ее глубины. Параметр fields
+ограничивает колонки выборки (.only()), позиции документов и счетов
+подгружаются одним prefetch-запросом на страницу.
+"""
+import base64
+from dataclasses import dataclass, field
+from datetime import date, datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from .models import Customer, DocumentItem, Invoice, InvoiceItem, Product, SaleDocument
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+ITEM_FIELDS = ('id', 'product_id', 'quantity', 'price')
+
+
+@dataclass
+class Resource:
+    model: type
+    fields: tuple
+    # параметр запроса -> (lookup, преобразование значения); только индексированные поля
+    filters: dict = field(default_factory=dict)
+    item_model: type = None
+    item_fk: str = ''
+
+
+def _date(value):
+    return date.fromisoformat(value)
+
+
+def _datetime(value):
+    value = datetime.fromisoformat(value)
+    return timezone.make_aware(value) if timezone.is_naive(value) else value
+
+
+def _bool(value):
+    if value.lower() not in ('1', '0', 'true', 'false'):
+        raise ValueError(value)
+    return value.lower() in ('1', 'true')
+
+
+RESOURCES = {
+    'documents': Resource(
+        model=SaleDocument,
+        fields=('id', 'type', 'number', 'date', 'total', 'customer_id', 'invoice_id',
+                'original_sale_id', 'register_id', 'shift_id', 'created_at'),
+        filters={
+            'type': ('type', str),
+            'customer': ('customer_id', int),
+            'number': ('number', str),
+            'date': ('date', _date),
+            'date_from': ('date__gte', _date),
+            'date_to': ('date__lte', _date),
+            'register': ('register_id', int),
+            'shift': ('shift_id', int),
+        },
+        item_model=DocumentItem,
+        item_fk='document_id',
+    ),
+    'invoices': Resource(
+        model=Invoice,
+        fields=('id', 'number', 'date', 'customer_id', 'is_paid', 'total', 'created_at'),
+        filters={
+            'customer': ('customer_id', int),
+            'number': ('number', str),
+            'is_paid': ('is_paid', _bool),
+            'date': ('date', _date),
+            'date_from': ('date__gte', _date),
+            'date_to': ('date__lte', _date),
+        },
+        item_model=InvoiceItem,
+        item_fk='invoice_id',
+    ),
+    'customers': Resource(
+        model=Customer,
+        fields=('id', 'name', 'is_company', 'contact', 'created_at'),
+        filters={
+            'name': ('name', str),
+            'is_company': ('is_company', _bool),
+        },
+    ),
+    'products': Resource(
+        model=Product,
+        fields=('id', 'name', 'price', 'quantity', 'reserved', 'updated_at'),
+        filters={
+            'updated_since': ('updated_at__gte', _datetime),
+        },
+    ),
+}
+
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    return int(base64.urlsafe_b64decode(padded.encode()).decode())
+
+
+def _selected_fields(resource, params):
+    """Колонки из параметра fields; id нужен всегда — по нему строится курсор"""
+    requested = [name for name in params.get('fields', '').split(',') if name]
+    allowed = set(resource.fields) | ({'items'} if resource.item_model else set())
+    unknown = [name for name in requested if name not in allowed]
+    if unknown:
+        raise ValidationError(f"Неизвестные поля: {', '.join(unknown)}")
+    if not requested:
+        requested = list(resource.fields) + (['items'] if resource.item_model else [])
+    columns = ['id'] + [name for name in requested if name not in ('id', 'items')]
+    return columns, 'items' in requested
+
+
+def _queryset(resource, columns, with_items):
+    qs = resource.model.objects.only(*columns).order_by('-id')
+    if with_items:
+        items = resource.item_model.objects.only(resource.item_fk, *ITEM_FIELDS).order_by('id')
+        qs = qs.prefetch_related(Prefetch('items', queryset=items))
+    return qs
+
+
+def _serialize(obj, columns, with_items):
+    data = {name: getattr(obj, name) for name in columns}
+    if with_items:
+        data['items'] = [{name: getattr(item, name) for name in ITEM_FIELDS} for item in obj.items.all()]
+    return data
+
+
+def list_objects(resource, params, path):
+    """Страница списка: {'results': [...], 'next': адрес следующей страницы или None}"""
+    columns, with_items = _selected_fields(resource, params)
+    try:
+        limit = min(max(int(params.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+        lookups = {
+            lookup: convert(params[name])
+            for name, (lookup, convert) in resource.filters.items()
+            if params.get(name)
+        }
+        if params.get('cursor'):
+            lookups['id__lt'] = decode_cursor(params['cursor'])
+    except (ValueError, UnicodeDecodeError):
+        raise ValidationError("Некорректное значение параметра")
+
+    qs = _queryset(resource, columns, with_items).filter(**lookups)
+    # лишняя запись показывает, есть ли следующая страница, без COUNT(*)
+    rows = list(qs[:limit + 1])
+    next_url = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        query = params.copy()
+        query['cursor'] = encode_cursor(rows[-1].id)
+        next_url = f"{path}?{query.urlencode()}"
+    return {
+        'results': [_serialize(obj, columns, with_items) for obj in rows],
+        'next': next_url,
+    }
+
+
+def get_object(resource, params, pk):
+    columns, with_items = _selected_fields(resource, params)
+    obj = _queryset(resource, columns, with_items).filter(pk=pk).first()
+    return obj and _serialize(obj, columns, with_items)
+
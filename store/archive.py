@@ -0,0 +1,197 @@
+"""Архив закрытых периодов.
+
+Команда close_period переносит документы продаж и их позиции старше
+даты закрытия в базу 'archive' (см. store.routers), пересчитывает
+дневные итоги архива и сохраняет снимок остатков. Журнал, отчет по
+продажам и панель обращаются к архиву, только если запрошенный период
+начинается раньше границы архива.
+"""
+from functools import partial
+
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Count, Exists, Max, OuterRef, Sum
+
+from .cache import bump_data_version
+from .models import (
+    ArchivedDailySales, ArchivedDocumentItem, ArchivedSaleDocument, ArchivePeriod,
+    DocumentItem, Product, SaleDocument, StockSnapshot,
+)
+from .routers import ARCHIVE_DB
+
+BATCH_SIZE = 500
+
+DOCUMENT_FIELDS = (
+    'id', 'type', 'number', 'date', 'total', 'customer_id', 'invoice_id', 'original_sale_id',
+    'cash_register', 'register_id', 'shift_id', 'reason', 'created_at',
+)
+
+
+def archive_boundary():
+    """Дата, до которой документы перенесены в архив, или None"""
+    try:
+        return ArchivePeriod.objects.aggregate(boundary=Max('cutoff'))['boundary']
+    except DatabaseError:
+        # архивная база еще не создана (migrate --database=archive)
+        return None
+
+
+def reaches_archive(start_date):
+    """Попадает ли период, начинающийся с start_date (None — с начала), в архив"""
+    boundary = archive_boundary()
+    return boundary is not None and (start_date is None or start_date < boundary)
+
+
+def archived_total(types, start_date=None, end_date=None):
+    """Сумма архивных документов типов types за период по дневным итогам"""
+    if not reaches_archive(start_date):
+        return 0
+    rows = ArchivedDailySales.objects.filter(type__in=types)
+    if start_date:
+        rows = rows.filter(date__gte=start_date)
+    if end_date:
+        rows = rows.filter(date__lte=end_date)
+    return rows.aggregate(total=Sum('total'))['total'] or 0
+
+
+def close_period(cutoff, batch_size=BATCH_SIZE):
+    """Переносит в архив документы с датой раньше cutoff.
+
+    Продажа переносится вместе со своими возвратами; продажи, возврат
+    по которым оформлен после cutoff, остаются в оперативной базе.
+    Каждая пачка сначала записывается в архив, затем удаляется из
+    оперативной базы, поэтому прерванный перенос можно запустить снова.
+    Возвращает (документов, позиций).
+    """
+    snapshot_stock(cutoff)
+
+    late_returns = SaleDocument.objects.filter(original_sale=OuterRef('pk'), date__gte=cutoff)
+    candidates = SaleDocument.objects.filter(date__lt=cutoff).exclude(type='return').exclude(
+        Exists(late_returns)
+    ).order_by('id')
+
+    documents = items = 0
+    last_id = 0
+    while True:
+        sale_ids = list(candidates.filter(id__gt=last_id).values_list('id', flat=True)[:batch_size])
+        if not sale_ids:
+            break
+        last_id = sale_ids[-1]
+        return_ids = list(SaleDocument.objects.filter(original_sale_id__in=sale_ids).values_list('id', flat=True))
+        moved_documents, moved_items = _archive_documents(sale_ids + return_ids)
+        documents += moved_documents
+        items += moved_items
+
+    period, _ = ArchivePeriod.objects.get_or_create(cutoff=cutoff)
+    ArchivePeriod.objects.filter(pk=period.pk).update(
+        documents=period.documents + documents,
+        items=period.items + items,
+    )
+    return documents, items
+
+
+def _archive_documents(document_ids):
+    documents = list(
+        SaleDocument.objects.filter(pk__in=document_ids).values(*DOCUMENT_FIELDS, 'customer__name')
+    )
+    items = list(
+        DocumentItem.objects.filter(document_id__in=document_ids).values(
+            'id', 'document_id', 'product_id', 'product__name', 'quantity', 'price'
+        )
+    )
+
+    with transaction.atomic(using=ARCHIVE_DB):
+        ArchivedSaleDocument.objects.bulk_create(
+            [
+                ArchivedSaleDocument(
+                    customer_name=row['customer__name'],
+                    **{name: row[name] for name in DOCUMENT_FIELDS}
+                )
+                for row in documents
+            ],
+            ignore_conflicts=True,
+        )
+        ArchivedDocumentItem.objects.bulk_create(
+            [
+                ArchivedDocumentItem(
+                    id=row['id'],
+                    document_id=row['document_id'],
+                    product_id=row['product_id'],
+                    product_name=row['product__name'],
+                    quantity=row['quantity'],
+                    price=row['price'],
+                )
+                for row in items
+            ],
+            ignore_conflicts=True,
+        )
+        refresh_daily_sales({row['date'] for row in documents})
+
+    with transaction.atomic():
+        # удаление без загрузки объектов: сигналы и каскады здесь не нужны
+        _delete_rows(DocumentItem, 'document_id', document_ids)
+        _delete_rows(SaleDocument, 'id', document_ids)
+        transaction.on_commit(partial(bump_data_version, 'sales'))
+    return len(documents), len(items)
+
+
+def _delete_rows(model, column, ids):
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM "{model._meta.db_table}" WHERE "{column}" IN ({placeholders})', ids)
+
+
+def refresh_daily_sales(dates):
+    """Пересчитывает дневные итоги архива за даты dates"""
+    rows = ArchivedSaleDocument.objects.filter(date__in=dates).order_by().values('date', 'type').annotate(
+        documents=Count('id'), total=Sum('total')
+    )
+    ArchivedDailySales.objects.bulk_create(
+        [ArchivedDailySales(**row) for row in rows],
+        update_conflicts=True,
+        unique_fields=['date', 'type'],
+        update_fields=['documents', 'total'],
+    )
+
+
+def snapshot_stock(cutoff):
+    """Сохраняет остатки всех товаров на момент закрытия периода"""
+    snapshots = [
+        StockSnapshot(cutoff=cutoff, product_id=pk, product_name=name, quantity=quantity, reserved=reserved)
+        for pk, name, quantity, reserved in Product.objects.values_list('id', 'name', 'quantity', 'reserved')
+    ]
+    StockSnapshot.objects.bulk_create(
+        snapshots,
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['cutoff', 'product_id'],
+        update_fields=['product_name', 'quantity', 'reserved', 'taken_at'],
+    )
+    return len(snapshots)
+
+
+class MergedResults:
+    """Объединение упорядоченных выборок из разных баз для Paginator.
+
+    key — ключ сортировки строк (как в ORDER BY выборок). Для страницы
+    из каждой выборки читается не больше stop строк.
+    """
+
+    def __init__(self, querysets, key):
+        self.querysets = querysets
+        self.key = key
+
+    def count(self):
+        return sum(qs.count() for qs in self.querysets)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+        rows = []
+        for qs in self.querysets:
+            rows.extend(qs[:stop] if stop is not None else qs)
+        rows.sort(key=self.key)
+        return rows[start:stop]
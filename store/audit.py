@@ -0,0 +1,247 @@
+"""Журнал изменений документов, счетов и товаров.
+
+Сигналы (store.signals) сравнивают поля объекта с их значениями при
+загрузке и после фиксации транзакции кладут записи AuditEntry в
+очередь процесса. Загрузка объекта ничего не считает: LoadedValuesMixin
+запоминает строку, а поля журнала выбираются из нее только при
+сохранении. Позиции, удаленные каскадом с документом или счетом,
+записываются одним запросом (record_cascade). Фоновый поток забирает
+записи из очереди и пишет их пачками bulk_create, поэтому сохранение
+документа не ждет записи журнала. При STORE_AUDIT_ASYNC = False записи пишутся сразу (команды,
+отладка); при завершении процесса очередь дописывается (atexit).
+
+Пачка, которую не удалось записать, потому что база занята долгой
+транзакцией (SQLite: database is locked), не теряется: она остается
+первой в очереди и записывается, когда база освободится, — но не больше
+WRITE_RETRIES попыток. Пачки с другими ошибками записи (и так и не
+записанные) отбрасываются с сообщением в лог, чтобы не останавливать
+журнал.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from functools import cache, partial
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
+
+from .models import AuditEntry, DocumentItem, Invoice, InvoiceItem, Product, SaleDocument
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 1.0
+# попытки дописать очередь при завершении процесса, пока база занята
+EXIT_RETRIES = 10
+# попытки записать одну пачку, пока база занята
+WRITE_RETRIES = 30
+
+# служебные поля, изменения которых не записываются
+SKIP_FIELDS = {'id', 'created_at', 'updated_at', 'version', 'cache_version'}
+
+# модель -> поля журнала (None — все, кроме служебных)
+AUDITED_MODELS = {
+    SaleDocument: None,
+    DocumentItem: None,
+    Invoice: None,
+    InvoiceItem: None,
+    Product: ('price', 'quantity'),
+}
+
+# пользователь текущего запроса (см. AuditUserMiddleware)
+current_user = ContextVar('audit_user', default='')
+
+_queue = queue.SimpleQueue()
+# (пачка, число неудачных попыток), не записанные из-за занятой базы;
+# пишутся раньше новых записей
+_postponed = deque()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+@cache
+def audited_fields(model):
+    fields = AUDITED_MODELS[model]
+    if fields is None:
+        fields = [field.attname for field in model._meta.concrete_fields if field.attname not in SKIP_FIELDS]
+    return tuple(fields)
+
+
+def snapshot(instance):
+    """Значения полей журнала; отложенные (.only()) поля пропускаются"""
+    values = instance.__dict__
+    return {name: values[name] for name in audited_fields(type(instance)) if name in values}
+
+
+def loaded_snapshot(instance):
+    """Значения полей журнала в строке, из которой объект загружен"""
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded is None:
+        return {}
+    fields = audited_fields(type(instance))
+    return {name: value for name, value in zip(*loaded) if name in fields}
+
+
+def record(model, object_id, action, changes):
+    """Ставит запись в очередь после фиксации текущей транзакции"""
+    if changes:
+        record_many(model, action, {object_id: changes})
+
+
+def record_many(model, action, changes):
+    """Записи {id объекта: изменения} одной операции — один обработчик on_commit на все"""
+    user, created_at = current_user.get(), timezone.now()
+    entries = [
+        AuditEntry(
+            model=model._meta.model_name,
+            object_id=object_id,
+            action=action,
+            changes=object_changes,
+            user=user,
+            created_at=created_at,
+        )
+        for object_id, object_changes in changes.items()
+    ]
+    if entries:
+        transaction.on_commit(partial(_enqueue, entries))
+
+
+def record_save(instance, created):
+    current = snapshot(instance)
+    if created:
+        record(type(instance), instance.pk, 'create', current)
+    else:
+        # после первого сохранения сравниваем с сохраненным состоянием, до него — с загруженным
+        previous = instance.__dict__.get('_audit_state')
+        if previous is None:
+            previous = loaded_snapshot(instance)
+        changes = {
+            name: [previous[name], value]
+            for name, value in current.items()
+            if name in previous and previous[name] != value
+        }
+        record(type(instance), instance.pk, 'update', changes)
+    instance._audit_state = current
+
+
+def record_delete(instance):
+    record(type(instance), instance.pk, 'delete', snapshot(instance))
+
+
+def record_cascade(model, rows):
+    """Удаление каскадом строк rows (queryset модели model) без загрузки объектов"""
+    fields = audited_fields(model)
+    record_many(model, 'delete', {row.pop('id'): row for row in rows.values('id', *fields)})
+
+
+def record_stock(deltas):
+    """Изменения остатков {id товара: изменение}, записанные UPDATE без save()"""
+    record_many(Product, 'stock', {product_id: {'quantity': delta} for product_id, delta in deltas.items()})
+
+
+def record_prices(changes):
+    """Переоценка {id товара: (старая цена, новая)}, записанная UPDATE без save()"""
+    record_many(Product, 'update', {product_id: {'price': [old, new]} for product_id, (old, new) in changes.items()})
+
+
+def _enqueue(entries):
+    if not settings.STORE_AUDIT_ASYNC:
+        AuditEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE)
+        return
+    _start_worker()
+    for entry in entries:
+        _queue.put(entry)
+
+
+def _start_worker():
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run_worker, name='audit-writer', daemon=True)
+            _worker.start()
+
+
+def _take_batch(timeout):
+    """Следующая пачка и число прошлых неудачных попыток ее записать"""
+    if _postponed:
+        return _postponed.popleft()
+    batch = [_queue.get(timeout=timeout)]
+    while len(batch) < BATCH_SIZE:
+        try:
+            batch.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch, 0
+
+
+def _is_busy(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def _write(batch, failures=0):
+    """Записывает пачку; False — база занята, пачка отложена до следующей попытки"""
+    try:
+        AuditEntry.objects.bulk_create(batch)
+    except OperationalError as error:
+        if not _is_busy(error):
+            logger.exception("Не удалось записать %d записей журнала изменений", len(batch))
+            return True
+        if failures + 1 >= WRITE_RETRIES:
+            logger.error(
+                "База занята, %d записей журнала изменений отброшены после %d попыток", len(batch), failures + 1
+            )
+            return True
+        _postponed.appendleft((batch, failures + 1))
+        logger.warning("База занята, %d записей журнала изменений отложены", len(batch))
+        return False
+    except Exception:
+        # ошибка в самих записях: повтор ее не исправит
+        logger.exception("Не удалось записать %d записей журнала изменений", len(batch))
+    return True
+
+
+def _run_worker():
+    try:
+        while True:
+            try:
+                batch, failures = _take_batch(FLUSH_INTERVAL)
+            except queue.Empty:
+                continue
+            if not _write(batch, failures):
+                time.sleep(FLUSH_INTERVAL)
+    finally:
+        connection.close()
+
+
+def flush(retries=EXIT_RETRIES):
+    """Дописывает очередь в текущем потоке; возвращает число записей.
+
+    Пока база занята, запись повторяется не больше retries раз; то, что
+    записать не удалось, остается в очереди.
+    """
+    written = 0
+    failures = 0
+    while True:
+        try:
+            batch, batch_failures = _take_batch(0)
+        except queue.Empty:
+            return written
+        if _write(batch, batch_failures):
+            written += len(batch)
+            continue
+        failures += 1
+        if failures >= retries:
+            logger.error("Журнал изменений не дописан: %d пачек ждут записи", len(_postponed))
+            return written
+        time.sleep(FLUSH_INTERVAL)
+
+
+atexit.register(flush)
@@ -0,0 +1,75 @@
+"""Кэш фрагментов шаблонов с версиями данных.
+
+Ключ фрагмента включает версии групп данных, от которых он зависит
+(например, 'sales' — документы продаж и их позиции). Сигналы
+post_save/post_delete (store.signals) и групповые операции увеличивают
+версию группы, после чего все зависящие от нее фрагменты строятся
+заново; старые записи вытесняются по сроку хранения.
+
+Версии хранятся в том же кэше, что и фрагменты, поэтому он должен быть
+общим для всех процессов сервера (STORE_FRAGMENT_CACHE_BACKEND = 'file'):
+версию, увеличенную в одном воркере, остальные увидят только так.
+"""
+import hashlib
+import logging
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'store:data_version:{}'
+# как часто писать в лог долю попаданий по фрагменту
+LOG_EVERY = 100
+
+_lookups = Counter()
+_hits = Counter()
+
+
+def fragment_cache():
+    return caches[settings.STORE_FRAGMENT_CACHE]
+
+
+def data_version(groups):
+    """Строка текущих версий групп данных"""
+    cache = fragment_cache()
+    keys = [VERSION_KEY.format(group) for group in groups]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # отметка времени вместо 0: пережившие сброс версии фрагменты не подойдут
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return '.'.join(str(versions[key]) for key in keys)
+
+
+def bump_data_version(*groups):
+    cache = fragment_cache()
+    for group in groups:
+        key = VERSION_KEY.format(group)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def fragment_key(name, groups, vary_on):
+    vary = hashlib.md5(':'.join(str(value) for value in vary_on).encode()).hexdigest()
+    return f"store:fragment:{name}:{data_version(groups)}:{vary}"
+
+
+def record_lookup(name, hit):
+    _lookups[name] += 1
+    _hits[name] += hit
+    logger.debug("Фрагмент %s: %s", name, "попадание" if hit else "промах")
+    if _lookups[name] % LOG_EVERY == 0:
+        logger.info(
+            "Фрагмент %s: попаданий %.1f%% (%d из %d)",
+            name, 100 * _hits[name] / _lookups[name], _hits[name], _lookups[name]
+        )
+
+
+def hit_rates():
+    return {name: _hits[name] / count for name, count in _lookups.items()}
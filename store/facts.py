@@ -0,0 +1,196 @@
+"""Колоночный снимок фактов продаж для аналитики.
+
+Каждая позиция документа — строка из колонок (id позиции, дата, тип,
+товар, покупатель, количество, цена в копейках). Колонки хранятся в
+отдельных двоичных файлах каталога settings.STORE_FACTS_DIR, в
+meta.json записаны число строк и id последней выгруженной позиции.
+Команда export_facts дописывает позиции с id больше отметки;
+аналитика открывает файлы через np.memmap без копирования в память.
+
+Снимок только дополняется: после удаления или изменения старых
+документов его нужно пересобрать (export_facts --full).
+"""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from .analytics import CHUNK_SIZE, TYPE_CODES, iter_item_chunks
+from .archive import archive_boundary
+from .models import ArchivedDocumentItem, DocumentItem
+
+COLUMNS = {
+    'id': np.int64,
+    'date': np.int32,  # date.toordinal()
+    'type': np.int8,  # analytics.TYPE_CODES
+    'product_id': np.int64,
+    'customer_id': np.int64,
+    'qty': np.int64,
+    'price': np.int64,  # копейки
+}
+
+ITEM_FIELDS = (
+    'id', 'document__date', 'document__type', 'product_id', 'document__customer_id', 'quantity', 'price'
+)
+
+META_FILE = 'meta.json'
+
+
+def facts_dir():
+    return Path(settings.STORE_FACTS_DIR)
+
+
+def _column_path(directory, name):
+    return directory / f'{name}.bin'
+
+
+def read_meta(directory=None):
+    """Описание снимка {'count', 'last_id'} или None, если снимка нет"""
+    path = (directory or facts_dir()) / META_FILE
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_meta(directory, count, last_id):
+    # meta.json заменяется целиком, поэтому читатель видит либо старое,
+    # либо новое число строк, но не промежуточное
+    tmp = directory / (META_FILE + '.tmp')
+    with open(tmp, 'w') as file:
+        json.dump({'count': count, 'last_id': last_id}, file)
+    os.replace(tmp, directory / META_FILE)
+
+
+def _rows_to_columns(rows):
+    count = len(rows)
+    ids, dates, types, product_ids, customer_ids, quantities, prices = zip(*rows)
+    return {
+        'id': np.fromiter(ids, dtype=COLUMNS['id'], count=count),
+        'date': np.fromiter((d.toordinal() for d in dates), dtype=COLUMNS['date'], count=count),
+        'type': np.fromiter((TYPE_CODES[t] for t in types), dtype=COLUMNS['type'], count=count),
+        'product_id': np.fromiter(product_ids, dtype=COLUMNS['product_id'], count=count),
+        'customer_id': np.fromiter(customer_ids, dtype=COLUMNS['customer_id'], count=count),
+        'qty': np.fromiter(quantities, dtype=COLUMNS['qty'], count=count),
+        'price': np.fromiter((int(p * 100) for p in prices), dtype=COLUMNS['price'], count=count),
+    }
+
+
+def _iter_rows(model, after_id, chunk_size):
+    last_id = after_id
+    while True:
+        rows = list(
+            model.objects.filter(id__gt=last_id).order_by('id').values_list(*ITEM_FIELDS)[:chunk_size]
+        )
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield _rows_to_columns(rows)
+
+
+def _append(directory, columns, count):
+    for name, dtype in COLUMNS.items():
+        with open(_column_path(directory, name), 'ab') as file:
+            columns[name].astype(dtype, copy=False).tofile(file)
+    return count + len(columns['id'])
+
+
+def export_facts(full=False, chunk_size=CHUNK_SIZE):
+    """Дописывает в снимок новые позиции; возвращает (добавлено, всего строк).
+
+    full — пересобрать снимок с начала истории, включая архив закрытых
+    периодов. Новые файлы пишутся рядом и подменяют старые целиком, так
+    что уже открытые memmap продолжают читать прежние данные.
+    """
+    directory = facts_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    meta = None if full else read_meta(directory)
+    count, last_id = (meta['count'], meta['last_id']) if meta else (0, 0)
+
+    if meta:
+        # хвост от прерванной выгрузки, не попавший в meta.json
+        for name, dtype in COLUMNS.items():
+            with open(_column_path(directory, name), 'r+b') as file:
+                file.truncate(count * np.dtype(dtype).itemsize)
+        target = directory
+    else:
+        target = directory / 'new'
+        target.mkdir(exist_ok=True)
+        for name in COLUMNS:
+            _column_path(target, name).write_bytes(b'')
+
+    sources = [DocumentItem]
+    if not meta and archive_boundary():
+        # id позиций сохраняются при переносе в архив, поэтому отметка общая
+        sources.insert(0, ArchivedDocumentItem)
+
+    added = 0
+    after_id = last_id
+    for model in sources:
+        for columns in _iter_rows(model, after_id, chunk_size):
+            count = _append(target, columns, count)
+            added += len(columns['id'])
+            last_id = max(last_id, int(columns['id'][-1]))
+            if meta:
+                _write_meta(directory, count, last_id)
+
+    if not meta:
+        for name in COLUMNS:
+            os.replace(_column_path(target, name), _column_path(directory, name))
+        target.rmdir()
+        _write_meta(directory, count, last_id)
+    return added, count
+
+
+def open_facts(directory=None):
+    """Колонки снимка как np.memmap только для чтения или None, если снимка нет"""
+    directory = directory or facts_dir()
+    meta = read_meta(directory)
+    if not meta:
+        return None
+    columns = {}
+    for name, dtype in COLUMNS.items():
+        path = _column_path(directory, name)
+        if meta['count'] == 0:
+            columns[name] = np.zeros(0, dtype=dtype)
+            continue
+        try:
+            columns[name] = np.memmap(path, dtype=dtype, mode='r', shape=(meta['count'],))
+        except (FileNotFoundError, ValueError):
+            # файлы подменяются пересборкой — читаем из базы
+            return None
+    return columns
+
+
+def iter_fact_chunks(start_date=None, end_date=None, chunk_size=CHUNK_SIZE):
+    """Порции колонок для analytics: снимок плюс позиции, добавленные после него.
+
+    Порции снимка — срезы memmap без копирования (при фильтре по датам
+    копируются только подходящие строки порции). Без снимка позиции
+    читаются из базы, как в analytics.iter_item_chunks.
+    """
+    facts = open_facts()
+    if facts is None:
+        yield from iter_item_chunks(start_date, end_date, chunk_size)
+        return
+
+    start = start_date.toordinal() if start_date else None
+    end = end_date.toordinal() if end_date else None
+    total = len(facts['id'])
+    for offset in range(0, total, chunk_size):
+        chunk = {name: column[offset:offset + chunk_size] for name, column in facts.items()}
+        if start is not None or end is not None:
+            mask = np.ones(len(chunk['id']), dtype=bool)
+            if start is not None:
+                mask &= chunk['date'] >= start
+            if end is not None:
+                mask &= chunk['date'] <= end
+            if not mask.all():
+                chunk = {name: column[mask] for name, column in chunk.items()}
+        yield chunk
+
+    last_id = int(facts['id'].max()) if total else 0
+    yield from iter_item_chunks(start_date, end_date, chunk_size, after_id=last_id)
@@ -0,0 +1,209 @@
+"""Прогноз исчерпания остатков и рекомендации по дозаказу.
+
+Ночной пересчет (manage.py update_stock_forecast) состоит из трех шагов:
+новые позиции документов (по id после отметки) добавляются в дневные
+продажи ProductDailySales; дни окна прогноза (LONG_WINDOW) пересобираются
+заново по текущим документам и архиву, чтобы в прогноз попали измененные
+и удаленные позиции и документы; по этим дням считаются скользящие
+средние и результат записывается в StockForecast. Дни раньше окна
+исправляет только полная пересборка (--full).
+"""
+import math
+from collections import defaultdict
+from datetime import date, timedelta
+
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import Case, F, Sum, When
+from django.utils import timezone
+
+from .analytics import RETURN_CODE, iter_item_chunks
+from .archive import archive_boundary
+from .models import (
+    ArchivedDocumentItem, DocumentItem, Product, ProductDailySales, SaleDocument, StockForecast, Watermark,
+)
+
+WATERMARK = 'product_daily_sales'
+
+SHORT_WINDOW = 7
+LONG_WINDOW = 28
+LEAD_DAYS = 7
+COVER_DAYS = 14
+
+BATCH_SIZE = 1000
+CHUNK_SIZE = 10_000
+MAX_DAYS = 3650
+
+
+def update_daily_sales(full=False, today=None):
+    """Добавляет в дневные продажи позиции, появившиеся после прошлого запуска,
+    и пересобирает дни окна прогноза; возвращает число обработанных позиций"""
+    if full:
+        with transaction.atomic():
+            ProductDailySales.objects.all().delete()
+            Watermark.set(WATERMARK, 0)
+            # позиции закрытых периодов в оперативной базе уже удалены
+            if archive_boundary():
+                _add_archived_sales()
+
+    processed = 0
+    chunks = iter_item_chunks(chunk_size=CHUNK_SIZE, after_id=Watermark.get(WATERMARK))
+    for columns in chunks:
+        sign = np.where(columns['type'] == RETURN_CODE, -1, 1)
+        keys = np.stack([columns['product_id'], columns['date'].astype(np.int64)], axis=1)
+        unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+        sums = np.bincount(inverse.ravel(), weights=columns['qty'] * sign, minlength=len(unique_keys))
+
+        increments = {
+            (int(product_id), date.fromordinal(int(day))): int(quantity)
+            for (product_id, day), quantity in zip(unique_keys, sums)
+        }
+
+        with transaction.atomic():
+            _add_daily_sales(increments)
+            Watermark.set(WATERMARK, int(columns['id'][-1]))
+        processed += len(columns['id'])
+
+    refresh_recent_days(today=today)
+    return processed
+
+
+def refresh_recent_days(days=LONG_WINDOW, today=None):
+    """Пересобирает дневные продажи за последние days дней по текущим документам.
+
+    Строки окна удаляются и записываются заново одним INSERT ... SELECT по
+    позициям (плюс архив, если граница архива попадает в окно), поэтому
+    правки и удаления позиций и документов не копятся в прогнозе.
+    """
+    first_day = (today or timezone.localdate()) - timedelta(days=days)
+    qn = connection.ops.quote_name
+    sql = f"""
+        INSERT INTO {qn(ProductDailySales._meta.db_table)} ("product_id", "date", "quantity")
+        SELECT i."product_id", d."date",
+               SUM(CASE WHEN d."type" = 'return' THEN -i."quantity" ELSE i."quantity" END)
+        FROM {qn(DocumentItem._meta.db_table)} i
+        JOIN {qn(SaleDocument._meta.db_table)} d ON d."id" = i."document_id"
+        WHERE d."date" >= %s
+        GROUP BY i."product_id", d."date"
+    """
+    with transaction.atomic():
+        ProductDailySales.objects.filter(date__gte=first_day).delete()
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [connection.ops.adapt_datefield_value(first_day)])
+        boundary = archive_boundary()
+        if boundary and boundary > first_day:
+            _add_archived_sales(first_day)
+
+
+def _add_archived_sales(start_date=None):
+    """Прибавляет к дневным продажам позиции архива (с даты start_date)"""
+    rows = ArchivedDocumentItem.objects.all()
+    if start_date:
+        rows = rows.filter(document__date__gte=start_date)
+    rows = rows.values('product_id', day=F('document__date')).annotate(
+        sold=Sum(Case(When(document__type='return', then=-F('quantity')), default=F('quantity')))
+    ).order_by()
+
+    increments = {}
+    for row in rows.iterator(chunk_size=CHUNK_SIZE):
+        increments[(row['product_id'], row['day'])] = row['sold']
+        if len(increments) >= CHUNK_SIZE:
+            _add_existing_products(increments)
+            increments = {}
+    if increments:
+        _add_existing_products(increments)
+
+
+def _add_existing_products(increments):
+    # товары архивных документов могли быть удалены
+    existing = set(Product.objects.filter(
+        pk__in={product_id for product_id, _ in increments}
+    ).values_list('id', flat=True))
+    increments = {key: quantity for key, quantity in increments.items() if key[0] in existing}
+    if increments:
+        _add_daily_sales(increments)
+
+
+def _add_daily_sales(increments):
+    existing = defaultdict(int)
+    product_ids = {product_id for product_id, _ in increments}
+    dates = {day for _, day in increments}
+    rows = ProductDailySales.objects.filter(
+        product_id__in=product_ids, date__range=(min(dates), max(dates))
+    ).values_list('product_id', 'date', 'quantity')
+    for product_id, day, quantity in rows:
+        existing[(product_id, day)] = quantity
+
+    ProductDailySales.objects.bulk_create(
+        [
+            ProductDailySales(product_id=product_id, date=day, quantity=existing[(product_id, day)] + quantity)
+            for (product_id, day), quantity in increments.items()
+        ],
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['product', 'date'],
+        update_fields=['quantity'],
+    )
+
+
+def compute_forecast(today=None):
+    """Пересчитывает прогноз для всего каталога по дневным продажам"""
+    today = today or timezone.localdate()
+    first_day = today - timedelta(days=LONG_WINDOW)
+
+    # на продажу доступен остаток без резервов счетов, у комплекта — собираемое количество
+    available = Product.objects.annotate(available=Case(
+        When(kit_available__isnull=False, then=F('kit_available')),
+        default=F('quantity') - F('reserved'),
+    )).values_list('id', 'available')
+    catalog = np.array(list(available), dtype=np.int64).reshape(-1, 2)
+    if not len(catalog):
+        return 0
+    product_ids, quantities = catalog[:, 0], catalog[:, 1]
+    index = {product_id: position for position, product_id in enumerate(product_ids.tolist())}
+
+    # матрица товар × день за длинное окно
+    daily = np.zeros((len(product_ids), LONG_WINDOW))
+    rows = ProductDailySales.objects.filter(date__gte=first_day, date__lt=today).values_list(
+        'product_id', 'date', 'quantity'
+    )
+    for product_id, day, quantity in rows.iterator(chunk_size=BATCH_SIZE):
+        position = index.get(product_id)
+        if position is not None:
+            daily[position, (day - first_day).days] = quantity
+    daily = np.clip(daily, 0, None)
+
+    # берем большее из короткого и длинного среднего, чтобы быстрее реагировать на рост спроса
+    short_rate = daily[:, -SHORT_WINDOW:].mean(axis=1)
+    long_rate = daily.mean(axis=1)
+    rate = np.maximum(short_rate, long_rate)
+
+    stock = np.clip(quantities, 0, None).astype(float)
+    selling = rate > 0
+    days_left = np.full(len(product_ids), np.nan)
+    days_left[selling] = stock[selling] / rate[selling]
+    reorder = np.zeros(len(product_ids), dtype=np.int64)
+    reorder[selling] = np.ceil(np.clip(rate[selling] * (LEAD_DAYS + COVER_DAYS) - stock[selling], 0, None))
+
+    now = timezone.now()
+    forecasts = []
+    for position, product_id in enumerate(product_ids.tolist()):
+        left = None if math.isnan(days_left[position]) else round(float(days_left[position]), 2)
+        forecasts.append(StockForecast(
+            product_id=product_id,
+            daily_rate=round(float(rate[position]), 4),
+            days_left=left,
+            stockout_date=today + timedelta(days=int(left)) if left is not None and left < MAX_DAYS else None,
+            reorder_quantity=int(reorder[position]),
+            computed_at=now,
+        ))
+
+    with transaction.atomic():
+        StockForecast.objects.bulk_create(
+            forecasts,
+            batch_size=BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=['daily_rate', 'days_left', 'stockout_date', 'reorder_quantity', 'computed_at'],
+        )
+    return len(forecasts)
@@ -1,6 +1,53 @@
+from datetime import timedelta
+
+from urllib.parse import urlencode
+
 from django import forms
 from django.core.exceptions import ValidationError
-from .models import Customer, Product, Invoice, InvoiceItem, SaleDocument, DocumentItem, SalesReport
+from django.urls import reverse
+from .models import (
+    Customer, Product, Invoice, InvoiceItem, SaleDocument, DocumentItem, SalesReport, CashRegister
+)
+
+
+class AutocompleteSelect(forms.Widget):
+    """Выбор из большой таблицы с подсказками по мере ввода.
+
+    В разметку попадает только выбранное значение, варианты запрашиваются
+    у api/search/<resource>/ (store.search). params — постоянные параметры
+    поиска, forward — {параметр: поле формы}, значение которого
+    добавляется к запросу (например, покупатель для выбора продажи).
+    """
+    template_name = 'store/widgets/autocomplete.html'
+    choices = ()
+
+    def __init__(self, resource, params=None, forward=None, attrs=None):
+        super().__init__(attrs)
+        self.resource = resource
+        self.params = params or {}
+        self.forward = forward or {}
+
+    def format_value(self, value):
+        return '' if value is None else str(value)
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        value = context['widget']['value']
+        label = ''
+        if value:
+            # только выбранный объект, а не весь queryset поля
+            instance = self.choices.queryset.filter(pk=value).first()
+            if instance is not None:
+                label = self.choices.field.label_from_instance(instance)
+        url = reverse('api_search', args=[self.resource])
+        if self.params:
+            url += '?' + urlencode(self.params)
+        context['widget'].update({
+            'label': label,
+            'url': url,
+            'forward': ','.join(f'{param}:id_{field}' for param, field in self.forward.items()),
+        })
+        return context
 
 
 class CustomerForm(forms.ModelForm):
@@ -19,7 +66,7 @@ class CustomerForm(forms.ModelForm):
 class ProductForm(forms.ModelForm):
     class Meta:
         model = Product
-        fields = ['name', 'price', 'quantity']
+        fields = ['name', 'sku', 'price', 'quantity']
         widgets = {
             'name': forms.TextInput(attrs={'placeholder': 'Название товара'}),
             'price': forms.NumberInput(attrs={
@@ -39,6 +86,7 @@ class InvoiceForm(forms.ModelForm):
         model = Invoice
         fields = ['customer', 'date']
         widgets = {
+            'customer': AutocompleteSelect('customers', params={'company': '1'}),
             'date': forms.DateInput(attrs={'type': 'date'}),
         }
 
@@ -77,13 +125,24 @@ class SaleDocumentForm(forms.ModelForm):
         model = SaleDocument
         fields = ['customer', 'date']
         widgets = {
+            'customer': AutocompleteSelect('customers'),
             'date': forms.DateInput(attrs={'type': 'date'}),
         }
 
     def __init__(self, *args, **kwargs):
         self.doc_type = kwargs.pop('doc_type', None)
+        with_register = kwargs.pop('with_register', False)
         super().__init__(*args, **kwargs)
 
+        # Касса чека или возврата: смена (и номер товарного чека) берутся от нее;
+        # возврат без кассы получает кассу оригинальной продажи (SaleDocument.save)
+        if with_register:
+            self.fields['register'] = forms.ModelChoiceField(
+                queryset=CashRegister.objects.filter(is_active=True),
+                label="Касса",
+                required=False
+            )
+
         # Устанавливаем тип документа
         if self.doc_type:
             self.instance.type = self.doc_type
@@ -93,7 +152,8 @@ class SaleDocumentForm(forms.ModelForm):
             self.fields['invoice'] = forms.ModelChoiceField(
                 queryset=Invoice.objects.filter(is_paid=True),
                 label="Счет на оплату",
-                required=True
+                required=True,
+                widget=AutocompleteSelect('invoices', params={'paid': '1'}, forward={'customer': 'customer'})
             )
         elif self.doc_type == 'cash':
             self.fields['cash_register'] = forms.CharField(
@@ -105,7 +165,10 @@ class SaleDocumentForm(forms.ModelForm):
             self.fields['original_sale'] = forms.ModelChoiceField(
                 queryset=SaleDocument.objects.filter(type__in=['cash', 'cashless']),
                 label="Оригинальная продажа",
-                required=True
+                required=True,
+                widget=AutocompleteSelect(
+                    'documents', params={'types': 'cash,cashless'}, forward={'customer': 'customer'}
+                )
             )
             self.fields['reason'] = forms.CharField(
                 widget=forms.Textarea(attrs={'rows': 3}),
@@ -132,6 +195,21 @@ class SaleDocumentForm(forms.ModelForm):
                 raise ValidationError("Покупатель должен совпадать с оригинальной продажей")
 
 
+class SaleDocumentEditForm(forms.ModelForm):
+    """Редактирование документа: связи с растущими таблицами — через поиск"""
+    class Meta:
+        model = SaleDocument
+        fields = '__all__'
+        widgets = {
+            'customer': AutocompleteSelect('customers'),
+            'invoice': AutocompleteSelect('invoices', forward={'customer': 'customer'}),
+            'original_sale': AutocompleteSelect(
+                'documents', params={'types': 'cash,cashless'}, forward={'customer': 'customer'}
+            ),
+            'shift': AutocompleteSelect('shifts', forward={'register': 'register'}),
+        }
+
+
 class DocumentItemForm(forms.ModelForm):
     class Meta:
         model = DocumentItem
@@ -172,9 +250,9 @@ class DocumentItemForm(forms.ModelForm):
 
         # Проверка доступности товара для продажи
         if document.type in ['cash', 'cashless']:
-            if quantity > product.quantity:
+            if quantity > product.available_quantity():
                 raise ValidationError(
-                    f"Недостаточно товара на складе. Доступно: {product.quantity}"
+                    f"Недостаточно товара на складе. Доступно: {product.available_quantity()}"
                 )
 
         # Проверка максимального количества для возврата
@@ -217,6 +295,150 @@ class SalesReportForm(forms.Form):
         label="Конечная дата",
         widget=forms.DateInput(attrs={'type': 'date'})
     )
+    COMPARE_CHOICES = [
+        ('', 'Без сравнения'),
+        ('previous', 'С предыдущим периодом'),
+        ('year', 'С тем же периодом год назад'),
+        ('custom', 'С другим периодом'),
+    ]
+    compare = forms.ChoiceField(
+        choices=COMPARE_CHOICES,
+        required=False,
+        label="Сравнение"
+    )
+    compare_start_date = forms.DateField(
+        required=False,
+        label="Начало периода сравнения",
+        widget=forms.DateInput(attrs={'type': 'date'})
+    )
+    compare_end_date = forms.DateField(
+        required=False,
+        label="Конец периода сравнения",
+        widget=forms.DateInput(attrs={'type': 'date'})
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_date = cleaned_data.get('start_date')
+        end_date = cleaned_data.get('end_date')
+
+        if start_date and end_date and start_date > end_date:
+            raise forms.ValidationError("Начальная дата не может быть позже конечной")
+
+        compare = cleaned_data.get('compare')
+        if compare and not (start_date and end_date):
+            raise forms.ValidationError("Для сравнения укажите начальную и конечную даты отчета")
+        if compare == 'custom':
+            compare_start = cleaned_data.get('compare_start_date')
+            compare_end = cleaned_data.get('compare_end_date')
+            if not (compare_start and compare_end):
+                raise forms.ValidationError("Укажите даты периода сравнения")
+            if compare_start > compare_end:
+                raise forms.ValidationError("Начало периода сравнения не может быть позже конца")
+
+        return cleaned_data
+
+    def comparison_period(self):
+        """Период сравнения (начало, конец) или None"""
+        data = self.cleaned_data
+        start_date, end_date = data['start_date'], data['end_date']
+        if data['compare'] == 'previous':
+            previous_end = start_date - timedelta(days=1)
+            return previous_end - (end_date - start_date), previous_end
+        if data['compare'] == 'year':
+            return year_ago(start_date), year_ago(end_date)
+        if data['compare'] == 'custom':
+            return data['compare_start_date'], data['compare_end_date']
+        return None
+
+
+def year_ago(value):
+    # 29 февраля -> 28 февраля предыдущего года
+    try:
+        return value.replace(year=value.year - 1)
+    except ValueError:
+        return value.replace(year=value.year - 1, day=28)
+
+
+class ProductAnalyticsForm(forms.Form):
+    start_date = forms.DateField(
+        required=False,
+        label="Начальная дата",
+        widget=forms.DateInput(attrs={'type': 'date'})
+    )
+    end_date = forms.DateField(
+        required=False,
+        label="Конечная дата",
+        widget=forms.DateInput(attrs={'type': 'date'})
+    )
+    window = forms.IntegerField(
+        required=False,
+        min_value=1,
+        max_value=365,
+        initial=30,
+        label="Окно, дней"
+    )
+    top = forms.IntegerField(
+        required=False,
+        min_value=1,
+        max_value=100,
+        initial=20,
+        label="Позиций в рейтинге"
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_date = cleaned_data.get('start_date')
+        end_date = cleaned_data.get('end_date')
+
+        if start_date and end_date and start_date > end_date:
+            raise forms.ValidationError("Начальная дата не может быть позже конечной")
+
+        return cleaned_data
+
+
+class PivotReportForm(forms.Form):
+    DIMENSION_CHOICES = [
+        ('month', 'Месяц'),
+        ('week', 'Неделя'),
+        ('day', 'День'),
+        ('product', 'Товар'),
+        ('customer', 'Покупатель'),
+        ('type', 'Тип документа'),
+    ]
+    MEASURE_CHOICES = [
+        ('net', 'Выручка за вычетом возвратов'),
+        ('amount', 'Сумма документов'),
+        ('quantity', 'Количество'),
+        ('lines', 'Число позиций'),
+    ]
+
+    rows = forms.ChoiceField(choices=DIMENSION_CHOICES, initial='month', label="Строки")
+    columns = forms.ChoiceField(
+        choices=[('', 'Нет')] + DIMENSION_CHOICES,
+        required=False,
+        initial='type',
+        label="Столбцы"
+    )
+    measure = forms.ChoiceField(choices=MEASURE_CHOICES, initial='net', label="Показатель")
+    start_date = forms.DateField(
+        required=False,
+        label="Начальная дата",
+        widget=forms.DateInput(attrs={'type': 'date'})
+    )
+    end_date = forms.DateField(
+        required=False,
+        label="Конечная дата",
+        widget=forms.DateInput(attrs={'type': 'date'})
+    )
+    # срезы задаются ссылками детализации
+    product = forms.IntegerField(required=False, widget=forms.HiddenInput)
+    customer = forms.IntegerField(required=False, widget=forms.HiddenInput)
+    type = forms.ChoiceField(
+        choices=[('', 'Все')] + list(SaleDocument.DOC_TYPES),
+        required=False,
+        label="Тип документа"
+    )
 
     def clean(self):
         cleaned_data = super().clean()
@@ -225,9 +447,32 @@ class SalesReportForm(forms.Form):
 
         if start_date and end_date and start_date > end_date:
             raise forms.ValidationError("Начальная дата не может быть позже конечной")
+        if cleaned_data.get('rows') and cleaned_data.get('rows') == cleaned_data.get('columns'):
+            raise forms.ValidationError("Строки и столбцы должны быть разными измерениями")
 
         return cleaned_data
 
 
+class BankStatementForm(forms.Form):
+    statement = forms.FileField(label="Банковская выписка (CSV)")
+
+
+class ProductImportForm(forms.Form):
+    file = forms.FileField(
+        label="Файл поставщика (CSV или XLSX)",
+        help_text="Колонки: артикул, наименование, цена, количество (поступление)"
+    )
+    dry_run = forms.BooleanField(label="Только проверить, ничего не записывая", required=False)
 
 
+class StocktakeForm(forms.Form):
+    file = forms.FileField(
+        label="Файл пересчета (CSV или XLSX)",
+        help_text="Колонки: артикул или id товара, фактическое количество"
+    )
+    full = forms.BooleanField(
+        label="Полная инвентаризация",
+        required=False,
+        help_text="Товары, которых нет в файле, при проведении списываются в ноль"
+    )
+    comment = forms.CharField(label="Комментарий", max_length=255, required=False)
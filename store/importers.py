@@ -0,0 +1,456 @@
+"""Загрузка внешних файлов: банковские выписки, прайс-листы и каталоги поставщиков."""
+import csv
+import io
+import re
+import zipfile
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
+from functools import partial
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import bump_data_version
+from .models import Invoice, PriceHistory, Product, prices_changed
+
+INVOICE_NUMBER_RE = re.compile(r'СЧ-\d+', re.IGNORECASE)
+
+NUMBER_COLUMNS = ('number', 'invoice', 'номер', 'счет', 'счёт')
+AMOUNT_COLUMNS = ('amount', 'sum', 'сумма')
+PURPOSE_COLUMNS = ('purpose', 'description', 'назначение', 'назначение платежа')
+PRODUCT_COLUMNS = ('id', 'product', 'product_id', 'код', 'товар')
+PRICE_COLUMNS = ('price', 'цена')
+SKU_COLUMNS = ('sku', 'артикул')
+NAME_COLUMNS = ('name', 'наименование', 'название')
+QUANTITY_COLUMNS = ('quantity', 'qty', 'количество', 'поступление')
+COUNTED_COLUMNS = ('counted', 'quantity', 'qty', 'количество', 'факт', 'фактически')
+
+PAYMENT_BATCH_SIZE = 200
+LOOKUP_CHUNK_SIZE = 500
+IMPORT_CHUNK_SIZE = 2000
+
+
+@dataclass
+class StatementLine:
+    line_no: int
+    number: str
+    amount: Decimal
+    raw: str
+
+
+@dataclass
+class CatalogRow:
+    line_no: int
+    sku: str
+    name: str
+    price: Decimal | None
+    quantity: int
+    raw: str
+
+
+def decode_upload(data):
+    """Декодирует файл: UTF-8 (в т.ч. с BOM) или Windows-1251 банковских выгрузок"""
+    if isinstance(data, str):
+        return data
+    try:
+        return data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return data.decode('cp1251')
+
+
+def _find_column(header, names):
+    for index, title in enumerate(header):
+        if title.strip().lower() in names:
+            return index
+    return None
+
+
+def parse_amount(value):
+    value = value.replace('\xa0', '').replace(' ', '').replace(',', '.')
+    return Decimal(value).quantize(Decimal('0.01'))
+
+
+def _sniff(sample):
+    try:
+        return csv.Sniffer().sniff(sample[:4096], delimiters=';,\t')
+    except csv.Error:
+        return csv.excel
+
+
+def _open_csv(text):
+    dialect = _sniff(text)
+    return dialect, csv.reader(io.StringIO(text), dialect)
+
+
+def read_bank_statement(data):
+    """Разбирает CSV-выписку: колонки номера счета (или назначения платежа) и суммы.
+
+    Возвращает (строки, ошибки разбора).
+    """
+    dialect, reader = _open_csv(decode_upload(data))
+    header = next(reader, None)
+    if not header:
+        return [], [(1, '', "Файл выписки пуст")]
+
+    number_col = _find_column(header, NUMBER_COLUMNS)
+    purpose_col = _find_column(header, PURPOSE_COLUMNS)
+    amount_col = _find_column(header, AMOUNT_COLUMNS)
+    if amount_col is None or (number_col is None and purpose_col is None):
+        return [], [(1, ';'.join(header), "Не найдены колонки суммы и номера счета (или назначения платежа)")]
+
+    lines, errors = [], []
+    for line_no, row in enumerate(reader, start=2):
+        if not any(cell.strip() for cell in row):
+            continue
+        raw = dialect.delimiter.join(row)
+        try:
+            amount = parse_amount(row[amount_col])
+        except (IndexError, InvalidOperation):
+            errors.append((line_no, raw, "Некорректная сумма"))
+            continue
+
+        number = row[number_col].strip() if number_col is not None and number_col < len(row) else ''
+        if not number and purpose_col is not None and purpose_col < len(row):
+            found = INVOICE_NUMBER_RE.search(row[purpose_col])
+            number = found.group(0) if found else ''
+        if not number:
+            errors.append((line_no, raw, "Номер счета не найден"))
+            continue
+
+        lines.append(StatementLine(line_no, number.upper(), amount, raw))
+    return lines, errors
+
+
+def match_statement(lines):
+    """Сопоставляет строки выписки с неоплаченными счетами.
+
+    Неоплаченные счета из выписки загружаются в словарь по номеру
+    (запросами по LOOKUP_CHUNK_SIZE номеров), после чего каждая строка
+    проверяется по номеру и сумме без обращений к БД.
+    Возвращает ({id счета: строка выписки}, несопоставленные строки с причиной).
+    """
+    numbers = sorted({line.number for line in lines})
+    unpaid = {}
+    for start in range(0, len(numbers), LOOKUP_CHUNK_SIZE):
+        rows = Invoice.objects.filter(
+            is_paid=False, number__in=numbers[start:start + LOOKUP_CHUNK_SIZE]
+        ).values_list('id', 'number', 'total')
+        for invoice_id, number, total in rows:
+            unpaid[number.upper()] = (invoice_id, total)
+
+    matched, unmatched = {}, []
+    for line in lines:
+        found = unpaid.get(line.number)
+        if found is None:
+            unmatched.append((line.line_no, line.raw, "Неоплаченный счет с таким номером не найден"))
+        elif found[1] != line.amount:
+            unmatched.append((line.line_no, line.raw, f"Сумма не совпадает со счетом ({found[1]})"))
+        elif found[0] in matched:
+            unmatched.append((line.line_no, line.raw, "Повторная оплата того же счета"))
+        else:
+            matched[found[0]] = line
+    return matched, unmatched
+
+
+def pay_bank_statement(data, batch_size=PAYMENT_BATCH_SIZE, dry_run=False):
+    """Оплачивает счета по выписке пачками транзакций и возвращает отчет"""
+    lines, errors = read_bank_statement(data)
+    matched, unmatched = match_statement(lines)
+    invoice_ids = list(matched)
+
+    paid = []
+    if not dry_run:
+        for start in range(0, len(invoice_ids), batch_size):
+            batch = invoice_ids[start:start + batch_size]
+            try:
+                paid.extend(Invoice.pay_many(batch))
+            except ValidationError:
+                # в пачке счет, который нельзя провести (истек резерв, нет остатка):
+                # проводим пачку по одному счету, отклоненные попадают в отчет
+                for invoice_id in batch:
+                    try:
+                        paid.extend(Invoice.pay_many([invoice_id]))
+                    except ValidationError as e:
+                        line = matched[invoice_id]
+                        unmatched.append((line.line_no, line.raw, " ".join(e.messages)))
+
+    return {
+        'lines': len(lines) + len(errors),
+        'matched': len(invoice_ids),
+        'paid': len(paid),
+        'sales': [sale.number for sale in paid],
+        'unmatched': sorted(errors + unmatched),
+    }
+
+
+def read_price_list(data):
+    """Разбирает CSV-прайс поставщика: колонки id товара и цены.
+
+    Возвращает ({id товара: цена}, ошибки разбора). Товары, которых нет
+    в каталоге, попадают в ошибки; при повторе товара действует
+    последняя строка.
+    """
+    dialect, reader = _open_csv(decode_upload(data))
+    header = next(reader, None)
+    if not header:
+        return {}, [(1, '', "Файл прайс-листа пуст")]
+
+    product_col = _find_column(header, PRODUCT_COLUMNS)
+    price_col = _find_column(header, PRICE_COLUMNS)
+    if product_col is None or price_col is None:
+        return {}, [(1, ';'.join(header), "Не найдены колонки товара и цены")]
+
+    rows, errors = {}, []
+    for line_no, row in enumerate(reader, start=2):
+        if not any(cell.strip() for cell in row):
+            continue
+        raw = dialect.delimiter.join(row)
+        try:
+            product_id = int(row[product_col])
+            price = parse_amount(row[price_col])
+        except (IndexError, ValueError, InvalidOperation):
+            errors.append((line_no, raw, "Некорректный товар или цена"))
+            continue
+        if price < 0:
+            errors.append((line_no, raw, "Отрицательная цена"))
+            continue
+        rows[product_id] = (line_no, raw, price)
+
+    product_ids = sorted(rows)
+    known = set()
+    for start in range(0, len(product_ids), LOOKUP_CHUNK_SIZE):
+        known.update(Product.objects.filter(
+            pk__in=product_ids[start:start + LOOKUP_CHUNK_SIZE]
+        ).values_list('id', flat=True))
+
+    prices = {}
+    for product_id, (line_no, raw, price) in rows.items():
+        if product_id in known:
+            prices[product_id] = price
+        else:
+            errors.append((line_no, raw, "Товар не найден"))
+    return prices, sorted(errors)
+
+
+def iter_upload_rows(file, filename=''):
+    """Строки файла поставщика по одной: CSV (UTF-8 или Windows-1251) или XLSX.
+
+    file — открытый двоичный файл; строки читаются потоком, без загрузки
+    файла в память целиком. Для XLSX нужен пакет openpyxl.
+    """
+    if filename.lower().endswith('.xlsx'):
+        try:
+            from openpyxl import load_workbook
+            from openpyxl.utils.exceptions import InvalidFileException
+        except ImportError:
+            raise ValueError("Для загрузки XLSX установите пакет openpyxl")
+        try:
+            workbook = load_workbook(file, read_only=True, data_only=True)
+        except (InvalidFileException, zipfile.BadZipFile, KeyError):
+            raise ValueError("Файл не является книгой XLSX")
+        try:
+            for row in workbook.active.iter_rows(values_only=True):
+                yield ['' if value is None else str(value) for value in row]
+        finally:
+            workbook.close()
+        return
+
+    sample = file.read(65536)
+    file.seek(0)
+    try:
+        sample.decode('utf-8')
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError as exc:
+        # символ, обрезанный на границе образца, — еще не ошибка кодировки
+        encoding = 'utf-8-sig' if exc.start >= len(sample) - 3 else 'cp1251'
+    text = io.TextIOWrapper(file, encoding=encoding, errors='replace', newline='')
+    try:
+        yield from csv.reader(text, _sniff(sample.decode(encoding, errors='ignore')))
+    finally:
+        # файл закрывает тот, кто его открыл
+        text.detach()
+
+
+def _parse_quantity(value):
+    value = value.strip()
+    if not value:
+        return 0
+    quantity = Decimal(value.replace(' ', '').replace(',', '.'))
+    if quantity != quantity.to_integral_value() or quantity < 0:
+        raise InvalidOperation
+    return int(quantity)
+
+
+def _parse_catalog_row(line_no, row, columns):
+    sku_col, name_col, price_col, quantity_col = columns
+    raw = ';'.join(row)
+
+    def cell(index):
+        return row[index].strip() if index is not None and index < len(row) else ''
+
+    sku = cell(sku_col)
+    if not sku or len(sku) > Product._meta.get_field('sku').max_length:
+        return None, (line_no, raw, "Пустой или слишком длинный артикул")
+    try:
+        price = parse_amount(cell(price_col)) if cell(price_col) else None
+        quantity = _parse_quantity(cell(quantity_col))
+    except InvalidOperation:
+        return None, (line_no, raw, "Некорректная цена или количество")
+    if price is not None and price < 0:
+        return None, (line_no, raw, "Отрицательная цена")
+    name = cell(name_col)[:Product._meta.get_field('name').max_length]
+    return CatalogRow(line_no, sku, name, price, quantity, raw), None
+
+
+def _catalog_index():
+    """Товары с артикулом: {артикул: (id, наименование, цена)}"""
+    rows = Product.objects.filter(sku__isnull=False).values_list('sku', 'id', 'name', 'price')
+    return {sku: (product_id, name, price) for sku, product_id, name, price in rows.iterator(chunk_size=10000)}
+
+
+def _upsert_catalog_chunk(rows, index, report, dry_run):
+    products, arrivals, changes, new_skus = [], {}, {}, []
+    for row in rows:
+        known = index.get(row.sku)
+        if known is None:
+            if not row.name or row.price is None:
+                report['unmatched'].append((row.line_no, row.raw, "Для нового товара нужны наименование и цена"))
+                continue
+            products.append(Product(sku=row.sku, name=row.name, price=row.price, quantity=row.quantity))
+            new_skus.append(row.sku)
+            report['inserted'] += 1
+            continue
+
+        product_id, name, price = known
+        new_name = row.name or name
+        new_price = price if row.price is None else row.price
+        if row.quantity:
+            arrivals[product_id] = row.quantity
+        if (new_name, new_price) == (name, price):
+            report['updated' if row.quantity else 'unchanged'] += 1
+            continue
+        products.append(Product(sku=row.sku, name=new_name, price=new_price))
+        if new_price != price:
+            changes[product_id] = (price, new_price)
+        index[row.sku] = (product_id, new_name, new_price)
+        report['updated'] += 1
+
+    if dry_run or not (products or arrivals):
+        return
+
+    with transaction.atomic():
+        # совпадение по артикулу обновляет наименование и цену; остаток —
+        # только через adjust_stock, чтобы не затереть параллельные продажи
+        Product.objects.bulk_create(
+            products,
+            update_conflicts=True,
+            unique_fields=['sku'],
+            update_fields=['name', 'price', 'updated_at'],
+        )
+        created = dict(Product.objects.filter(sku__in=new_skus).values_list('sku', 'id'))
+        for product in products:
+            if product.sku in created:
+                index[product.sku] = (created[product.sku], product.name, product.price)
+        PriceHistory.record_current(
+            [*created.values(), *changes], timezone.localdate(), "Импорт каталога"
+        )
+        Product.adjust_stock(quantity=arrivals)
+        if changes:
+            prices_changed.send(sender=Product, changes=changes)
+        transaction.on_commit(partial(bump_data_version, 'catalog'))
+
+
+def import_catalog(rows, chunk_size=IMPORT_CHUNK_SIZE, dry_run=False):
+    """Загружает каталог поставщика: колонки артикула, наименования, цены и количества.
+
+    rows — строки файла (iter_upload_rows), первая — заголовок. Строки
+    сопоставляются с товарами по артикулу через словарь в памяти и
+    записываются порциями по chunk_size: новые товары создаются,
+    у найденных обновляются наименование и цена (пустая ячейка
+    оставляет прежнее значение), количество прибавляется к остатку
+    как поступление. Каждая порция — отдельная транзакция.
+    """
+    report = {'lines': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'unmatched': []}
+    rows = iter(rows)
+    header = next(rows, None)
+    if not header:
+        report['unmatched'].append((1, '', "Файл пуст"))
+        return report
+
+    columns = tuple(_find_column(header, names) for names in (
+        SKU_COLUMNS, NAME_COLUMNS, PRICE_COLUMNS, QUANTITY_COLUMNS
+    ))
+    if columns[0] is None:
+        report['unmatched'].append((1, ';'.join(header), "Не найдена колонка артикула"))
+        return report
+
+    index = _catalog_index()
+    seen, chunk = set(), []
+    for line_no, row in enumerate(rows, start=2):
+        if not any(cell.strip() for cell in row):
+            continue
+        report['lines'] += 1
+        parsed, error = _parse_catalog_row(line_no, row, columns)
+        if parsed is not None and parsed.sku in seen:
+            parsed, error = None, (line_no, parsed.raw, "Артикул повторяется в файле")
+        if error:
+            report['unmatched'].append(error)
+            continue
+        seen.add(parsed.sku)
+        chunk.append(parsed)
+        if len(chunk) >= chunk_size:
+            _upsert_catalog_chunk(chunk, index, report, dry_run)
+            chunk = []
+    if chunk:
+        _upsert_catalog_chunk(chunk, index, report, dry_run)
+
+    report['unmatched'].sort()
+    return report
+
+
+def read_stocktake_counts(rows):
+    """Разбирает файл пересчета: колонки артикула или id товара и фактического количества.
+
+    Возвращает ({id товара: количество}, ошибки разбора). Повтор товара
+    в файле складывается (товар пересчитан в нескольких местах).
+    """
+    rows = iter(rows)
+    header = next(rows, None)
+    if not header:
+        return {}, [(1, '', "Файл пуст")]
+
+    sku_col = _find_column(header, SKU_COLUMNS)
+    product_col = _find_column(header, PRODUCT_COLUMNS)
+    counted_col = _find_column(header, COUNTED_COLUMNS)
+    if counted_col is None or (sku_col is None and product_col is None):
+        return {}, [(1, ';'.join(header), "Не найдены колонки товара (артикула) и количества")]
+
+    parsed, errors = [], []
+    for line_no, row in enumerate(rows, start=2):
+        if not any(cell.strip() for cell in row):
+            continue
+        raw = ';'.join(row)
+        try:
+            counted = _parse_quantity(row[counted_col])
+            key = row[sku_col].strip() if sku_col is not None else int(row[product_col])
+        except (IndexError, ValueError, InvalidOperation):
+            errors.append((line_no, raw, "Некорректный товар или количество"))
+            continue
+        parsed.append((line_no, raw, key, counted))
+
+    keys = sorted({key for _, _, key, _ in parsed})
+    field = 'sku' if sku_col is not None else 'id'
+    known = {}
+    for start in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+        known.update(Product.objects.filter(
+            **{f'{field}__in': keys[start:start + LOOKUP_CHUNK_SIZE]}
+        ).values_list(field, 'id'))
+
+    counts = {}
+    for line_no, raw, key, counted in parsed:
+        if key not in known:
+            errors.append((line_no, raw, "Товар не найден"))
+            continue
+        counts[known[key]] = counts.get(known[key], 0) + counted
+    return counts, sorted(errors)
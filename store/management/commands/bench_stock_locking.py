@@ -0,0 +1,84 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест записи остатков: много потоков списывают один товар "
+        "в оптимистичном и пессимистичном режимах"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help="Количество потоков-кассиров")
+        parser.add_argument('--writes', type=int, default=200, help="Списаний на один поток")
+        parser.add_argument(
+            '--mode',
+            choices=['optimistic', 'pessimistic', 'both'],
+            default='both',
+            help="Режим блокировки"
+        )
+
+    def handle(self, *args, **options):
+        modes = ['optimistic', 'pessimistic'] if options['mode'] == 'both' else [options['mode']]
+        threads, writes = options['threads'], options['writes']
+
+        product = Product.objects.create(name="__bench_stock_locking__", price=1, quantity=threads * writes)
+        try:
+            self.stdout.write(f"Потоков: {threads}, списаний на поток: {writes}")
+            for mode in modes:
+                Product.objects.filter(pk=product.pk).update(quantity=threads * writes, version=0)
+                self.report(mode, *self.run(product.pk, mode, threads, writes))
+        finally:
+            Product.objects.filter(pk=product.pk).delete()
+
+    def run(self, product_id, mode, threads, writes):
+        results = []
+        lock = threading.Lock()
+
+        def cashier():
+            attempts = done = failed = 0
+            try:
+                for _ in range(writes):
+                    try:
+                        attempts += Product.change_quantity(product_id, -1, mode=mode)
+                        done += 1
+                    except ValidationError:
+                        # исчерпаны повторы оптимистичной записи
+                        attempts += settings.STORE_STOCK_MAX_RETRIES
+                        failed += 1
+                    except DatabaseError:
+                        failed += 1
+            finally:
+                connection.close()
+            with lock:
+                results.append((attempts, done, failed))
+
+        workers = [threading.Thread(target=cashier) for _ in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        attempts = sum(r[0] for r in results)
+        done = sum(r[1] for r in results)
+        failed = sum(r[2] for r in results)
+        remaining = Product.objects.filter(pk=product_id).values_list('quantity', flat=True).get()
+        lost = remaining - (threads * writes - done)
+        return elapsed, attempts, done, failed, lost
+
+    def report(self, mode, elapsed, attempts, done, failed, lost):
+        conflicts = attempts - done
+        self.stdout.write(
+            f"{mode:>12}: {done / elapsed:8.0f} списаний/с, "
+            f"конфликтов {conflicts} ({conflicts / max(attempts, 1):.1%} попыток), "
+            f"отказов {failed}, потерянных обновлений {lost}, время {elapsed:.2f} с"
+        )
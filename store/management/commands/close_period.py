@@ -0,0 +1,29 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.archive import BATCH_SIZE, close_period
+
+
+class Command(BaseCommand):
+    help = (
+        "Закрывает период: переносит документы продаж и позиции старше даты "
+        "в архивную базу, пересчитывает итоги архива и снимает остатки"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('cutoff', help="Дата закрытия ГГГГ-ММ-ДД: переносятся документы раньше нее")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Продаж в одной пачке")
+
+    def handle(self, *args, **options):
+        try:
+            cutoff = date.fromisoformat(options['cutoff'])
+        except ValueError:
+            raise CommandError("Дата должна быть в формате ГГГГ-ММ-ДД")
+        if cutoff > date.today():
+            raise CommandError("Нельзя закрыть период, который еще не закончился")
+
+        documents, items = close_period(cutoff, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Период до {cutoff:%d.%m.%Y} закрыт: перенесено документов {documents}, позиций {items}"
+        ))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import facts
+
+
+class Command(BaseCommand):
+    help = (
+        "Выгружает позиции документов в колоночный снимок для аналитики "
+        "(дописывает позиции после последней выгруженной)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help="Пересобрать снимок с начала истории (после удаления или изменения документов)"
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        added, total = facts.export_facts(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Выгружено позиций: {added}, всего в снимке: {total} "
+            f"({time.perf_counter() - started:.2f} с, каталог {facts.facts_dir()})"
+        ))
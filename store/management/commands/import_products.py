@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.importers import IMPORT_CHUNK_SIZE, import_catalog, iter_upload_rows
+
+
+class Command(BaseCommand):
+    help = "Загружает товары и поступления из файла поставщика (CSV или XLSX) с сопоставлением по артикулу"
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help="Путь к CSV- или XLSX-файлу с колонками артикула, наименования, цены и количества")
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=IMPORT_CHUNK_SIZE,
+            help="Количество строк в одной транзакции"
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help="Только проверить файл, ничего не записывая"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['file'], 'rb') as file:
+                report = import_catalog(
+                    iter_upload_rows(file, options['file']),
+                    chunk_size=options['chunk_size'],
+                    dry_run=options['dry_run'],
+                )
+        except (OSError, ValueError) as exc:
+            raise CommandError(f"Не удалось прочитать файл: {exc}")
+
+        self.stdout.write(
+            f"Строк: {report['lines']}, добавлено: {report['inserted']}, обновлено: {report['updated']}, "
+            f"без изменений: {report['unchanged']}, отклонено: {len(report['unmatched'])}"
+        )
+        for line_no, raw, reason in report['unmatched']:
+            self.stdout.write(self.style.WARNING(f"  строка {line_no}: {reason} — {raw}"))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.importers import PAYMENT_BATCH_SIZE, pay_bank_statement
+
+
+class Command(BaseCommand):
+    help = "Оплачивает счета по банковской выписке (CSV) и создает безналичные продажи"
+
+    def add_arguments(self, parser):
+        parser.add_argument('statement', help="Путь к CSV-файлу выписки")
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=PAYMENT_BATCH_SIZE,
+            help="Количество счетов в одной транзакции"
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help="Только сопоставить строки, ничего не оплачивая"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['statement'], 'rb') as statement:
+                data = statement.read()
+        except OSError as exc:
+            raise CommandError(f"Не удалось прочитать выписку: {exc}")
+
+        report = pay_bank_statement(data, batch_size=options['batch_size'], dry_run=options['dry_run'])
+
+        self.stdout.write(
+            f"Строк: {report['lines']}, сопоставлено: {report['matched']}, оплачено: {report['paid']}"
+        )
+        for line_no, raw, reason in report['unmatched']:
+            self.stdout.write(self.style.WARNING(f"  строка {line_no}: {reason} — {raw}"))
@@ -0,0 +1,54 @@
+import os
+import re
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+IMPORT_TIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|\s*(\S+)')
+
+
+class Command(BaseCommand):
+    help = (
+        "Время запуска: импорт модулей при django.setup() и загрузке указанных "
+        "модулей (python -X importtime в отдельном процессе)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'modules',
+            nargs='*',
+            default=['store.urls'],
+            help="Модули, импортируемые после django.setup() (по умолчанию store.urls)"
+        )
+        parser.add_argument('--top', type=int, default=20, help="Сколько самых медленных модулей показать")
+
+    def handle(self, *args, **options):
+        code = "import django; django.setup()\n" + "".join(f"import {name}\n" for name in options['modules'])
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            capture_output=True,
+            text=True,
+            env=dict(os.environ),
+        )
+        if result.returncode:
+            raise CommandError(result.stderr.strip().splitlines()[-1])
+
+        rows = []
+        for line in result.stderr.splitlines():
+            match = IMPORT_TIME_RE.match(line)
+            if match:
+                own, cumulative, name = match.groups()
+                rows.append((int(own), int(cumulative), name))
+        total = sum(own for own, _, _ in rows)
+
+        self.stdout.write(f"Импортировано модулей: {len(rows)}, всего {total / 1000:.1f} мс")
+        self.stdout.write(f"{'собств., мс':>12} {'с вложенными, мс':>17}  модуль")
+        for own, cumulative, name in sorted(rows, reverse=True)[:options['top']]:
+            self.stdout.write(f"{own / 1000:12.1f} {cumulative / 1000:17.1f}  {name}")
+
+        store = [row for row in rows if row[2].startswith('store')]
+        if store:
+            self.stdout.write("\nМодули приложения:")
+            for own, cumulative, name in sorted(store, key=lambda row: -row[1]):
+                self.stdout.write(f"{own / 1000:12.1f} {cumulative / 1000:17.1f}  {name}")
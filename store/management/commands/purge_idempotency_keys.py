@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Удаляет устаревшие ключи идемпотентности"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours',
+            type=int,
+            default=settings.STORE_IDEMPOTENCY_TTL_HOURS,
+            help="Срок хранения ключей, часов"
+        )
+
+    def handle(self, *args, **options):
+        deleted = IdempotencyKey.purge(timezone.now() - timedelta(hours=options['hours']))
+        self.stdout.write(self.style.SUCCESS(f"Удалено ключей: {deleted}"))
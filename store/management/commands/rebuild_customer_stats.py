@@ -0,0 +1,65 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, Max, Min, Q, Sum, When
+
+from store.archive import archive_boundary
+from store.models import ArchivedSaleDocument, CustomerStats, SaleDocument
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает статистику продаж покупателей по всем документам, включая архив"
+
+    batch_size = 1000
+
+    def handle(self, *args, **options):
+        totals = {}
+        sources = [SaleDocument]
+        if archive_boundary():
+            sources.append(ArchivedSaleDocument)
+        for model in sources:
+            for row in self.customer_rows(model).iterator():
+                current = totals.get(row['customer_id'])
+                totals[row['customer_id']] = row if current is None else self.merge(current, row)
+
+        stats = [
+            CustomerStats(
+                customer_id=customer_id,
+                revenue=row['revenue'] or Decimal('0.00'),
+                returns_total=row['returns_total'] or Decimal('0.00'),
+                document_count=row['document_count'],
+                first_purchase=row['first_purchase'],
+                last_purchase=row['last_purchase'],
+            )
+            for customer_id, row in totals.items()
+        ]
+
+        with transaction.atomic():
+            CustomerStats.objects.all().delete()
+            CustomerStats.objects.bulk_create(stats, batch_size=self.batch_size)
+
+        self.stdout.write(self.style.SUCCESS(f"Статистика пересчитана для {len(stats)} покупателей"))
+
+    @staticmethod
+    def customer_rows(model):
+        sales = Q(type__in=['cash', 'cashless'])
+        return model.objects.order_by().values('customer_id').annotate(
+            revenue=Sum(Case(When(sales, then='total'), output_field=DecimalField())),
+            returns_total=Sum(Case(When(type='return', then='total'), output_field=DecimalField())),
+            document_count=Count('id'),
+            first_purchase=Min(Case(When(sales, then='date'))),
+            last_purchase=Max(Case(When(sales, then='date'))),
+        )
+
+    @staticmethod
+    def merge(current, row):
+        """Складывает итоги покупателя по оперативной базе и архиву"""
+        return {
+            'customer_id': current['customer_id'],
+            'revenue': (current['revenue'] or 0) + (row['revenue'] or 0),
+            'returns_total': (current['returns_total'] or 0) + (row['returns_total'] or 0),
+            'document_count': current['document_count'] + row['document_count'],
+            'first_purchase': min(filter(None, (current['first_purchase'], row['first_purchase'])), default=None),
+            'last_purchase': max(filter(None, (current['last_purchase'], row['last_purchase'])), default=None),
+        }
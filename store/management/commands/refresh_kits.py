@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from store.models import KitComponent
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает доступное количество всех комплектов по остаткам комплектующих"
+
+    def handle(self, *args, **options):
+        kit_ids = list(KitComponent.objects.order_by().values_list('kit_id', flat=True).distinct())
+        KitComponent.refresh(kit_ids)
+        self.stdout.write(self.style.SUCCESS(f"Пересчитано комплектов: {len(kit_ids)}"))
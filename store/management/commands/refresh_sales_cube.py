@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from store import pivot
+
+
+class Command(BaseCommand):
+    help = "Добавляет новые позиции документов в куб продаж для сводного отчета"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help="Пересобрать куб с начала истории (после изменения или удаления документов)"
+        )
+
+    def handle(self, *args, **options):
+        processed = pivot.refresh_cube(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f"Обработано позиций: {processed}"))
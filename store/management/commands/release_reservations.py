@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from store.models import StockReservation
+
+
+class Command(BaseCommand):
+    help = "Снимает просроченные резервы товаров по неоплаченным счетам"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help="Количество резервов в одной транзакции"
+        )
+
+    def handle(self, *args, **options):
+        released = StockReservation.release_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Снято резервов: {released}"))
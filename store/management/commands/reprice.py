@@ -0,0 +1,67 @@
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.importers import read_price_list
+from store.models import Product
+from store.pricing import apply_due_prices, percent_prices, reprice
+
+
+def _date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f"Некорректная дата: {value} (ожидается ГГГГ-ММ-ДД)")
+
+
+class Command(BaseCommand):
+    help = "Групповая переоценка товаров: на процент, по прайс-листу поставщика или по истории цен"
+
+    def add_arguments(self, parser):
+        action = parser.add_mutually_exclusive_group(required=True)
+        action.add_argument('--percent', help="Изменение цены в процентах, например 7 или -5")
+        action.add_argument('--file', help="CSV-прайс поставщика с колонками id товара и цены")
+        action.add_argument(
+            '--apply',
+            action='store_true',
+            help="Записать в каталог цены из истории, вступившие в силу сегодня"
+        )
+        parser.add_argument('--name', help="Только товары, в названии которых есть строка (для --percent)")
+        parser.add_argument('--ids', help="Только товары с этими id через запятую (для --percent)")
+        parser.add_argument('--date', help="Дата начала действия цен ГГГГ-ММ-ДД (по умолчанию сегодня)")
+        parser.add_argument('--source', default='', help="Основание переоценки для истории цен")
+
+    def handle(self, *args, **options):
+        if options['apply']:
+            changed = apply_due_prices()
+            self.stdout.write(self.style.SUCCESS(f"Обновлены цены товаров: {changed}"))
+            return
+
+        effective_from = _date(options['date']) if options['date'] else None
+        if options['file']:
+            try:
+                with open(options['file'], 'rb') as price_list:
+                    prices, errors = read_price_list(price_list.read())
+            except OSError as exc:
+                raise CommandError(f"Не удалось прочитать прайс-лист: {exc}")
+            for line_no, raw, reason in errors:
+                self.stdout.write(self.style.WARNING(f"  строка {line_no}: {reason} — {raw}"))
+            source = options['source'] or f"Прайс-лист {options['file']}"
+        else:
+            try:
+                percent = Decimal(options['percent'].replace(',', '.'))
+            except InvalidOperation:
+                raise CommandError(f"Некорректный процент: {options['percent']}")
+            products = Product.objects.all()
+            if options['name']:
+                products = products.filter(name__icontains=options['name'])
+            if options['ids']:
+                products = products.filter(pk__in=[int(pk) for pk in options['ids'].split(',') if pk.strip()])
+            prices = percent_prices(products, percent)
+            source = options['source'] or f"Переоценка {percent:+}%"
+
+        changed = reprice(prices, effective_from, source)
+        self.stdout.write(self.style.SUCCESS(
+            f"Записано цен: {len(prices)}, изменены текущие цены товаров: {changed}"
+        ))
@@ -0,0 +1,100 @@
+import json
+import random
+import time
+import uuid
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from django.urls import reverse
+
+from store.models import CashRegister, Customer, Product, SaleDocument
+
+
+class Command(BaseCommand):
+    help = (
+        "Имитация кассового терминала: очередь чеков, накопленная без связи, "
+        "отправляется пачками в api/pos/receipts/"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--receipts', type=int, default=1000, help="Чеков в очереди терминала")
+        parser.add_argument('--batch-size', type=int, default=200, help="Чеков в одной отправке")
+        parser.add_argument('--url', help="Адрес запущенного сервера (по умолчанию запросы выполняются в процессе)")
+        parser.add_argument('--keep', action='store_true', help="Не удалять созданные тестовые данные")
+
+    def handle(self, *args, **options):
+        register = CashRegister.objects.create(code=f"SIM{random.randint(0, 99999)}", name="Имитация терминала")
+        customer = Customer.objects.create(name="__simulate_terminal__")
+        products = [
+            Product.objects.create(name=f"__simulate_terminal__ {n}", price=100 + n, quantity=10 ** 6)
+            for n in range(10)
+        ]
+        try:
+            queue = [self.make_receipt(customer, products) for _ in range(options['receipts'])]
+            batches = [
+                queue[start:start + options['batch_size']]
+                for start in range(0, len(queue), options['batch_size'])
+            ]
+            send = self.sender(options['url'])
+
+            started = time.perf_counter()
+            statuses = {}
+            for batch in batches:
+                for result in send({'register': register.code, 'receipts': batch}):
+                    statuses[result['status']] = statuses.get(result['status'], 0) + 1
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"Отправлено {len(queue)} чеков пачками по {options['batch_size']}: "
+                f"{elapsed:.2f} с ({len(queue) / elapsed:.0f} чеков/с), результаты: {statuses}"
+            )
+
+            # повтор пачки после обрыва связи не должен создавать документы
+            replayed = send({'register': register.code, 'receipts': batches[0]}) if batches else []
+            duplicates = sum(1 for result in replayed if result['status'] == 'duplicate')
+            self.stdout.write(f"Повторная отправка первой пачки: дублей {duplicates} из {len(replayed)}")
+
+            shift = register.current_shift()
+            if shift:
+                self.stdout.write(f"Смена: чеков {shift.sales_count}, продажи {shift.sales_total} руб.")
+        finally:
+            if not options['keep']:
+                self.cleanup(register, customer, products)
+
+    def make_receipt(self, customer, products):
+        return {
+            'uuid': str(uuid.uuid4()),
+            'customer': customer.pk,
+            'items': [
+                {'product': product.pk, 'quantity': random.randint(1, 3)}
+                for product in random.sample(products, random.randint(1, 3))
+            ],
+        }
+
+    def sender(self, url):
+        path = reverse('api_pos_receipts')
+        if url:
+            def send(payload):
+                request = Request(
+                    url.rstrip('/') + path,
+                    data=json.dumps(payload).encode(),
+                    headers={'Content-Type': 'application/json'},
+                )
+                with urlopen(request) as response:
+                    return json.load(response)['results']
+        else:
+            client = Client(HTTP_HOST='localhost')
+
+            def send(payload):
+                response = client.post(path, json.dumps(payload), content_type='application/json')
+                return response.json()['results']
+        return send
+
+    def cleanup(self, register, customer, products):
+        with transaction.atomic():
+            SaleDocument.objects.filter(register=register).delete()
+            register.shifts.all().delete()
+            register.delete()
+            Product.objects.filter(pk__in=[product.pk for product in products]).delete()
+            customer.delete()
@@ -0,0 +1,37 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from store.importers import iter_upload_rows, read_stocktake_counts
+from store.models import Stocktake
+
+
+class Command(BaseCommand):
+    help = "Создает инвентаризацию по файлу пересчета (CSV или XLSX) и, при --post, проводит ее"
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help="Файл с колонками артикула (или id товара) и фактического количества")
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help="Полная инвентаризация: товары, которых нет в файле, списываются в ноль"
+        )
+        parser.add_argument('--comment', default='', help="Комментарий к инвентаризации")
+        parser.add_argument('--post', action='store_true', help="Сразу провести инвентаризацию")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['file'], 'rb') as file:
+                counts, errors = read_stocktake_counts(iter_upload_rows(file, options['file']))
+        except (OSError, ValueError) as exc:
+            raise CommandError(f"Не удалось прочитать файл: {exc}")
+        for line_no, raw, reason in errors:
+            self.stdout.write(self.style.WARNING(f"  строка {line_no}: {reason} — {raw}"))
+
+        stocktake = Stocktake.from_counts(counts, full=options['full'], comment=options['comment'])
+        self.stdout.write(f"{stocktake}: товаров в пересчете {len(counts)}")
+        if options['post']:
+            try:
+                changed = stocktake.post()
+            except ValidationError as exc:
+                raise CommandError(exc.message)
+            self.stdout.write(self.style.SUCCESS(f"Проведена, товаров с расхождением: {changed}"))
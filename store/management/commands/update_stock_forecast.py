@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from store import forecast
+
+
+class Command(BaseCommand):
+    help = "Обновляет дневные продажи и прогноз исчерпания остатков (запускать по ночам)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help="Пересобрать дневные продажи с начала истории"
+        )
+
+    def handle(self, *args, **options):
+        processed = forecast.update_daily_sales(full=options['full'])
+        products = forecast.compute_forecast()
+        self.stdout.write(self.style.SUCCESS(
+            f"Обработано позиций: {processed}, прогноз обновлен для {products} товаров"
+        ))
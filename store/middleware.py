@@ -0,0 +1,116 @@
+"""Идемпотентность POST-запросов, создающих документы.
+
+Клиент передает ключ в заголовке Idempotency-Key (HTML-формы — в
+скрытом поле idempotency_key). Первый запрос с ключом выполняется и
+его ответ сохраняется в IdempotencyKey; повтор (двойной клик, повтор
+прокси) получает сохраненный ответ одним чтением таблицы ключей, не
+создавая документов и не списывая остатки повторно. Ключ запоминает
+отпечаток запроса (метод, путь и тело без самого ключа): тот же ключ с
+другими данными отклоняется.
+
+AuditUserMiddleware передает журналу изменений пользователя запроса.
+"""
+import hashlib
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+
+from .audit import current_user
+from .models import IdempotencyKey
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+FORM_FIELD = 'idempotency_key'
+# поля формы, которые не входят в отпечаток запроса
+SKIP_FIELDS = {FORM_FIELD, 'csrfmiddlewaretoken'}
+FORM_CONTENT_TYPES = {'application/x-www-form-urlencoded', 'multipart/form-data'}
+
+
+def fingerprint(request):
+    """Отпечаток запроса: метод, путь и тело без ключа идемпотентности"""
+    digest = hashlib.sha256(f"{request.method} {request.path}\n".encode())
+    if request.content_type in FORM_CONTENT_TYPES:
+        # тело формы уже разобрано (request.POST), повторно его не прочитать
+        for name in sorted(set(request.POST) - SKIP_FIELDS):
+            for value in request.POST.getlist(name):
+                digest.update(f"{name}={value}\n".encode())
+        for name in sorted(request.FILES):
+            for upload in request.FILES.getlist(name):
+                digest.update(f"{name}:{upload.name}:{upload.size}\n".encode())
+    else:
+        digest.update(request.body)
+    return digest.hexdigest()
+
+
+class IdempotencyMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        key = getattr(request, '_idempotency_key', None)
+        if key is not None:
+            self.store(key, response)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # process_view выполняется после проверки CSRF, поэтому повтор ее не обходит
+        if request.method != 'POST' or request.resolver_match.url_name not in settings.STORE_IDEMPOTENT_VIEWS:
+            return None
+        key = request.META.get(HEADER) or request.POST.get(FORM_FIELD)
+        if not key:
+            return None
+        if len(key) > 64:
+            return HttpResponse("Idempotency-Key длиннее 64 символов", status=400)
+
+        request_fingerprint = fingerprint(request)
+        stored = IdempotencyKey.objects.filter(key=key).first()
+        if stored is None:
+            try:
+                with transaction.atomic():
+                    IdempotencyKey.objects.create(key=key, fingerprint=request_fingerprint)
+            except IntegrityError:
+                # параллельный запрос с тем же ключом успел раньше
+                stored = IdempotencyKey.objects.filter(key=key).first()
+            else:
+                request._idempotency_key = key
+                return None
+        return self.replay(stored, request_fingerprint)
+
+    def replay(self, stored, request_fingerprint):
+        if stored is None or stored.status is None:
+            return HttpResponse("Запрос с этим ключом еще выполняется", status=409)
+        if stored.fingerprint != request_fingerprint:
+            return HttpResponse("Ключ уже использован для другого запроса", status=422)
+        response = HttpResponse(bytes(stored.body), status=stored.status, content_type=stored.content_type or None)
+        if stored.location:
+            response['Location'] = stored.location
+        response['Idempotent-Replayed'] = 'true'
+        return response
+
+    def store(self, key, response):
+        if response.streaming or response.status_code >= 500:
+            # ошибку сервера сохранять нельзя: повтор должен выполниться заново
+            IdempotencyKey.objects.filter(key=key).delete()
+            return
+        IdempotencyKey.objects.filter(key=key).update(
+            status=response.status_code,
+            content_type=response.get('Content-Type', ''),
+            location=response.get('Location', ''),
+            body=response.content,
+        )
+
+
+class AuditUserMiddleware:
+    """Пользователь запроса для записей журнала изменений (store.audit)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        user = getattr(request, 'user', None)
+        token = current_user.set(user.get_username() if user is not None and user.is_authenticated else '')
+        try:
+            return self.get_response(request)
+        finally:
+            current_user.reset(token)
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_invoice_invoiceitem_saledocument_salesreport_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='saledocument',
+            name='invoice',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sale_document', to='store.invoice'),
+        ),
+        migrations.AlterField(
+            model_name='saledocument',
+            name='number',
+            field=models.CharField(max_length=20, unique=True, verbose_name='Номер'),
+        ),
+        migrations.AlterField(
+            model_name='saledocument',
+            name='original_sale',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='returns', to='store.saledocument', verbose_name='Оригинальная продажа'),
+        ),
+        migrations.AddIndex(
+            model_name='saledocument',
+            index=models.Index(fields=['date'], name='store_saled_date_69e1bd_idx'),
+        ),
+    ]
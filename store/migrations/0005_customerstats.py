@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_saledocument_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerStats',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='store.customer', verbose_name='Покупатель')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка')),
+                ('returns_total', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Сумма возвратов')),
+                ('document_count', models.IntegerField(default=0, verbose_name='Количество документов')),
+                ('first_purchase', models.DateField(blank=True, null=True, verbose_name='Первая покупка')),
+                ('last_purchase', models.DateField(blank=True, null=True, verbose_name='Последняя покупка')),
+            ],
+            options={
+                'verbose_name': 'Статистика покупателя',
+                'verbose_name_plural': 'Статистика покупателей',
+                'indexes': [models.Index(fields=['revenue'], name='store_custo_revenue_53a1b2_idx'), models.Index(fields=['returns_total'], name='store_custo_returns_6bc962_idx'), models.Index(fields=['document_count'], name='store_custo_documen_ee9df6_idx'), models.Index(fields=['first_purchase'], name='store_custo_first_p_d423c4_idx'), models.Index(fields=['last_purchase'], name='store_custo_last_pu_fe12d1_idx')],
+            },
+        ),
+    ]
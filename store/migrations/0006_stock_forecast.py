@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0005_customerstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Процесс')),
+                ('last_id', models.BigIntegerField(default=0, verbose_name='Последний id')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Отметка обработки',
+                'verbose_name_plural': 'Отметки обработки',
+            },
+        ),
+        migrations.CreateModel(
+            name='StockForecast',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='forecast', serialize=False, to='store.product', verbose_name='Товар')),
+                ('daily_rate', models.FloatField(default=0, verbose_name='Продаж в день')),
+                ('days_left', models.FloatField(blank=True, null=True, verbose_name='Дней до исчерпания')),
+                ('stockout_date', models.DateField(blank=True, null=True, verbose_name='Дата исчерпания')),
+                ('reorder_quantity', models.IntegerField(default=0, verbose_name='Рекомендуемый заказ')),
+                ('computed_at', models.DateTimeField(verbose_name='Дата расчета')),
+            ],
+            options={
+                'verbose_name': 'Прогноз остатка',
+                'verbose_name_plural': 'Прогнозы остатков',
+                'indexes': [models.Index(fields=['days_left'], name='store_stock_days_le_ec5226_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('quantity', models.IntegerField(default=0, verbose_name='Продано, шт.')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='store.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Продажи товара за день',
+                'verbose_name_plural': 'Продажи товаров по дням',
+                'indexes': [models.Index(fields=['date'], name='store_produ_date_3c2567_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'date'), name='unique_product_daily_sales')],
+            },
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:29
+
+import django.db.models.deletion
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+from django.utils import timezone
+
+
+def reserve_unpaid_invoice_items(apps, schema_editor):
+    """Позиции неоплаченных счетов раньше сразу списывали остаток: возвращаем его в резерв"""
+    InvoiceItem = apps.get_model('store', 'InvoiceItem')
+    Product = apps.get_model('store', 'Product')
+    StockReservation = apps.get_model('store', 'StockReservation')
+
+    expires_at = timezone.now() + timedelta(hours=settings.STORE_RESERVATION_TTL_HOURS)
+    items = InvoiceItem.objects.filter(invoice__is_paid=False).values_list(
+        'id', 'invoice_id', 'product_id', 'quantity'
+    )
+    reservations = []
+    for item_id, invoice_id, product_id, quantity in items.iterator():
+        Product.objects.filter(pk=product_id).update(
+            quantity=F('quantity') + quantity,
+            reserved=F('reserved') + quantity,
+        )
+        reservations.append(StockReservation(
+            invoice_item_id=item_id,
+            invoice_id=invoice_id,
+            product_id=product_id,
+            quantity=quantity,
+            expires_at=expires_at,
+        ))
+    StockReservation.objects.bulk_create(reservations, batch_size=1000)
+
+
+def unreserve_unpaid_invoice_items(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    StockReservation = apps.get_model('store', 'StockReservation')
+
+    for product_id, quantity in StockReservation.objects.values_list('product_id', 'quantity').iterator():
+        Product.objects.filter(pk=product_id).update(quantity=F('quantity') - quantity)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_stock_forecast'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='reserved',
+            field=models.IntegerField(default=0, help_text='Сумма активных резервов по неоплаченным счетам', verbose_name='В резерве'),
+        ),
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(verbose_name='Количество')),
+                ('expires_at', models.DateTimeField(verbose_name='Действует до')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='store.invoice', verbose_name='Счет')),
+                ('invoice_item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='reservation', to='store.invoiceitem', verbose_name='Позиция счета')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='reservations', to='store.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Резерв товара',
+                'verbose_name_plural': 'Резервы товаров',
+                'indexes': [models.Index(fields=['expires_at'], name='store_stock_expires_f1477d_idx')],
+            },
+        ),
+        migrations.RunPython(reserve_unpaid_invoice_items, unreserve_unpaid_invoice_items),
+    ]
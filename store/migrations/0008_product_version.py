@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='version',
+            field=models.PositiveIntegerField(default=0, help_text='Увеличивается при каждом изменении остатка (оптимистичная блокировка)', verbose_name='Версия'),
+        ),
+    ]
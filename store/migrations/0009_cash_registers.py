@@ -0,0 +1,68 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:34
+
+import django.core.validators
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_product_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CashRegister',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=8, unique=True, validators=[django.core.validators.RegexValidator('^[0-9A-Za-zА-Яа-яЁё]+$', 'Код кассы: только буквы и цифры')], verbose_name='Код')),
+                ('name', models.CharField(max_length=100, verbose_name='Наименование')),
+                ('last_number', models.PositiveIntegerField(default=0, verbose_name='Последний номер чека')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Работает')),
+            ],
+            options={
+                'verbose_name': 'Касса',
+                'verbose_name_plural': 'Кассы',
+                'ordering': ['code'],
+            },
+        ),
+        migrations.AddField(
+            model_name='saledocument',
+            name='register',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='documents', to='store.cashregister', verbose_name='Касса'),
+        ),
+        migrations.CreateModel(
+            name='Shift',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField(verbose_name='Номер смены')),
+                ('opened_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Открыта')),
+                ('closed_at', models.DateTimeField(blank=True, null=True, verbose_name='Закрыта')),
+                ('sales_total', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Продажи за наличные')),
+                ('returns_total', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Возвраты')),
+                ('sales_count', models.IntegerField(default=0, verbose_name='Чеков продажи')),
+                ('returns_count', models.IntegerField(default=0, verbose_name='Чеков возврата')),
+                ('register', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='shifts', to='store.cashregister', verbose_name='Касса')),
+            ],
+            options={
+                'verbose_name': 'Кассовая смена',
+                'verbose_name_plural': 'Кассовые смены',
+                'ordering': ['-opened_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='saledocument',
+            name='shift',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='documents', to='store.shift', verbose_name='Смена'),
+        ),
+        migrations.AddConstraint(
+            model_name='shift',
+            constraint=models.UniqueConstraint(fields=('register', 'number'), name='shift_register_number'),
+        ),
+        migrations.AddConstraint(
+            model_name='shift',
+            constraint=models.UniqueConstraint(condition=models.Q(('closed_at__isnull', True)), fields=('register',), name='shift_one_open_per_register'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_cash_registers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='saledocument',
+            name='client_uuid',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True, verbose_name='Идентификатор чека на кассе'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:37
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_saledocument_client_uuid'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True, verbose_name='Ключ')),
+                ('fingerprint', models.CharField(max_length=64, verbose_name='Отпечаток запроса')),
+                ('status', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Код ответа')),
+                ('content_type', models.CharField(blank=True, max_length=100, verbose_name='Тип ответа')),
+                ('location', models.CharField(blank=True, max_length=500, verbose_name='Адрес перенаправления')),
+                ('body', models.BinaryField(blank=True, default=b'', verbose_name='Тело ответа')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Дата создания')),
+            ],
+            options={
+                'verbose_name': 'Ключ идемпотентности',
+                'verbose_name_plural': 'Ключи идемпотентности',
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_product_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='cache_version',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Версия для кэша'),
+        ),
+        migrations.AddField(
+            model_name='saledocument',
+            name='cache_version',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Версия для кэша'),
+        ),
+    ]
@@ -0,0 +1,102 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:44
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_document_cache_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivePeriod',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cutoff', models.DateField(unique=True, verbose_name='Документы до даты')),
+                ('closed_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата закрытия')),
+                ('documents', models.IntegerField(default=0, verbose_name='Перенесено документов')),
+                ('items', models.IntegerField(default=0, verbose_name='Перенесено позиций')),
+            ],
+            options={
+                'verbose_name': 'Закрытый период',
+                'verbose_name_plural': 'Закрытые периоды',
+                'ordering': ['-cutoff'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('type', models.CharField(choices=[('cashless', 'Безналичная продажа'), ('cash', 'Наличная продажа'), ('return', 'Возврат товара')], max_length=10, verbose_name='Тип')),
+                ('documents', models.IntegerField(default=0, verbose_name='Документов')),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Сумма')),
+            ],
+            options={
+                'verbose_name': 'Итог архива за день',
+                'verbose_name_plural': 'Итоги архива по дням',
+                'constraints': [models.UniqueConstraint(fields=('date', 'type'), name='archived_daily_sales_date_type')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedSaleDocument',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('type', models.CharField(choices=[('cashless', 'Безналичная продажа'), ('cash', 'Наличная продажа'), ('return', 'Возврат товара')], max_length=10, verbose_name='Тип')),
+                ('number', models.CharField(max_length=20, verbose_name='Номер')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Сумма')),
+                ('customer_id', models.BigIntegerField(verbose_name='Покупатель (id)')),
+                ('customer_name', models.CharField(max_length=255, verbose_name='Покупатель')),
+                ('invoice_id', models.BigIntegerField(blank=True, null=True, verbose_name='Счет (id)')),
+                ('original_sale_id', models.BigIntegerField(blank=True, null=True, verbose_name='Оригинальная продажа (id)')),
+                ('cash_register', models.CharField(blank=True, max_length=50, verbose_name='Номер кассы/отдела')),
+                ('register_id', models.BigIntegerField(blank=True, null=True, verbose_name='Касса (id)')),
+                ('shift_id', models.BigIntegerField(blank=True, null=True, verbose_name='Смена (id)')),
+                ('reason', models.TextField(blank=True, verbose_name='Причина возврата')),
+                ('created_at', models.DateTimeField(verbose_name='Дата создания')),
+            ],
+            options={
+                'verbose_name': 'Архивный документ продажи',
+                'verbose_name_plural': 'Архивные документы продаж',
+                'ordering': ['-date', '-id'],
+                'indexes': [models.Index(fields=['type', 'date'], name='store_archi_type_8df32a_idx'), models.Index(fields=['date'], name='store_archi_date_0f201d_idx'), models.Index(fields=['customer_id'], name='store_archi_custome_2950b8_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedDocumentItem',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('product_id', models.BigIntegerField(verbose_name='Товар (id)')),
+                ('product_name', models.CharField(max_length=255, verbose_name='Товар')),
+                ('quantity', models.IntegerField(verbose_name='Количество')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Цена')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='store.archivedsaledocument', verbose_name='Документ')),
+            ],
+            options={
+                'verbose_name': 'Архивная позиция документа',
+                'verbose_name_plural': 'Архивные позиции документов',
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cutoff', models.DateField(verbose_name='Период до даты')),
+                ('product_id', models.BigIntegerField(verbose_name='Товар (id)')),
+                ('product_name', models.CharField(max_length=255, verbose_name='Товар')),
+                ('quantity', models.IntegerField(verbose_name='Остаток')),
+                ('reserved', models.IntegerField(default=0, verbose_name='В резерве')),
+                ('taken_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Снят')),
+            ],
+            options={
+                'verbose_name': 'Снимок остатков',
+                'verbose_name_plural': 'Снимки остатков',
+                'constraints': [models.UniqueConstraint(fields=('cutoff', 'product_id'), name='stock_snapshot_cutoff_product')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_period_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesCubeCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('type', models.CharField(choices=[('cashless', 'Безналичная продажа'), ('cash', 'Наличная продажа'), ('return', 'Возврат товара')], max_length=10, verbose_name='Тип')),
+                ('quantity', models.IntegerField(default=0, verbose_name='Количество')),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Сумма')),
+                ('lines', models.IntegerField(default=0, verbose_name='Позиций')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.customer', verbose_name='Покупатель')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Ячейка куба продаж',
+                'verbose_name_plural': 'Куб продаж',
+                'indexes': [models.Index(fields=['product', 'date'], name='store_sales_product_925e10_idx'), models.Index(fields=['customer', 'date'], name='store_sales_custome_0275e3_idx')],
+                'constraints': [models.UniqueConstraint(fields=('date', 'type', 'product', 'customer'), name='unique_sales_cube_cell')],
+            },
+        ),
+    ]
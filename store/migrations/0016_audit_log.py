@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:00
+
+import django.core.serializers.json
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_sales_cube'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=50, verbose_name='Модель')),
+                ('object_id', models.BigIntegerField(verbose_name='id объекта')),
+                ('action', models.CharField(choices=[('create', 'Создание'), ('update', 'Изменение'), ('delete', 'Удаление'), ('stock', 'Изменение остатка')], max_length=10, verbose_name='Действие')),
+                ('changes', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Изменения')),
+                ('user', models.CharField(blank=True, max_length=150, verbose_name='Пользователь')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата')),
+            ],
+            options={
+                'verbose_name': 'Запись журнала изменений',
+                'verbose_name_plural': 'Журнал изменений',
+                'indexes': [models.Index(fields=['model', 'object_id', 'created_at'], name='store_audit_model_e213a8_idx'), models.Index(fields=['created_at'], name='store_audit_created_f935de_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def record_current_prices(apps, schema_editor):
+    """Текущие цены — первая запись истории; прежние цены неизвестны"""
+    Product = apps.get_model('store', 'Product')
+    PriceHistory = apps.get_model('store', 'PriceHistory')
+    today = timezone.localdate()
+    PriceHistory.objects.bulk_create(
+        (
+            PriceHistory(product_id=product_id, price=price, effective_from=today, source="Начальная цена")
+            for product_id, price in Product.objects.values_list('id', 'price').iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_audit_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Цена')),
+                ('effective_from', models.DateField(verbose_name='Действует с')),
+                ('source', models.CharField(blank=True, max_length=100, verbose_name='Основание')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_history', to='store.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Цена товара',
+                'verbose_name_plural': 'История цен',
+                'ordering': ['product', '-effective_from'],
+                'constraints': [models.UniqueConstraint(fields=('product', 'effective_from'), name='price_history_product_date')],
+            },
+        ),
+        migrations.RunPython(record_current_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0017_price_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sku',
+            field=models.CharField(blank=True, help_text='Код товара в прайс-листах поставщиков', max_length=64, null=True, unique=True, verbose_name='Артикул'),
+        ),
+    ]
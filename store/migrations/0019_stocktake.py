@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:14
+
+import django.core.validators
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_product_sku'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Stocktake',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.CharField(max_length=20, unique=True, verbose_name='Номер')),
+                ('date', models.DateField(default=django.utils.timezone.localdate, verbose_name='Дата')),
+                ('full', models.BooleanField(default=False, help_text='Товары, которых нет в пересчете, списываются в ноль', verbose_name='Полная инвентаризация')),
+                ('comment', models.CharField(blank=True, max_length=255, verbose_name='Комментарий')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('posted_at', models.DateTimeField(blank=True, null=True, verbose_name='Проведена')),
+            ],
+            options={
+                'verbose_name': 'Инвентаризация',
+                'verbose_name_plural': 'Инвентаризации',
+                'ordering': ['-date', '-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(verbose_name='Изменение')),
+                ('balance', models.IntegerField(verbose_name='Остаток после')),
+                ('kind', models.CharField(choices=[('stocktake', 'Инвентаризация')], max_length=20, verbose_name='Вид')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='store.product', verbose_name='Товар')),
+                ('stocktake', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='movements', to='store.stocktake', verbose_name='Инвентаризация')),
+            ],
+            options={
+                'verbose_name': 'Движение товара',
+                'verbose_name_plural': 'Движения товаров',
+                'indexes': [models.Index(fields=['product', 'created_at'], name='store_stock_product_860bf2_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StocktakeLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('counted', models.IntegerField(validators=[django.core.validators.MinValueValidator(0)], verbose_name='Фактически')),
+                ('book_quantity', models.IntegerField(blank=True, null=True, verbose_name='По учету')),
+                ('difference', models.IntegerField(blank=True, null=True, verbose_name='Расхождение')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='store.product', verbose_name='Товар')),
+                ('stocktake', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='store.stocktake', verbose_name='Инвентаризация')),
+            ],
+            options={
+                'verbose_name': 'Строка инвентаризации',
+                'verbose_name_plural': 'Строки инвентаризации',
+                'constraints': [models.UniqueConstraint(fields=('stocktake', 'product'), name='stocktake_line_product')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:20
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_stocktake'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='kit_available',
+            field=models.IntegerField(blank=True, editable=False, help_text='Для комплектов: сколько можно собрать из доступных комплектующих (пересчитывается при изменении их остатков)', null=True, verbose_name='Комплектов доступно'),
+        ),
+        migrations.CreateModel(
+            name='KitComponent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1)], verbose_name='Количество в комплекте')),
+                ('component', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='used_in_kits', to='store.product', verbose_name='Комплектующее')),
+                ('kit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='components', to='store.product', verbose_name='Комплект')),
+            ],
+            options={
+                'verbose_name': 'Комплектующее',
+                'verbose_name_plural': 'Состав комплектов',
+                'constraints': [models.UniqueConstraint(fields=('kit', 'component'), name='kit_component_unique')],
+            },
+        ),
+    ]
@@ -1,11 +1,49 @@
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
 from decimal import Decimal
+from functools import partial
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.core.validators import MinValueValidator
-from django.db import models, transaction
-from django.db.models import Sum, F
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.validators import MinValueValidator, RegexValidator
+from django.db import connection, models, transaction
+from django.db.models import F, Max, Min, OuterRef, Subquery, Sum, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.dispatch import Signal
 from django.urls import reverse
 from django.utils import timezone
 
+from .cache import bump_data_version
+
+# остатки изменены UPDATE без save(): sender=Product, deltas={id товара: изменение}
+stock_changed = Signal()
+
+# цены изменены UPDATE без save(): sender=Product, changes={id товара: (старая цена, новая)}
+prices_changed = Signal()
+
+# позиция документа или счета удалена своим delete(): sender=модель, instance=позиция.
+# post_delete для позиций не подключается: с ним Django не удаляет их каскадом одним запросом
+item_deleted = Signal()
+
+
+def bump_cache_version(model, pk):
+    """Увеличивает версию документа: закэшированные фрагменты страницы устаревают"""
+    model.objects.filter(pk=pk).update(cache_version=F('cache_version') + 1)
+
+
+class LoadedValuesMixin:
+    """Запоминает строку, из которой загружен объект (журнал изменений сравнивает с ней при сохранении)"""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # только ссылки: поля журнала выбираются из строки лишь при сохранении
+        instance._loaded_values = (field_names, values)
+        return instance
+
 
 class Customer(models.Model):
     name = models.CharField(max_length=255, verbose_name="Наименование")
@@ -26,14 +64,39 @@ class Customer(models.Model):
         return self.name
 
 
-class Product(models.Model):
+class Product(LoadedValuesMixin, models.Model):
     name = models.CharField(max_length=255, verbose_name="Наименование")
+    sku = models.CharField(
+        max_length=64,
+        unique=True,
+        null=True,
+        blank=True,
+        verbose_name="Артикул",
+        help_text="Код товара в прайс-листах поставщиков"
+    )
     price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Цена")
     quantity = models.IntegerField(
         validators=[MinValueValidator(0)],
         verbose_name="Остаток",
         default=0
     )
+    reserved = models.IntegerField(
+        default=0,
+        verbose_name="В резерве",
+        help_text="Сумма активных резервов по неоплаченным счетам"
+    )
+    kit_available = models.IntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name="Комплектов доступно",
+        help_text="Для комплектов: сколько можно собрать из доступных комплектующих (пересчитывается при изменении их остатков)"
+    )
+    version = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Версия",
+        help_text="Увеличивается при каждом изменении остатка (оптимистичная блокировка)"
+    )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
 
@@ -41,18 +104,511 @@ class Product(models.Model):
         verbose_name = "Товар"
         verbose_name_plural = "Товары"
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['updated_at']),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.price} руб.)"
 
+    # счетчики меняются UPDATE с F() (резервы, продажи, оптимистичная блокировка);
+    # сохранение всей строки не должно затирать их значениями, прочитанными раньше
+    COUNTER_FIELDS = ('quantity', 'reserved', 'version', 'kit_available')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # цена при загрузке: сохранение с другой ценой добавляет запись в историю
+        instance._loaded_price = instance.__dict__.get('price')
+        # остаток при загрузке: сохранение записывает разницу, а не значение
+        instance._loaded_quantity = instance.__dict__.get('quantity')
+        return instance
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        price_changed = adding or self.price != getattr(self, '_loaded_price', None)
+        stock_delta = 0
+        if not adding:
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                deferred = self.get_deferred_fields()
+                update_fields = [
+                    field.attname for field in self._meta.concrete_fields
+                    if not field.primary_key and field.attname not in deferred
+                ]
+            if 'quantity' in update_fields and getattr(self, '_loaded_quantity', None) is not None:
+                stock_delta = self.quantity - self._loaded_quantity
+            kwargs['update_fields'] = [name for name in update_fields if name not in self.COUNTER_FIELDS]
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if price_changed:
+                PriceHistory.record({self.pk: self.price}, timezone.localdate())
+            if stock_delta:
+                Product.objects.filter(pk=self.pk).update(
+                    quantity=F('quantity') + stock_delta, version=F('version') + 1
+                )
+                KitComponent.refresh_for_components([self.pk])
+            if not adding:
+                self.refresh_from_db(fields=self.COUNTER_FIELDS)
+        self._loaded_price = self.price
+        self._loaded_quantity = self.quantity
+
+    @classmethod
+    def prices_on(cls, product_ids, on_date=None):
+        """Цены товаров на дату одним запросом: {id товара: цена}.
+
+        Цена — последняя запись PriceHistory, действующая на on_date; для
+        дат раньше истории — первая известная цена, для товаров без
+        истории — текущая Product.price.
+        """
+        on_date = on_date or timezone.localdate()
+        first = PriceHistory.objects.filter(product=OuterRef('pk')).order_by('effective_from').values('price')[:1]
+        rows = cls.objects.filter(pk__in=product_ids).annotate(
+            effective_price=Coalesce(
+                Subquery(PriceHistory.effective(on_date)), Subquery(first), F('price'),
+                output_field=cls._meta.get_field('price'),
+            )
+        ).values_list('id', 'effective_price')
+        # SQLite возвращает вычисленные десятичные значения без округления до копеек
+        return {pk: price.quantize(Decimal('0.01')) for pk, price in rows}
+
+    @property
+    def is_kit(self):
+        return self.kit_available is not None
+
     def available_quantity(self):
-        """Доступное количество для продажи"""
-        return self.quantity
+        """Доступное количество для продажи: остаток за вычетом резервов.
+
+        Комплект собирается из комплектующих при продаже, поэтому для него
+        это число комплектов, которые можно собрать (kit_available).
+        """
+        if self.is_kit:
+            return self.kit_available
+        return self.quantity - self.reserved
+
+    @classmethod
+    def change_quantity(cls, product_id, delta, check_available=False, mode=None):
+        """Изменяет остаток одного товара на delta (см. change_stock)"""
+        return cls.change_stock({product_id: delta}, check_available, mode)
+
+    @classmethod
+    def change_stock(cls, deltas, check_available=False, mode=None):
+        """Изменяет остатки товаров {id товара: изменение} одним UPDATE.
+
+        В оптимистичном режиме (по умолчанию, STORE_STOCK_LOCKING) UPDATE
+        проходит, только если версии всех строк не изменились с чтения;
+        при конфликте остатки перечитываются, не более
+        STORE_STOCK_MAX_RETRIES попыток. В пессимистичном режиме строки
+        блокируются select_for_update. check_available запрещает уменьшать
+        остаток ниже зарезервированного. Возвращает число попыток записи
+        (1 — без конфликтов).
+        """
+        deltas = {pk: delta for pk, delta in deltas.items() if delta}
+        if not deltas:
+            return 1
+        product_ids = sorted(deltas)
+        mode = mode or settings.STORE_STOCK_LOCKING
+        if mode == 'pessimistic':
+            with transaction.atomic():
+                rows = cls.objects.select_for_update().filter(pk__in=product_ids).order_by('pk').values_list(
+                    'id', 'quantity', 'reserved'
+                )
+                cls._check_rows(product_ids, [row + (None,) for row in rows], deltas, check_available)
+                cls.adjust_stock(quantity=deltas)
+            return 1
+
+        for attempt in range(1, settings.STORE_STOCK_MAX_RETRIES + 1):
+            rows = list(cls.objects.filter(pk__in=product_ids).values_list('id', 'quantity', 'reserved', 'version'))
+            cls._check_rows(product_ids, rows, deltas, check_available)
+            with transaction.atomic():
+                updated = cls.objects.filter(
+                    pk__in=product_ids,
+                    version=cls._delta_case([(pk, version) for pk, _, _, version in rows], default='NULL'),
+                ).update(
+                    quantity=F('quantity') + cls._delta_case([(pk, deltas[pk]) for pk in product_ids]),
+                    version=F('version') + 1,
+                    updated_at=timezone.now(),
+                )
+                if updated == len(product_ids):
+                    KitComponent.refresh_for_components(product_ids)
+                    stock_changed.send(sender=cls, deltas=deltas)
+                    return attempt
+                # часть строк уже изменили другие — откатываем записанные
+                transaction.set_rollback(True)
+            # небольшая случайная пауза, чтобы конкурирующие записи разошлись
+            time.sleep(random.uniform(0, 0.001 * 2 ** attempt))
+
+        raise ValidationError(
+            "Остаток товара одновременно изменяют другие пользователи. Повторите операцию."
+        )
+
+    @classmethod
+    def _check_rows(cls, product_ids, rows, deltas, check_available):
+        if len(rows) != len(product_ids):
+            missing = sorted(set(product_ids) - {row[0] for row in rows})
+            raise ValidationError(f"Товар не найден (id {', '.join(map(str, missing))})")
+        for product_id, quantity, reserved, _ in rows:
+            cls._check_stock(product_id, quantity, deltas[product_id], reserved, check_available)
+
+    @staticmethod
+    def _check_stock(product_id, quantity, delta, reserved, check_available):
+        # поступление и возврат разрешены, даже если остаток уже ниже резерва
+        if check_available and delta < 0 and quantity + delta < reserved:
+            raise ValidationError(
+                f"Недостаточно товара на складе (id {product_id}). Доступно: {quantity - reserved}"
+            )
+
+    @classmethod
+    def adjust_stock(cls, quantity=None, reserved=None, chunk_size=500):
+        """Групповое изменение остатков и резервов.
+
+        quantity и reserved — словари {id товара: изменение}. Все товары
+        пачки меняются одним UPDATE с CASE по id, без чтения строк;
+        версия увеличивается, чтобы параллельные оптимистичные записи
+        увидели конфликт. Затем пересчитываются комплекты, в которые
+        входят измененные товары.
+        """
+        quantity = {pk: delta for pk, delta in (quantity or {}).items() if delta}
+        reserved = {pk: delta for pk, delta in (reserved or {}).items() if delta}
+        product_ids = sorted(set(quantity) | set(reserved))
+
+        for start in range(0, len(product_ids), chunk_size):
+            chunk = product_ids[start:start + chunk_size]
+            updates = {'updated_at': timezone.now(), 'version': F('version') + 1}
+            for field, deltas in (('quantity', quantity), ('reserved', reserved)):
+                pairs = [(pk, deltas[pk]) for pk in chunk if pk in deltas]
+                if pairs:
+                    updates[field] = F(field) + cls._delta_case(pairs)
+            cls.objects.filter(pk__in=chunk).update(**updates)
+        KitComponent.refresh_for_components(product_ids, chunk_size)
+        if quantity:
+            stock_changed.send(sender=cls, deltas=quantity)
+
+    @staticmethod
+    def _delta_case(pairs, default='0'):
+        # CASE "id" WHEN ... в SQL: дерево When(pk=...) на тысячи товаров
+        # Django собирает дольше, чем выполняется сам UPDATE
+        sql = 'CASE "id" ' + ' '.join(['WHEN %s THEN %s'] * len(pairs)) + f' ELSE {default} END'
+        params = [value for pair in pairs for value in pair]
+        return RawSQL(sql, params, output_field=models.IntegerField())
+
+
+class KitComponent(models.Model):
+    """Комплектующее комплекта (готового ПК): товар и его количество в одном комплекте.
+
+    Комплект — обычный товар со списком комплектующих; собственного
+    остатка у него нет. Сколько комплектов можно собрать, хранится в
+    Product.kit_available и пересчитывается только для комплектов,
+    в которые входят товары с измененным остатком или резервом
+    (refresh_for_components из adjust_stock, change_quantity и т.д.).
+    """
+    kit = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='components',
+        verbose_name="Комплект"
+    )
+    component = models.ForeignKey(
+        Product,
+        on_delete=models.PROTECT,
+        related_name='used_in_kits',
+        verbose_name="Комплектующее"
+    )
+    quantity = models.PositiveIntegerField(
+        default=1,
+        validators=[MinValueValidator(1)],
+        verbose_name="Количество в комплекте"
+    )
+
+    class Meta:
+        verbose_name = "Комплектующее"
+        verbose_name_plural = "Состав комплектов"
+        constraints = [
+            models.UniqueConstraint(fields=['kit', 'component'], name='kit_component_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.kit_id}: {self.component_id} x {self.quantity}"
 
+    def clean(self):
+        # комплекты одноуровневые: комплект не входит в другие комплекты
+        if self.kit_id and self.kit_id == self.component_id:
+            raise ValidationError("Комплект не может входить в собственный состав")
+        if self.component_id and KitComponent.objects.filter(kit_id=self.component_id).exists():
+            raise ValidationError("Комплектующим не может быть другой комплект")
+        if self.kit_id and KitComponent.objects.filter(component_id=self.kit_id).exists():
+            raise ValidationError("Товар входит в состав других комплектов и не может быть комплектом")
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            KitComponent.refresh([self.kit_id])
+
+    def delete(self, *args, **kwargs):
+        kit_id = self.kit_id
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            KitComponent.refresh([kit_id])
+        return result
+
+    @classmethod
+    def refresh(cls, kit_ids):
+        """Пересчитывает Product.kit_available комплектов одним UPDATE.
+
+        kit_ids — id комплектов или подзапрос с ними. Число комплектов —
+        минимум по комплектующим (остаток - резерв) // количество в
+        комплекте; у товара без комплектующих kit_available = NULL.
+        """
+        sets = cls.objects.filter(kit=OuterRef('pk')).values('kit').annotate(
+            sets=Min(Greatest(F('component__quantity') - F('component__reserved'), Value(0)) / F('quantity'))
+        ).values('sets')
+        Product.objects.filter(pk__in=kit_ids).update(kit_available=Subquery(sets))
+
+    @classmethod
+    def refresh_for_components(cls, component_ids, chunk_size=500):
+        """Пересчитывает только комплекты, в которые входят товары component_ids"""
+        component_ids = list(component_ids)
+        for start in range(0, len(component_ids), chunk_size):
+            chunk = component_ids[start:start + chunk_size]
+            cls.refresh(cls.objects.filter(component_id__in=chunk).values('kit_id'))
+
+    @classmethod
+    def recipes(cls, product_ids):
+        """Состав комплектов среди product_ids: {id комплекта: [(id комплектующего, количество)]}"""
+        recipes = defaultdict(list)
+        rows = cls.objects.filter(kit_id__in=product_ids).values_list('kit_id', 'component_id', 'quantity')
+        for kit_id, component_id, quantity in rows:
+            recipes[kit_id].append((component_id, quantity))
+        return dict(recipes)
+
+    @classmethod
+    def expand(cls, quantities, recipes=None):
+        """Количества {id товара: количество}, где комплекты заменены комплектующими.
+
+        recipes — уже прочитанный состав (recipes()), иначе читается одним запросом.
+        """
+        if recipes is None:
+            recipes = cls.recipes(list(quantities))
+        expanded = defaultdict(int)
+        for product_id, quantity in quantities.items():
+            for component_id, per_kit in recipes.get(product_id, [(product_id, 1)]):
+                expanded[component_id] += quantity * per_kit
+        return dict(expanded)
+
+
+class PriceHistory(models.Model):
+    """Цена товара, действующая с даты effective_from до следующей записи"""
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='price_history',
+        verbose_name="Товар"
+    )
+    price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Цена")
+    effective_from = models.DateField(verbose_name="Действует с")
+    source = models.CharField(max_length=100, blank=True, verbose_name="Основание")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+
+    class Meta:
+        verbose_name = "Цена товара"
+        verbose_name_plural = "История цен"
+        ordering = ['product', '-effective_from']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'effective_from'], name='price_history_product_date'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.price} руб. с {self.effective_from:%d.%m.%Y}"
+
+    @classmethod
+    def effective(cls, on_date):
+        """Подзапрос цены, действующей на дату, для товара из внешнего запроса"""
+        return cls.objects.filter(
+            product=OuterRef('pk'), effective_from__lte=on_date
+        ).order_by('-effective_from').values('price')[:1]
+
+    @classmethod
+    def record(cls, prices, effective_from, source='', batch_size=1000):
+        """Записывает цены {id товара: цена} с даты effective_from.
+
+        Повторная запись на ту же дату заменяет цену.
+        """
+        cls.objects.bulk_create(
+            [
+                cls(product_id=product_id, price=price, effective_from=effective_from, source=source)
+                for product_id, price in prices.items()
+            ],
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['product', 'effective_from'],
+            update_fields=['price', 'source'],
+        )
+
+    @classmethod
+    def record_current(cls, product_ids, effective_from, source='', chunk_size=500):
+        """Записывает в историю текущие Product.price товаров с даты effective_from.
+
+        Одним INSERT ... SELECT на порцию id, без загрузки товаров в Python.
+        """
+        qn = connection.ops.quote_name
+        product_ids = list(product_ids)
+        created_at = connection.ops.adapt_datetimefield_value(timezone.now())
+        effective_from = connection.ops.adapt_datefield_value(effective_from)
+        with connection.cursor() as cursor:
+            for start in range(0, len(product_ids), chunk_size):
+                chunk = product_ids[start:start + chunk_size]
+                cursor.execute(f"""
+                    INSERT INTO {qn(cls._meta.db_table)} ("product_id", "price", "effective_from", "source", "created_at")
+                    SELECT "id", "price", %s, %s, %s FROM {qn(Product._meta.db_table)}
+                    WHERE "id" IN ({', '.join(['%s'] * len(chunk))})
+                    ON CONFLICT ("product_id", "effective_from") DO UPDATE SET
+                        "price" = excluded."price", "source" = excluded."source"
+                """, [effective_from, source, created_at, *chunk])
+
+
+class CustomerStats(models.Model):
+    """Накопленная статистика продаж покупателя.
+
+    Обновляется в той же транзакции, что и документ продажи, поэтому
+    список покупателей сортируется и фильтруется без обхода документов.
+    Полный пересчет: manage.py rebuild_customer_stats
+    """
+    customer = models.OneToOneField(
+        Customer,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name="Покупатель"
+    )
+    revenue = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        default=0,
+        verbose_name="Выручка"
+    )
+    returns_total = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        default=0,
+        verbose_name="Сумма возвратов"
+    )
+    document_count = models.IntegerField(default=0, verbose_name="Количество документов")
+    first_purchase = models.DateField(null=True, blank=True, verbose_name="Первая покупка")
+    last_purchase = models.DateField(null=True, blank=True, verbose_name="Последняя покупка")
+
+    class Meta:
+        verbose_name = "Статистика покупателя"
+        verbose_name_plural = "Статистика покупателей"
+        indexes = [
+            models.Index(fields=['revenue']),
+            models.Index(fields=['returns_total']),
+            models.Index(fields=['document_count']),
+            models.Index(fields=['first_purchase']),
+            models.Index(fields=['last_purchase']),
+        ]
+
+    def __str__(self):
+        return f"Статистика: {self.customer}"
+
+    @staticmethod
+    def document_state(document):
+        """Вклад документа в статистику"""
+        doc_date = document.date
+        if isinstance(doc_date, datetime):
+            # значение по умолчанию timezone.now дает datetime до перечитывания из БД
+            doc_date = timezone.localdate(doc_date) if timezone.is_aware(doc_date) else doc_date.date()
+        return {
+            'customer_id': document.customer_id,
+            'type': document.type,
+            'date': doc_date,
+            'total': document.total,
+        }
+
+    @classmethod
+    def apply_change(cls, old, new):
+        """Переносит в статистику изменение документа.
+
+        old и new — состояния документа до и после записи
+        (см. document_state) или None при создании/удалении.
+        """
+        cls.apply_changes([(old, new)])
+
+    @classmethod
+    def apply_changes(cls, changes):
+        """Переносит в статистику пачку изменений (пар old, new).
+
+        Изменения суммируются по покупателю, поэтому число запросов
+        зависит от количества покупателей, а не документов.
+        """
+        deltas = {}
+        contributions = (
+            (state, sign)
+            for old, new in changes
+            for state, sign in ((old, -1), (new, 1))
+        )
+        for state, sign in contributions:
+            if not state:
+                continue
+            delta = deltas.setdefault(state['customer_id'], {
+                'revenue': Decimal('0.00'),
+                'returns_total': Decimal('0.00'),
+                'document_count': 0,
+                'added': set(),
+                'removed': set(),
+            })
+            total = Decimal(state['total'] or 0) * sign
+            delta['document_count'] += sign
+            if state['type'] == 'return':
+                delta['returns_total'] += total
+            else:
+                delta['revenue'] += total
+                delta['added' if sign > 0 else 'removed'].add(state['date'])
+
+        for customer_id, delta in deltas.items():
+            removed = delta['removed'] - delta['added']
+            added = delta['added'] - delta['removed']
+            updates = {
+                field: F(field) + delta[field]
+                for field in ('revenue', 'returns_total', 'document_count')
+                if delta[field]
+            }
+            if added:
+                first = Value(min(added), output_field=models.DateField())
+                last = Value(max(added), output_field=models.DateField())
+                updates['first_purchase'] = Coalesce(Least(F('first_purchase'), first), first)
+                updates['last_purchase'] = Coalesce(Greatest(F('last_purchase'), last), last)
+            if not updates and not removed:
+                continue
+
+            cls.objects.bulk_create([cls(customer_id=customer_id)], ignore_conflicts=True)
+            if updates:
+                cls.objects.filter(customer_id=customer_id).update(**updates)
+            if removed:
+                # Граничную дату нельзя вычесть — пересчитываем по индексу покупателя
+                cls.objects.filter(customer_id=customer_id).update(
+                    **cls.purchase_dates(customer_id)
+                )
 
+    @staticmethod
+    def purchase_dates(customer_id):
+        from .archive import archive_boundary
+
+        sales = {'customer_id': customer_id, 'type__in': ['cash', 'cashless']}
+        dates = SaleDocument.objects.filter(**sales).aggregate(first_purchase=Min('date'), last_purchase=Max('date'))
+        if archive_boundary():
+            # покупки закрытых периодов хранятся в архиве
+            archived = ArchivedSaleDocument.objects.filter(**sales).aggregate(
+                first_purchase=Min('date'), last_purchase=Max('date')
+            )
+            dates = {
+                'first_purchase': min(filter(None, (dates['first_purchase'], archived['first_purchase'])), default=None),
+                'last_purchase': max(filter(None, (dates['last_purchase'], archived['last_purchase'])), default=None),
+            }
+        return dates
 
 
-class Invoice(models.Model):
+class Invoice(LoadedValuesMixin, models.Model):
     """Счет на оплату (предварительный документ)"""
     number = models.CharField(max_length=20, unique=True, verbose_name="Номер")
     date = models.DateField(default=timezone.now, verbose_name="Дата")
@@ -69,6 +625,11 @@ class Invoice(models.Model):
         verbose_name="Сумма"
     )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    cache_version = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Версия для кэша"
+    )
 
     class Meta:
         verbose_name = "Счет"
@@ -92,16 +653,62 @@ class Invoice(models.Model):
             last_num = int(last_invoice.number.split('-')[-1]) if last_invoice else 0
             self.number = f"СЧ-{last_num + 1}"
 
-        # При оплате счета создаем связанную продажу
-        if self.is_paid and not hasattr(self, 'sale_document'):
-            SaleDocument.objects.create(
-                type='cashless',
-                customer=self.customer,
-                invoice=self,
-                total=self.total
+        with transaction.atomic():
+            is_new = self._state.adding
+            was_paid = self.is_paid and not is_new and Invoice.objects.filter(pk=self.pk, is_paid=True).exists()
+            super().save(*args, **kwargs)
+            if not is_new:
+                bump_cache_version(Invoice, self.pk)
+
+            # При оплате счета (например, из админки) создаем связанную продажу —
+            # только при переходе в оплаченные, а не при каждом сохранении
+            if self.is_paid and not was_paid and not self.has_sale():
+                self.create_sale_document()
+
+    def has_sale(self):
+        """Есть ли продажа по счету, в том числе перенесенная в архив закрытого периода"""
+        from .archive import archive_boundary
+
+        if SaleDocument.objects.filter(invoice=self).exists():
+            return True
+        return bool(archive_boundary()) and ArchivedSaleDocument.objects.filter(invoice_id=self.pk).exists()
+
+    def mark_paid(self):
+        """Помечает счет оплаченным и создает по нему безналичную продажу.
+
+        Возвращает документ продажи (уже существующий, если счет был оплачен).
+        """
+        sales = Invoice.pay_many([self.pk])
+        self.is_paid = True
+        if sales:
+            return sales[0]
+        return SaleDocument.objects.filter(invoice=self).first()
+
+    @classmethod
+    def pay_many(cls, invoice_ids):
+        """Оплачивает пачку счетов в одной транзакции.
+
+        Уже оплаченные счета пропускаются, поэтому повторный запрос не
+        создает вторую продажу. Число запросов не зависит от количества
+        счетов и позиций. Возвращает созданные продажи.
+        """
+        with transaction.atomic():
+            invoices = list(
+                cls.objects.select_for_update().filter(pk__in=invoice_ids, is_paid=False).order_by('id')
+            )
+            if not invoices:
+                return []
+            cls.objects.filter(pk__in=[invoice.pk for invoice in invoices]).update(
+                is_paid=True, cache_version=F('cache_version') + 1
             )
+            for invoice in invoices:
+                invoice.is_paid = True
+            return SaleDocument.create_from_invoices(invoices)
+
+    def create_sale_document(self):
+        """Создает безналичную продажу с копией позиций счета и списывает резервы"""
+        return SaleDocument.create_from_invoices([self])[0]
 
-        super().save(*args, **kwargs)
     def update_total(self):
         """Обновляет сумму счета на основе позиций"""
         self.total = self.items.aggregate(
@@ -130,7 +737,7 @@ def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
         self.invoice.update_total()
 
-class InvoiceItem(models.Model):
+class InvoiceItem(LoadedValuesMixin, models.Model):
     """Позиция в счете на оплату"""
     invoice = models.ForeignKey(
         Invoice,
@@ -167,52 +774,372 @@ class InvoiceItem(models.Model):
     def __str__(self):
         return f"{self.product.name} - {self.quantity} шт."
 
+    @property
+    def total(self):
+        """Сумма позиции (цена * количество)"""
+        return self.price * self.quantity
+
     def clean(self):
-        # Проверка доступного количества товара
-        if self.quantity > self.product.available_quantity():
+        # Проверка доступного количества товара (собственный резерв позиции тоже доступен)
+        available = self.product.available_quantity() + self.reserved_quantity()
+        if self.quantity > available:
             raise ValidationError(
-                f"Недостаточно товара на складе. Доступно: {self.product.available_quantity()}"
+                f"Недостаточно товара на складе. Доступно: {available}"
             )
 
-    def save(self, *args, **kwargs):
-        from django.db import transaction
+    def reserved_quantity(self):
+        """Количество, уже зарезервированное под эту позицию"""
+        if not self.pk:
+            return 0
+        return StockReservation.objects.filter(invoice_item=self).values_list('quantity', flat=True).first() or 0
 
+    def save(self, *args, **kwargs):
         self.clean()
 
         with transaction.atomic():
-            if self.pk:
-                # Обработка редактирования: вернуть старое количество на склад
-                old_item = InvoiceItem.objects.get(pk=self.pk)
-                self.product.quantity += old_item.quantity
-            # Списываем новое количество
-            if self.quantity > self.product.available_quantity():
-                raise ValidationError(
-                    f"Недостаточно товара на складе. Доступно: {self.product.available_quantity()}"
-                )
-            self.product.quantity -= self.quantity
-            self.product.save()
-
             super().save(*args, **kwargs)
+            # Товар не списывается, а резервируется до оплаты или истечения срока
+            if not self.invoice.is_paid:
+                StockReservation.reserve(self)
             self.invoice.update_total()
 
     def delete(self, *args, **kwargs):
-        from django.db import transaction
-
         with transaction.atomic():
-            # Возвращаем товар на склад при удалении
-            self.product.quantity += self.quantity
-            self.product.save()
+            # Снимаем резерв при удалении позиции
+            StockReservation.release(self)
 
+            item_deleted.send(sender=InvoiceItem, instance=self)
             super().delete(*args, **kwargs)
             self.invoice.update_total()
 
-class SaleDocument(models.Model):
+
+class StockReservation(models.Model):
+    """Резерв товара под позицию неоплаченного счета.
+
+    Пока резерв активен, товар учитывается в Product.reserved и недоступен
+    для продажи. При оплате счета резерв превращается в списание остатка,
+    просроченные резервы снимает команда release_reservations.
+    Резерв комплекта записывается на комплект, а счетчики резерва
+    меняются у его комплектующих (KitComponent.expand).
+    """
+    invoice_item = models.OneToOneField(
+        InvoiceItem,
+        on_delete=models.CASCADE,
+        related_name='reservation',
+        verbose_name="Позиция счета"
+    )
+    invoice = models.ForeignKey(
+        Invoice,
+        on_delete=models.CASCADE,
+        related_name='reservations',
+        verbose_name="Счет"
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.PROTECT,
+        related_name='reservations',
+        verbose_name="Товар"
+    )
+    quantity = models.IntegerField(verbose_name="Количество")
+    expires_at = models.DateTimeField(verbose_name="Действует до")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+
+    class Meta:
+        verbose_name = "Резерв товара"
+        verbose_name_plural = "Резервы товаров"
+        indexes = [
+            models.Index(fields=['expires_at']),
+        ]
+
+    def __str__(self):
+        return f"Резерв {self.product_id}: {self.quantity} шт. до {self.expires_at}"
+
+    @staticmethod
+    def default_expiry():
+        return timezone.now() + timedelta(hours=settings.STORE_RESERVATION_TTL_HOURS)
+
+    @classmethod
+    def reserve(cls, item):
+        """Создает или изменяет резерв под позицию счета.
+
+        Счетчик резерва товара (для комплекта — каждого комплектующего)
+        меняется условным UPDATE, который не пропускает резерв сверх
+        доступного остатка.
+        """
+        current = cls.objects.filter(invoice_item=item).values_list('product_id', 'quantity').first()
+        if current and current[0] != item.product_id:
+            cls.release(item)
+            current = None
+        delta = item.quantity - (current[1] if current else 0)
+
+        if delta > 0:
+            needed = KitComponent.expand({item.product_id: delta})
+            with transaction.atomic():
+                for product_id, quantity in sorted(needed.items()):
+                    updated = Product.objects.filter(
+                        pk=product_id,
+                        quantity__gte=F('reserved') + quantity
+                    ).update(reserved=F('reserved') + quantity, version=F('version') + 1)
+                    if not updated:
+                        item.product.refresh_from_db(fields=Product.COUNTER_FIELDS)
+                        raise ValidationError(
+                            f"Недостаточно товара на складе. Доступно: {item.product.available_quantity()}"
+                        )
+                KitComponent.refresh_for_components(needed)
+        elif delta < 0:
+            Product.adjust_stock(reserved=KitComponent.expand({item.product_id: delta}))
+
+        cls.objects.update_or_create(
+            invoice_item=item,
+            defaults={
+                'invoice_id': item.invoice_id,
+                'product_id': item.product_id,
+                'quantity': item.quantity,
+                'expires_at': cls.default_expiry(),
+            }
+        )
+
+    @classmethod
+    def release(cls, item):
+        """Снимает резерв позиции счета"""
+        current = cls.objects.filter(invoice_item=item).values_list('id', 'product_id', 'quantity').first()
+        if current:
+            Product.adjust_stock(reserved=KitComponent.expand({current[1]: -current[2]}))
+            cls.objects.filter(pk=current[0]).delete()
+
+    @classmethod
+    def release_invoices(cls, invoice_ids):
+        """Снимает все резервы счетов одним групповым UPDATE (перед удалением счетов)"""
+        reservations = cls.objects.filter(invoice_id__in=invoice_ids)
+        deltas = defaultdict(int)
+        for product_id, quantity in reservations.values_list('product_id', 'quantity'):
+            deltas[product_id] -= quantity
+        if deltas:
+            Product.adjust_stock(reserved=KitComponent.expand(deltas))
+            reservations.delete()
+
+    @classmethod
+    def consume(cls, invoices, quantities):
+        """Превращает резервы оплаченных счетов в списание остатков.
+
+        quantities — {id товара: количество} по позициям счетов. Остаток
+        списывается полностью, резерв снимается в размере еще активных
+        резервов (просроченные уже сняты). Количество сверх активных
+        резервов должно быть в свободном остатке, иначе ValidationError.
+        Комплекты списываются своими комплектующими. Все одним групповым
+        UPDATE.
+        """
+        reservations = cls.objects.filter(invoice__in=invoices)
+        reserved = defaultdict(int)
+        for product_id, quantity in reservations.values_list('product_id', 'quantity'):
+            reserved[product_id] -= quantity
+
+        recipes = KitComponent.recipes(set(quantities) | set(reserved))
+        deltas = KitComponent.expand({product_id: -quantity for product_id, quantity in quantities.items()}, recipes)
+        released = KitComponent.expand(reserved, recipes)
+
+        # позиции без резерва (истек) списываются только из свободного остатка
+        uncovered = {
+            product_id: -delta + released.get(product_id, 0)
+            for product_id, delta in deltas.items()
+            if -delta + released.get(product_id, 0) > 0
+        }
+        if uncovered:
+            rows = Product.objects.select_for_update().filter(pk__in=uncovered).values_list(
+                'id', 'name', 'quantity', 'reserved'
+            )
+            shortages = [
+                f"{name} (доступно {quantity - reserved}, нужно {uncovered[product_id]})"
+                for product_id, name, quantity, reserved in rows
+                if quantity - reserved < uncovered[product_id]
+            ]
+            if shortages:
+                raise ValidationError(
+                    "Резерв по счету истек, а свободного остатка не хватает: " + ", ".join(shortages)
+                )
+
+        Product.adjust_stock(quantity=deltas, reserved=released)
+        reservations.delete()
+
+    @classmethod
+    def release_expired(cls, now=None, batch_size=1000):
+        """Снимает просроченные резервы пачками; возвращает их количество"""
+        now = now or timezone.now()
+        released = 0
+        while True:
+            with transaction.atomic():
+                rows = list(
+                    cls.objects.filter(expires_at__lte=now).order_by('expires_at').values_list(
+                        'id', 'product_id', 'quantity'
+                    )[:batch_size]
+                )
+                if not rows:
+                    return released
+
+                deltas = defaultdict(int)
+                for _, product_id, quantity in rows:
+                    deltas[product_id] -= quantity
+                Product.adjust_stock(reserved=KitComponent.expand(deltas))
+                cls.objects.filter(pk__in=[row[0] for row in rows]).delete()
+            released += len(rows)
+
+
+class CashRegister(models.Model):
+    """Касса (отдел) с собственной нумерацией товарных чеков.
+
+    Счетчик last_number у каждой кассы свой, поэтому кассы не
+    конкурируют за общий последний номер документа.
+    """
+    code = models.CharField(
+        max_length=8,
+        unique=True,
+        validators=[RegexValidator(r'^[0-9A-Za-zА-Яа-яЁё]+$', "Код кассы: только буквы и цифры")],
+        verbose_name="Код"
+    )
+    name = models.CharField(max_length=100, verbose_name="Наименование")
+    last_number = models.PositiveIntegerField(default=0, verbose_name="Последний номер чека")
+    is_active = models.BooleanField(default=True, verbose_name="Работает")
+
+    class Meta:
+        verbose_name = "Касса"
+        verbose_name_plural = "Кассы"
+        ordering = ['code']
+
+    def __str__(self):
+        return f"{self.code} — {self.name}"
+
+    def allocate_numbers(self, count=1):
+        """Выделяет count последовательных номеров чеков этой кассы"""
+        with transaction.atomic():
+            CashRegister.objects.filter(pk=self.pk).update(last_number=F('last_number') + count)
+            last = CashRegister.objects.filter(pk=self.pk).values_list('last_number', flat=True).get()
+        prefix = SaleDocument.NUMBER_PREFIXES['cash']
+        return [f"{prefix}-{self.code}-{num}" for num in range(last - count + 1, last + 1)]
+
+    def current_shift(self):
+        return self.shifts.filter(closed_at__isnull=True).first()
+
+    def open_shift(self):
+        """Возвращает открытую смену кассы, открывая новую при необходимости"""
+        with transaction.atomic():
+            shift = self.current_shift()
+            if shift is None:
+                last = self.shifts.aggregate(last=Max('number'))['last'] or 0
+                shift = self.shifts.create(number=last + 1)
+        return shift
+
+
+class Shift(models.Model):
+    """Кассовая смена.
+
+    Итоги смены накапливаются в транзакции каждого чека (см.
+    SaleDocument.save), поэтому Z-отчет при закрытии — чтение одной строки.
+    """
+    register = models.ForeignKey(
+        CashRegister,
+        on_delete=models.PROTECT,
+        related_name='shifts',
+        verbose_name="Касса"
+    )
+    number = models.PositiveIntegerField(verbose_name="Номер смены")
+    opened_at = models.DateTimeField(default=timezone.now, verbose_name="Открыта")
+    closed_at = models.DateTimeField(null=True, blank=True, verbose_name="Закрыта")
+    sales_total = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        default=0,
+        verbose_name="Продажи за наличные"
+    )
+    returns_total = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        default=0,
+        verbose_name="Возвраты"
+    )
+    sales_count = models.IntegerField(default=0, verbose_name="Чеков продажи")
+    returns_count = models.IntegerField(default=0, verbose_name="Чеков возврата")
+
+    class Meta:
+        verbose_name = "Кассовая смена"
+        verbose_name_plural = "Кассовые смены"
+        ordering = ['-opened_at']
+        constraints = [
+            models.UniqueConstraint(fields=['register', 'number'], name='shift_register_number'),
+            models.UniqueConstraint(
+                fields=['register'],
+                condition=models.Q(closed_at__isnull=True),
+                name='shift_one_open_per_register'
+            ),
+        ]
+
+    def __str__(self):
+        return f"Смена №{self.number} ({self.register.code})"
+
+    def get_absolute_url(self):
+        return reverse('shift_detail', args=[str(self.id)])
+
+    @property
+    def is_open(self):
+        return self.closed_at is None
+
+    @property
+    def net_total(self):
+        return self.sales_total - self.returns_total
+
+    @property
+    def receipt_count(self):
+        return self.sales_count + self.returns_count
+
+    def close(self):
+        """Закрывает смену; итоги уже посчитаны"""
+        Shift.objects.filter(pk=self.pk, closed_at__isnull=True).update(closed_at=timezone.now())
+        self.refresh_from_db()
+        return self
+
+    @staticmethod
+    def document_state(document):
+        """Вклад чека в итоги смены"""
+        return {
+            'shift_id': document.shift_id,
+            'type': document.type,
+            'total': document.total,
+        }
+
+    @classmethod
+    def apply_changes(cls, changes):
+        """Переносит в итоги смен пачку изменений чеков (пар old, new)"""
+        deltas = {}
+        contributions = (
+            (state, sign)
+            for old, new in changes
+            for state, sign in ((old, -1), (new, 1))
+        )
+        for state, sign in contributions:
+            if not state or not state.get('shift_id'):
+                continue
+            delta = deltas.setdefault(state['shift_id'], defaultdict(int))
+            kind = 'returns' if state['type'] == 'return' else 'sales'
+            delta[f'{kind}_total'] += Decimal(state['total'] or 0) * sign
+            delta[f'{kind}_count'] += sign
+
+        for shift_id, delta in deltas.items():
+            updates = {field: F(field) + value for field, value in delta.items() if value}
+            if updates:
+                cls.objects.filter(pk=shift_id).update(**updates)
+
+
+class SaleDocument(LoadedValuesMixin, models.Model):
     """Базовый класс для документов продаж"""
     DOC_TYPES = (
         ('cashless', 'Безналичная продажа'),
         ('cash', 'Наличная продажа'),
         ('return', 'Возврат товара'),
     )
+    NUMBER_PREFIXES = {
+        'cashless': 'БН',
+        'cash': 'ТЧ',
+        'return': 'ВР',
+    }
 
     type = models.CharField(
         max_length=10,
@@ -271,6 +1198,35 @@ class SaleDocument(models.Model):
         verbose_name="Причина возврата"
     )
 
+    register = models.ForeignKey(
+        CashRegister,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='documents',
+        verbose_name="Касса"
+    )
+    cache_version = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Версия для кэша"
+    )
+    client_uuid = models.UUIDField(
+        null=True,
+        blank=True,
+        unique=True,
+        editable=False,
+        verbose_name="Идентификатор чека на кассе"
+    )
+    shift = models.ForeignKey(
+        Shift,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='documents',
+        verbose_name="Смена"
+    )
+
     customer = models.ForeignKey(
         Customer,
         on_delete=models.PROTECT,
@@ -283,6 +1239,7 @@ class SaleDocument(models.Model):
         ordering = ['-date', '-id']
         indexes = [
             models.Index(fields=['type', 'date']),
+            models.Index(fields=['date']),
             models.Index(fields=['customer']),
         ]
 
@@ -337,45 +1294,136 @@ class SaleDocument(models.Model):
                     )
 
     def save(self, *args, **kwargs):
-        if hasattr(self, '_saving'):
-            return  # предотвращаем рекурсию
-        self._saving = True  # устанавливаем флаг
-
-        # Генерация номера документа
-        if not self.number:
-            prefix = {
-                'cashless': 'БН',
-                'cash': 'ТЧ',
-                'return': 'ВР'
-            }[self.type]
-
-            last_doc = SaleDocument.objects.filter(
-                type=self.type
-            ).order_by('-id').first()
+        # Сумма и остатки пересчитываются явно (update_total и
+        # update_product_quantities): при сохранении документа без позиций
+        # пересчет обнулил бы сумму, перенесенную, например, из счета.
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                previous = SaleDocument.objects.filter(pk=self.pk).values(
+                    'customer_id', 'type', 'date', 'total', 'shift_id'
+                ).first()
+
+            if self.type == 'return' and not self.pk and not self.register_id and self.original_sale_id:
+                # возврат принимает касса продажи: он попадает в итоги ее текущей смены
+                self.register_id = SaleDocument.objects.filter(pk=self.original_sale_id).values_list(
+                    'register_id', flat=True
+                ).first()
+
+            if self.register_id and not self.pk:
+                if not self.shift_id:
+                    self.shift = self.register.open_shift()
+                if not self.cash_register:
+                    self.cash_register = self.register.code
+
+            # Генерация номера документа: чеки кассы нумеруются ее счетчиком
+            if not self.number:
+                if self.register_id and self.type == 'cash':
+                    self.number = self.register.allocate_numbers(1)[0]
+                else:
+                    self.number = SaleDocument.allocate_numbers(self.type, 1)[0]
 
-            last_num = int(last_doc.number.split('-')[-1]) if last_doc else 0
-            self.number = f"{prefix}-{last_num + 1}"
+            super().save(*args, **kwargs)
+            if previous:
+                # изменение документа или его позиций (через update_total)
+                bump_cache_version(SaleDocument, self.pk)
+            CustomerStats.apply_change(previous, CustomerStats.document_state(self))
+            Shift.apply_changes([(previous, Shift.document_state(self))])
+
+    @staticmethod
+    def numbered(manager, doc_type):
+        """Документы типа doc_type с общей нумерацией"""
+        qs = manager.filter(type=doc_type)
+        if doc_type == 'cash':
+            # чеки касс (register) нумеруются собственными счетчиками
+            qs = qs.filter(register_id__isnull=True)
+        return qs
+
+    @classmethod
+    def allocate_numbers(cls, doc_type, count):
+        """Выделяет count последовательных номеров документов типа doc_type"""
+        from .archive import archive_boundary
+
+        last_doc = cls.numbered(cls.objects, doc_type).order_by('-id').values_list('number', flat=True).first()
+        if not last_doc and archive_boundary():
+            # все документы типа могли уйти в архив — продолжаем его нумерацию
+            last_doc = cls.numbered(ArchivedSaleDocument.objects, doc_type).order_by('-id').values_list(
+                'number', flat=True
+            ).first()
+        last_num = int(last_doc.split('-')[-1]) if last_doc else 0
+        prefix = cls.NUMBER_PREFIXES[doc_type]
+        return [f"{prefix}-{num}" for num in range(last_num + 1, last_num + count + 1)]
+
+    @classmethod
+    def create_from_invoices(cls, invoices):
+        """Создает безналичные продажи по оплаченным счетам пачкой.
+
+        Позиции всех счетов читаются одним запросом и копируются
+        bulk_create; продажи получают суммы позиций и последовательные
+        номера. Резервы счетов превращаются в списание остатков одним
+        групповым UPDATE.
+        """
+        items_by_invoice = defaultdict(list)
+        quantities = defaultdict(int)
+        rows = InvoiceItem.objects.filter(invoice__in=invoices).values_list(
+            'invoice_id', 'product_id', 'quantity', 'price'
+        )
+        for invoice_id, product_id, quantity, price in rows:
+            items_by_invoice[invoice_id].append(
+                DocumentItem(product_id=product_id, quantity=quantity, price=price)
+            )
+            quantities[product_id] += quantity
 
-        super().save(*args, **kwargs)
+        numbers = cls.allocate_numbers('cashless', len(invoices))
+        sales = [
+            cls(
+                type='cashless',
+                number=number,
+                customer_id=invoice.customer_id,
+                invoice=invoice,
+                total=sum((item.total for item in items_by_invoice[invoice.pk]), Decimal('0.00')),
+            )
+            for invoice, number in zip(invoices, numbers)
+        ]
 
-        try:
-            self.update_total()  # пересчитать сумму после сохранения
-            self.update_product_quantities()  # обновить остатки
-        finally:
-            delattr(self, '_saving')  # снимаем флаг
+        with transaction.atomic():
+            cls.objects.bulk_create(sales)
+
+            items = []
+            for sale in sales:
+                for item in items_by_invoice[sale.invoice_id]:
+                    item.document = sale
+                    items.append(item)
+            DocumentItem.objects.bulk_create(items)
+            StockReservation.consume(invoices, quantities)
+
+            CustomerStats.apply_changes(
+                (None, CustomerStats.document_state(sale)) for sale in sales
+            )
+            # bulk_create не отправляет post_save
+            transaction.on_commit(partial(bump_data_version, 'sales'))
+        return sales
 
     def update_product_quantities(self):
-        """Обновляет остатки товаров в зависимости от типа документа"""
+        """Обновляет остатки товаров в зависимости от типа документа.
+
+        Комплекты списываются (возвращаются) своими комплектующими;
+        все остатки документа меняются одним UPDATE в режиме
+        STORE_STOCK_LOCKING, продажа сверх доступного остатка отклоняется.
+        """
         if self.type == 'return':
-            # Возврат - увеличиваем остатки
-            for item in self.items.all():
-                item.product.quantity += item.quantity
-                item.product.save()
+            sign = 1  # Возврат - увеличиваем остатки
         elif self.type in ['cash', 'cashless']:
-            # Продажа - уменьшаем остатки
-            for item in self.items.all():
-                item.product.quantity -= item.quantity
-                item.product.save()
+            sign = -1  # Продажа - уменьшаем остатки
+        else:
+            return
+
+        deltas = defaultdict(int)
+        for product_id, quantity in self.items.values_list('product_id', 'quantity'):
+            deltas[product_id] += sign * quantity
+
+        with transaction.atomic():
+            Product.change_stock(KitComponent.expand(deltas), check_available=True)
 
 
     def delete(self, *args, **kwargs):
@@ -383,21 +1431,28 @@ class SaleDocument(models.Model):
         doc_type = self.type
 
         with transaction.atomic():
+            # Возвраты удаляются каскадом, минуя delete(), — учитываем их здесь
+            removed = [dict(CustomerStats.document_state(self), shift_id=self.shift_id)]
+            removed += list(self.returns.values('customer_id', 'type', 'date', 'total', 'shift_id'))
+            register_id = self.register_id
+
             super().delete(*args, **kwargs)
 
+            CustomerStats.apply_changes((state, None) for state in removed)
+            Shift.apply_changes((state, None) for state in removed)
+
+            if register_id and doc_type == 'cash':
+                # номера чеков кассы не перенумеровываются
+                return
+
             try:
-                prefix = {
-                    'cashless': 'БН',
-                    'cash': 'ТЧ',
-                    'return': 'ВР'
-                }[doc_type]
+                prefix = self.NUMBER_PREFIXES[doc_type]
                 current_num = int(current_number.split('-')[-1])
             except (KeyError, ValueError, IndexError):
                 return
 
             # Находим документы с номером больше текущего
-            docs_to_update = SaleDocument.objects.filter(
-                type=doc_type,
+            docs_to_update = self.numbered(SaleDocument.objects, doc_type).filter(
                 number__startswith=prefix
             )
 
@@ -427,7 +1482,7 @@ class SaleDocument(models.Model):
     )
 
 
-class DocumentItem(models.Model):
+class DocumentItem(LoadedValuesMixin, models.Model):
     document = models.ForeignKey(
         SaleDocument,
         on_delete=models.CASCADE,
@@ -491,8 +1546,10 @@ class DocumentItem(models.Model):
         self.document.update_total()
 
     def delete(self, *args, **kwargs):
-        super().delete(*args, **kwargs)
-        self.document.update_total()
+        with transaction.atomic():
+            item_deleted.send(sender=DocumentItem, instance=self)
+            super().delete(*args, **kwargs)
+            self.document.update_total()
 
     @property
     def total(self):
@@ -716,3 +1773,495 @@ class SalesReport(models.Model):
             })
 
         return formatted_data
+
+
+class Watermark(models.Model):
+    """Отметка последней обработанной записи для инкрементальных пересчетов"""
+    name = models.CharField(max_length=50, unique=True, verbose_name="Процесс")
+    last_id = models.BigIntegerField(default=0, verbose_name="Последний id")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+
+    class Meta:
+        verbose_name = "Отметка обработки"
+        verbose_name_plural = "Отметки обработки"
+
+    def __str__(self):
+        return f"{self.name}: {self.last_id}"
+
+    @classmethod
+    def get(cls, name):
+        return cls.objects.filter(name=name).values_list('last_id', flat=True).first() or 0
+
+    @classmethod
+    def set(cls, name, last_id):
+        cls.objects.update_or_create(name=name, defaults={'last_id': last_id})
+
+
+class ProductDailySales(models.Model):
+    """Чистые продажи товара за день (продажи минус возвраты), в штуках"""
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='daily_sales',
+        verbose_name="Товар"
+    )
+    date = models.DateField(verbose_name="Дата")
+    quantity = models.IntegerField(default=0, verbose_name="Продано, шт.")
+
+    class Meta:
+        verbose_name = "Продажи товара за день"
+        verbose_name_plural = "Продажи товаров по дням"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['product', 'date'],
+                name='unique_product_daily_sales'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['date']),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} {self.date}: {self.quantity} шт."
+
+
+class StockForecast(models.Model):
+    """Прогноз исчерпания остатка товара (пересчитывается по ночам)"""
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='forecast',
+        verbose_name="Товар"
+    )
+    daily_rate = models.FloatField(default=0, verbose_name="Продаж в день")
+    days_left = models.FloatField(null=True, blank=True, verbose_name="Дней до исчерпания")
+    stockout_date = models.DateField(null=True, blank=True, verbose_name="Дата исчерпания")
+    reorder_quantity = models.IntegerField(default=0, verbose_name="Рекомендуемый заказ")
+    computed_at = models.DateTimeField(verbose_name="Дата расчета")
+
+    class Meta:
+        verbose_name = "Прогноз остатка"
+        verbose_name_plural = "Прогнозы остатков"
+        indexes = [
+            models.Index(fields=['days_left']),
+        ]
+
+    def __str__(self):
+        return f"Прогноз: {self.product_id}"
+
+
+class SalesCubeCell(models.Model):
+    """Ячейка куба продаж: итоги позиций документов за день по товару,
+    покупателю и типу документа (пересчитывается командой refresh_sales_cube)"""
+    date = models.DateField(verbose_name="Дата")
+    type = models.CharField(max_length=10, choices=SaleDocument.DOC_TYPES, verbose_name="Тип")
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name="Товар"
+    )
+    customer = models.ForeignKey(
+        Customer,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name="Покупатель"
+    )
+    quantity = models.IntegerField(default=0, verbose_name="Количество")
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Сумма")
+    lines = models.IntegerField(default=0, verbose_name="Позиций")
+
+    class Meta:
+        verbose_name = "Ячейка куба продаж"
+        verbose_name_plural = "Куб продаж"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'type', 'product', 'customer'],
+                name='unique_sales_cube_cell'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['product', 'date']),
+            models.Index(fields=['customer', 'date']),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.type} {self.product_id}/{self.customer_id}: {self.amount}"
+
+
+class IdempotencyKey(models.Model):
+    """Результат POST-запроса с ключом Idempotency-Key.
+
+    Повтор запроса с тем же ключом получает сохраненный ответ без
+    повторного создания документов (см. store.middleware).
+    status пуст, пока первый запрос выполняется.
+    """
+    key = models.CharField(max_length=64, unique=True, verbose_name="Ключ")
+    fingerprint = models.CharField(max_length=64, verbose_name="Отпечаток запроса")
+    status = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Код ответа")
+    content_type = models.CharField(max_length=100, blank=True, verbose_name="Тип ответа")
+    location = models.CharField(max_length=500, blank=True, verbose_name="Адрес перенаправления")
+    body = models.BinaryField(blank=True, default=b'', verbose_name="Тело ответа")
+    created_at = models.DateTimeField(default=timezone.now, db_index=True, verbose_name="Дата создания")
+
+    class Meta:
+        verbose_name = "Ключ идемпотентности"
+        verbose_name_plural = "Ключи идемпотентности"
+
+    def __str__(self):
+        return self.key
+
+    @classmethod
+    def purge(cls, before, batch_size=10000):
+        """Удаляет ключи старше before пачками; возвращает их количество"""
+        deleted = 0
+        while True:
+            ids = list(cls.objects.filter(created_at__lt=before).values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            deleted += cls.objects.filter(pk__in=ids).delete()[0]
+
+
+class AuditEntry(models.Model):
+    """Запись журнала изменений (только добавление, см. store.audit).
+
+    changes — измененные поля: при изменении {поле: [было, стало]},
+    при создании и удалении {поле: значение}, для остатков {поле: изменение}.
+    """
+    ACTIONS = (
+        ('create', 'Создание'),
+        ('update', 'Изменение'),
+        ('delete', 'Удаление'),
+        ('stock', 'Изменение остатка'),
+    )
+
+    model = models.CharField(max_length=50, verbose_name="Модель")
+    object_id = models.BigIntegerField(verbose_name="id объекта")
+    action = models.CharField(max_length=10, choices=ACTIONS, verbose_name="Действие")
+    changes = models.JSONField(encoder=DjangoJSONEncoder, default=dict, verbose_name="Изменения")
+    user = models.CharField(max_length=150, blank=True, verbose_name="Пользователь")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Дата")
+
+    class Meta:
+        verbose_name = "Запись журнала изменений"
+        verbose_name_plural = "Журнал изменений"
+        indexes = [
+            models.Index(fields=['model', 'object_id', 'created_at']),
+            models.Index(fields=['created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.model} {self.object_id}: {self.get_action_display()}"
+
+    def save(self, *args, **kwargs):
+        if self.pk:
+            raise ValueError("Записи журнала изменений не изменяются")
+        super().save(*args, **kwargs)
+
+
+# Архив закрытых периодов (база 'archive', см. store.routers).
+# Связи с оперативной базой хранятся как простые id: внешние ключи
+# между базами невозможны, поэтому имена покупателей и товаров копируются.
+
+class ArchivePeriod(models.Model):
+    """Закрытый период: документы до cutoff перенесены в архив"""
+    cutoff = models.DateField(unique=True, verbose_name="Документы до даты")
+    closed_at = models.DateTimeField(default=timezone.now, verbose_name="Дата закрытия")
+    documents = models.IntegerField(default=0, verbose_name="Перенесено документов")
+    items = models.IntegerField(default=0, verbose_name="Перенесено позиций")
+
+    class Meta:
+        verbose_name = "Закрытый период"
+        verbose_name_plural = "Закрытые периоды"
+        ordering = ['-cutoff']
+
+    def __str__(self):
+        return f"Период до {self.cutoff}"
+
+
+class ArchivedSaleDocument(models.Model):
+    """Документ продажи закрытого периода (id сохраняется)"""
+    id = models.BigIntegerField(primary_key=True)
+    type = models.CharField(max_length=10, choices=SaleDocument.DOC_TYPES, verbose_name="Тип")
+    number = models.CharField(max_length=20, verbose_name="Номер")
+    date = models.DateField(verbose_name="Дата")
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Сумма")
+    customer_id = models.BigIntegerField(verbose_name="Покупатель (id)")
+    customer_name = models.CharField(max_length=255, verbose_name="Покупатель")
+    invoice_id = models.BigIntegerField(null=True, blank=True, verbose_name="Счет (id)")
+    original_sale_id = models.BigIntegerField(null=True, blank=True, verbose_name="Оригинальная продажа (id)")
+    cash_register = models.CharField(max_length=50, blank=True, verbose_name="Номер кассы/отдела")
+    register_id = models.BigIntegerField(null=True, blank=True, verbose_name="Касса (id)")
+    shift_id = models.BigIntegerField(null=True, blank=True, verbose_name="Смена (id)")
+    reason = models.TextField(blank=True, verbose_name="Причина возврата")
+    created_at = models.DateTimeField(verbose_name="Дата создания")
+
+    class Meta:
+        verbose_name = "Архивный документ продажи"
+        verbose_name_plural = "Архивные документы продаж"
+        ordering = ['-date', '-id']
+        indexes = [
+            models.Index(fields=['type', 'date']),
+            models.Index(fields=['date']),
+            models.Index(fields=['customer_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_type_display()} №{self.number} (архив)"
+
+
+class ArchivedDocumentItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    document = models.ForeignKey(
+        ArchivedSaleDocument,
+        on_delete=models.CASCADE,
+        related_name='items',
+        verbose_name="Документ"
+    )
+    product_id = models.BigIntegerField(verbose_name="Товар (id)")
+    product_name = models.CharField(max_length=255, verbose_name="Товар")
+    quantity = models.IntegerField(verbose_name="Количество")
+    price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Цена")
+
+    class Meta:
+        verbose_name = "Архивная позиция документа"
+        verbose_name_plural = "Архивные позиции документов"
+
+    @property
+    def total(self):
+        return self.price * self.quantity
+
+
+class ArchivedDailySales(models.Model):
+    """Итоги архивных документов по дням и типам"""
+    date = models.DateField(verbose_name="Дата")
+    type = models.CharField(max_length=10, choices=SaleDocument.DOC_TYPES, verbose_name="Тип")
+    documents = models.IntegerField(default=0, verbose_name="Документов")
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Сумма")
+
+    class Meta:
+        verbose_name = "Итог архива за день"
+        verbose_name_plural = "Итоги архива по дням"
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'type'], name='archived_daily_sales_date_type'),
+        ]
+
+
+class StockSnapshot(models.Model):
+    """Остатки товаров на момент закрытия периода"""
+    cutoff = models.DateField(verbose_name="Период до даты")
+    product_id = models.BigIntegerField(verbose_name="Товар (id)")
+    product_name = models.CharField(max_length=255, verbose_name="Товар")
+    quantity = models.IntegerField(verbose_name="Остаток")
+    reserved = models.IntegerField(default=0, verbose_name="В резерве")
+    taken_at = models.DateTimeField(default=timezone.now, verbose_name="Снят")
+
+    class Meta:
+        verbose_name = "Снимок остатков"
+        verbose_name_plural = "Снимки остатков"
+        constraints = [
+            models.UniqueConstraint(fields=['cutoff', 'product_id'], name='stock_snapshot_cutoff_product'),
+        ]
+
+
+class Stocktake(models.Model):
+    """Инвентаризация: фактические остатки товаров на дату пересчета"""
+    number = models.CharField(max_length=20, unique=True, verbose_name="Номер")
+    date = models.DateField(default=timezone.localdate, verbose_name="Дата")
+    full = models.BooleanField(
+        default=False,
+        verbose_name="Полная инвентаризация",
+        help_text="Товары, которых нет в пересчете, списываются в ноль"
+    )
+    comment = models.CharField(max_length=255, blank=True, verbose_name="Комментарий")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    posted_at = models.DateTimeField(null=True, blank=True, verbose_name="Проведена")
+
+    class Meta:
+        verbose_name = "Инвентаризация"
+        verbose_name_plural = "Инвентаризации"
+        ordering = ['-date', '-id']
+
+    def __str__(self):
+        return f"Инвентаризация №{self.number} от {self.date:%d.%m.%Y}"
+
+    def get_absolute_url(self):
+        return reverse('stocktake_detail', args=[self.pk])
+
+    def save(self, *args, **kwargs):
+        if not self.number:
+            last = Stocktake.objects.order_by('-id').first()
+            last_num = int(last.number.split('-')[-1]) if last else 0
+            self.number = f"ИНВ-{last_num + 1}"
+        super().save(*args, **kwargs)
+
+    @property
+    def is_posted(self):
+        return self.posted_at is not None
+
+    @classmethod
+    def from_counts(cls, counts, full=False, comment='', batch_size=1000):
+        """Черновик инвентаризации со строками {id товара: фактическое количество}"""
+        with transaction.atomic():
+            stocktake = cls.objects.create(full=full, comment=comment)
+            StocktakeLine.objects.bulk_create(
+                [
+                    StocktakeLine(stocktake=stocktake, product_id=product_id, counted=counted)
+                    for product_id, counted in counts.items()
+                ],
+                batch_size=batch_size,
+            )
+        return stocktake
+
+    def post(self):
+        """Проводит инвентаризацию; возвращает число товаров с расхождением.
+
+        Расхождения со всем каталогом считаются и списываются несколькими
+        UPDATE ... SELECT по строкам документа, без загрузки товаров в
+        Python: остаток по учету и разница записываются в строки, остатки
+        товаров меняются на разницу одним UPDATE, движения — одним
+        INSERT ... SELECT в StockMovement. Остатки пишутся в режиме
+        STORE_STOCK_LOCKING, см. _apply_counts.
+        """
+        with transaction.atomic():
+            # отметка проведения — первой записью: повторное проведение ничего не меняет
+            if not Stocktake.objects.filter(pk=self.pk, posted_at__isnull=True).update(posted_at=timezone.now()):
+                raise ValidationError("Инвентаризация уже проведена")
+
+            for attempt in range(1, settings.STORE_STOCK_MAX_RETRIES + 1):
+                with transaction.atomic():
+                    if self._apply_counts(settings.STORE_STOCK_LOCKING):
+                        break
+                    # остатки изменили между чтением и записью — пересчитываем заново
+                    transaction.set_rollback(True)
+                time.sleep(random.uniform(0, 0.001 * 2 ** attempt))
+            else:
+                raise ValidationError(
+                    "Остатки товаров одновременно изменяют другие пользователи. Повторите проведение."
+                )
+
+            changed = StocktakeLine.objects.filter(stocktake=self).exclude(difference=0)
+            deltas = dict(changed.values_list('product_id', 'difference'))
+            if deltas:
+                KitComponent.refresh_for_components(deltas)
+                stock_changed.send(sender=Product, deltas=deltas)
+                transaction.on_commit(partial(bump_data_version, 'catalog'))
+        self.refresh_from_db(fields=['posted_at'])
+        return len(deltas)
+
+    def _apply_counts(self, mode):
+        """Записывает расхождения в строки и остатки товаров.
+
+        В пессимистичном режиме (STORE_STOCK_LOCKING) товары документа
+        блокируются до чтения остатков по учету; в оптимистичном остаток
+        меняется, только если он равен прочитанному. Возвращает False,
+        если какой-то остаток успели изменить — тогда вызывающий
+        откатывает запись и повторяет ее.
+        """
+        qn = connection.ops.quote_name
+        line_table = qn(StocktakeLine._meta.db_table)
+        product_table = qn(Product._meta.db_table)
+        movement_table = qn(StockMovement._meta.db_table)
+        with connection.cursor() as cursor:
+            if self.full:
+                cursor.execute(f"""
+                    INSERT INTO {line_table} ("stocktake_id", "product_id", "counted")
+                    SELECT %s, p."id", 0 FROM {product_table} p
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM {line_table} l WHERE l."stocktake_id" = %s AND l."product_id" = p."id"
+                    )
+                """, [self.pk, self.pk])
+
+            lines = StocktakeLine.objects.filter(stocktake=self)
+            if mode == 'pessimistic':
+                list(Product.objects.select_for_update().filter(
+                    pk__in=lines.values('product_id')
+                ).values_list('pk', flat=True))
+            lines.update(
+                book_quantity=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('quantity')[:1])
+            )
+            lines.update(difference=F('counted') - F('book_quantity'))
+
+            changed = lines.exclude(difference=0)
+            line = changed.filter(product=OuterRef('pk'))
+            products = Product.objects.filter(pk__in=changed.values('product_id'))
+            if mode != 'pessimistic':
+                products = products.filter(quantity=Subquery(line.values('book_quantity')[:1]))
+            updated = products.update(
+                quantity=F('quantity') + Subquery(line.values('difference')[:1]),
+                version=F('version') + 1,
+                updated_at=timezone.now(),
+            )
+            if updated != changed.count():
+                return False
+            cursor.execute(f"""
+                INSERT INTO {movement_table} ("product_id", "quantity", "balance", "kind", "stocktake_id", "created_at")
+                SELECT "product_id", "difference", "counted", 'stocktake', "stocktake_id", %s
+                FROM {line_table} WHERE "stocktake_id" = %s AND "difference" <> 0
+            """, [connection.ops.adapt_datetimefield_value(timezone.now()), self.pk])
+        return True
+
+
+class StocktakeLine(models.Model):
+    stocktake = models.ForeignKey(
+        Stocktake,
+        on_delete=models.CASCADE,
+        related_name='lines',
+        verbose_name="Инвентаризация"
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.PROTECT,
+        related_name='+',
+        verbose_name="Товар"
+    )
+    counted = models.IntegerField(validators=[MinValueValidator(0)], verbose_name="Фактически")
+    book_quantity = models.IntegerField(null=True, blank=True, verbose_name="По учету")
+    difference = models.IntegerField(null=True, blank=True, verbose_name="Расхождение")
+
+    class Meta:
+        verbose_name = "Строка инвентаризации"
+        verbose_name_plural = "Строки инвентаризации"
+        constraints = [
+            models.UniqueConstraint(fields=['stocktake', 'product'], name='stocktake_line_product'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.counted} шт."
+
+
+class StockMovement(models.Model):
+    """Журнал движения остатков: изменение остатка товара и его основание"""
+    KINDS = (
+        ('stocktake', 'Инвентаризация'),
+    )
+
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='movements',
+        verbose_name="Товар"
+    )
+    quantity = models.IntegerField(verbose_name="Изменение")
+    balance = models.IntegerField(verbose_name="Остаток после")
+    kind = models.CharField(max_length=20, choices=KINDS, verbose_name="Вид")
+    stocktake = models.ForeignKey(
+        Stocktake,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='movements',
+        verbose_name="Инвентаризация"
+    )
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Дата")
+
+    class Meta:
+        verbose_name = "Движение товара"
+        verbose_name_plural = "Движения товаров"
+        indexes = [
+            models.Index(fields=['product', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()}: товар {self.product_id} {self.quantity:+} шт."
@@ -0,0 +1,274 @@
+"""Сводный отчет по кубу продаж.
+
+Позиции документов заранее сгруппированы в SalesCubeCell по дню, типу
+документа, товару и покупателю (manage.py refresh_sales_cube добавляет
+позиции после отметки одним INSERT ... SELECT на порцию). Сводная таблица —
+один GROUP BY по кубу: строки и столбцы — любые из измерений товар,
+покупатель, тип, день/неделя/месяц; срез по товару, покупателю, типу и
+периоду — фильтр по кубу. Документы и позиции отчет не читает.
+"""
+import calendar
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Case, Count, DecimalField, F, Max, Sum, When
+from django.db.models.functions import TruncMonth, TruncWeek
+
+from .archive import archive_boundary
+from .models import (
+    ArchivedDocumentItem, Customer, DocumentItem, Product, SaleDocument, SalesCubeCell, Watermark,
+)
+
+WATERMARK = 'sales_cube'
+
+CHUNK_SIZE = 50_000
+BATCH_SIZE = 1000
+
+DIMENSIONS = {
+    'product': ("Товар", F('product_id')),
+    'customer': ("Покупатель", F('customer_id')),
+    'type': ("Тип документа", F('type')),
+    'day': ("День", F('date')),
+    'week': ("Неделя", TruncWeek('date')),
+    'month': ("Месяц", TruncMonth('date')),
+}
+
+MEASURES = {
+    'net': (
+        "Выручка за вычетом возвратов",
+        Sum(Case(When(type='return', then=F('amount') * -1), default=F('amount'), output_field=DecimalField())),
+    ),
+    'amount': ("Сумма документов", Sum('amount')),
+    'quantity': ("Количество, шт.", Sum('quantity')),
+    'lines': ("Позиций", Sum('lines')),
+}
+
+# измерения, по которым делается срез (фильтр по значению)
+SLICE_DIMENSIONS = ('product', 'customer', 'type')
+
+# детализация и свертка по времени
+DRILL_DOWN = {'month': 'week', 'week': 'day'}
+ROLL_UP = {'day': 'week', 'week': 'month'}
+
+
+def refresh_cube(full=False):
+    """Добавляет в куб позиции, появившиеся после прошлого запуска.
+
+    full — пересобрать куб, включая архив закрытых периодов. Позиции,
+    перенесенные в архив раньше, чем попали в куб, добавляются из архива
+    (id позиций при переносе сохраняются, поэтому отметка общая).
+    Изменения и удаления уже учтенных документов попадают в куб только
+    при пересборке. Возвращает число обработанных позиций.
+    """
+    if full:
+        with transaction.atomic():
+            SalesCubeCell.objects.all().delete()
+            Watermark.set(WATERMARK, 0)
+
+    last_id = Watermark.get(WATERMARK)
+    max_id = DocumentItem.objects.aggregate(last=Max('id'))['last'] or 0
+    with_archive = bool(archive_boundary())
+    if with_archive:
+        archived_max = ArchivedDocumentItem.objects.filter(id__gt=last_id).aggregate(last=Max('id'))['last']
+        max_id = max(max_id, archived_max or 0)
+
+    processed = 0
+    while last_id < max_id:
+        upper = min(last_id + CHUNK_SIZE, max_id)
+        with transaction.atomic():
+            _merge_items(last_id, upper)
+            if with_archive:
+                processed += _merge_archived_items(last_id, upper)
+            Watermark.set(WATERMARK, upper)
+        processed += DocumentItem.objects.filter(id__gt=last_id, id__lte=upper).count()
+        last_id = upper
+    return processed
+
+
+def _merge_items(after_id, upper):
+    """Группирует позиции с id в (after_id, upper] и прибавляет к ячейкам куба.
+
+    Один INSERT ... SELECT ... ON CONFLICT: строки позиций не
+    загружаются в Python.
+    """
+    qn = connection.ops.quote_name
+    cube = qn(SalesCubeCell._meta.db_table)
+    item = qn(DocumentItem._meta.db_table)
+    document = qn(SaleDocument._meta.db_table)
+    sql = f"""
+        INSERT INTO {cube} ("date", "type", "product_id", "customer_id", "quantity", "amount", "lines")
+        SELECT d."date", d."type", i."product_id", d."customer_id",
+               SUM(i."quantity"), SUM(i."quantity" * i."price"), COUNT(*)
+        FROM {item} i JOIN {document} d ON d."id" = i."document_id"
+        WHERE i."id" > %s AND i."id" <= %s
+        GROUP BY d."date", d."type", i."product_id", d."customer_id"
+        ON CONFLICT ("date", "type", "product_id", "customer_id") DO UPDATE SET
+            "quantity" = {cube}."quantity" + excluded."quantity",
+            "amount" = {cube}."amount" + excluded."amount",
+            "lines" = {cube}."lines" + excluded."lines"
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [after_id, upper])
+
+
+def _merge_archived_items(after_id, upper):
+    # архив в другой базе, поэтому группировка — в архиве, сложение — в Python
+    rows = ArchivedDocumentItem.objects.filter(id__gt=after_id, id__lte=upper).values(
+        cell_date=F('document__date'),
+        cell_type=F('document__type'),
+        cell_product=F('product_id'),
+        cell_customer=F('document__customer_id'),
+    ).annotate(
+        cell_quantity=Sum('quantity'),
+        cell_amount=Sum(F('quantity') * F('price')),
+        cell_lines=Count('id'),
+    ).order_by()
+    increments = {
+        (row['cell_date'], row['cell_type'], row['cell_product'], row['cell_customer']): (
+            row['cell_quantity'], row['cell_amount'], row['cell_lines']
+        )
+        for row in rows
+    }
+    if increments:
+        _add_cells(increments)
+    return sum(lines for _, _, lines in increments.values())
+
+
+def _add_cells(increments):
+    product_ids = {key[2] for key in increments}
+    customer_ids = {key[3] for key in increments}
+    dates = {key[0] for key in increments}
+    # товары и покупатели архивных документов могли быть удалены
+    product_ids = set(Product.objects.filter(pk__in=product_ids).values_list('id', flat=True))
+    customer_ids = set(Customer.objects.filter(pk__in=customer_ids).values_list('id', flat=True))
+
+    existing = {}
+    rows = SalesCubeCell.objects.filter(
+        product_id__in=product_ids, date__range=(min(dates), max(dates))
+    ).values_list('date', 'type', 'product_id', 'customer_id', 'quantity', 'amount', 'lines')
+    for day, doc_type, product_id, customer_id, quantity, amount, lines in rows:
+        existing[(day, doc_type, product_id, customer_id)] = (quantity, amount, lines)
+
+    cells = []
+    for key, (quantity, amount, lines) in increments.items():
+        day, doc_type, product_id, customer_id = key
+        if product_id not in product_ids or customer_id not in customer_ids:
+            continue
+        old_quantity, old_amount, old_lines = existing.get(key, (0, 0, 0))
+        cells.append(SalesCubeCell(
+            date=day,
+            type=doc_type,
+            product_id=product_id,
+            customer_id=customer_id,
+            quantity=old_quantity + quantity,
+            amount=old_amount + amount,
+            lines=old_lines + lines,
+        ))
+    SalesCubeCell.objects.bulk_create(
+        cells,
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['date', 'type', 'product', 'customer'],
+        update_fields=['quantity', 'amount', 'lines'],
+    )
+
+
+def cube_updated_at():
+    return Watermark.objects.filter(name=WATERMARK).values_list('updated_at', flat=True).first()
+
+
+def member_range(dimension, value):
+    """Первый и последний день элемента временного измерения"""
+    if dimension == 'week':
+        return value, value + timedelta(days=6)
+    if dimension == 'month':
+        return value, value.replace(day=calendar.monthrange(value.year, value.month)[1])
+    return value, value
+
+
+def drill_down(dimension, value):
+    """Следующее измерение строк и срез при детализации элемента value.
+
+    Месяц раскрывается по неделям, неделя — по дням; товар, покупатель
+    или тип становятся срезом, а строки — месяцами.
+    """
+    if dimension in DRILL_DOWN:
+        return DRILL_DOWN[dimension], dict(zip(('start_date', 'end_date'), member_range(dimension, value)))
+    if dimension in SLICE_DIMENSIONS:
+        return 'month', {dimension: value}
+    return None, {}
+
+
+def _labels(dimension, keys):
+    if dimension == 'product':
+        names = dict(Product.objects.filter(pk__in=keys).values_list('id', 'name'))
+    elif dimension == 'customer':
+        names = dict(Customer.objects.filter(pk__in=keys).values_list('id', 'name'))
+    elif dimension == 'type':
+        names = dict(SaleDocument.DOC_TYPES)
+    elif dimension == 'month':
+        return {key: f"{key:%m.%Y}" for key in keys}
+    elif dimension == 'week':
+        return {key: f"{key:%d.%m}–{key + timedelta(days=6):%d.%m.%Y}" for key in keys}
+    else:
+        return {key: f"{key:%d.%m.%Y}" for key in keys}
+    return {key: names.get(key, str(key)) for key in keys}
+
+
+def _ordered(dimension, labels):
+    if dimension in ('product', 'customer'):
+        return sorted(labels, key=lambda key: (labels[key], key))
+    if dimension == 'type':
+        order = [value for value, _ in SaleDocument.DOC_TYPES]
+        return sorted(labels, key=order.index)
+    return sorted(labels)
+
+
+def pivot(rows, columns=None, measure='net', start_date=None, end_date=None, slices=None):
+    """Сводная таблица по кубу одним запросом.
+
+    rows, columns — измерения строк и столбцов (columns может быть
+    пустым), slices — {измерение: значение} для среза по товару,
+    покупателю или типу.
+    """
+    qs = SalesCubeCell.objects.all()
+    if start_date:
+        qs = qs.filter(date__gte=start_date)
+    if end_date:
+        qs = qs.filter(date__lte=end_date)
+    for dimension, value in (slices or {}).items():
+        qs = qs.filter(**{DIMENSIONS[dimension][1].name: value})
+
+    group = {'row_key': DIMENSIONS[rows][1]}
+    if columns:
+        group['column_key'] = DIMENSIONS[columns][1]
+    cells = {}
+    for row in qs.values(**group).annotate(value=MEASURES[measure][1]).order_by():
+        cells[(row['row_key'], row.get('column_key'))] = row['value'] or 0
+
+    row_labels = _labels(rows, {row_key for row_key, _ in cells})
+    column_labels = _labels(columns, {column_key for _, column_key in cells}) if columns else {None: ''}
+    column_keys = _ordered(columns, column_labels) if columns else [None]
+
+    table = []
+    for row_key in _ordered(rows, row_labels):
+        values = [cells.get((row_key, column_key), 0) for column_key in column_keys]
+        table.append({'key': row_key, 'label': row_labels[row_key], 'cells': values, 'total': sum(values)})
+
+    column_totals = [sum(row['cells'][index] for row in table) for index in range(len(column_keys))]
+    return {
+        'row_dimension': rows,
+        'row_label': DIMENSIONS[rows][0],
+        'column_dimension': columns,
+        'column_label': DIMENSIONS[columns][0] if columns else '',
+        'measure_label': MEASURES[measure][0],
+        'columns': [{'key': key, 'label': column_labels[key]} for key in column_keys],
+        'rows': table,
+        'column_totals': column_totals,
+        'total': sum(column_totals),
+    }
+
+
+def slice_labels(slices):
+    """Подписи активных срезов: {измерение: название значения}"""
+    return {dimension: _labels(dimension, {value})[value] for dimension, value in slices.items()}
@@ -0,0 +1,199 @@
+"""Прием чеков, накопленных кассовым терминалом без связи.
+
+Терминал отправляет очередь чеков пачкой; у каждого чека есть UUID,
+сгенерированный на кассе, поэтому повторная отправка той же пачки
+не создает дублей. Пачка записывается одной транзакцией: номера
+выделяются счетчиком кассы сразу на всю пачку, документы и позиции
+создаются bulk_create, остатки списываются одним групповым UPDATE
+(комплекты — своими комплектующими).
+"""
+import uuid
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from functools import partial
+
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import bump_data_version
+from .models import CustomerStats, Customer, DocumentItem, KitComponent, Product, SaleDocument, Shift
+
+MAX_BATCH_SIZE = 500
+
+
+class ReceiptError(ValueError):
+    pass
+
+
+def _parse_receipt(data):
+    """Проверяет формат чека; возвращает (uuid, id покупателя, дата, позиции)"""
+    if not isinstance(data, dict):
+        raise ReceiptError("Чек должен быть объектом")
+    try:
+        client_uuid = uuid.UUID(str(data.get('uuid')))
+    except ValueError:
+        raise ReceiptError("Некорректный uuid чека")
+    try:
+        customer_id = int(data['customer'])
+        doc_date = date.fromisoformat(data['date']) if data.get('date') else timezone.localdate()
+    except (KeyError, TypeError, ValueError):
+        raise ReceiptError("Некорректный покупатель или дата")
+
+    items = data.get('items')
+    if not items or not isinstance(items, list):
+        raise ReceiptError("Чек без позиций")
+    parsed = []
+    for item in items:
+        try:
+            product_id = int(item['product'])
+            quantity = int(item['quantity'])
+            price = Decimal(str(item['price'])) if item.get('price') is not None else None
+        except (KeyError, TypeError, ValueError, InvalidOperation):
+            raise ReceiptError("Некорректная позиция чека")
+        if quantity <= 0 or (price is not None and price < 0):
+            raise ReceiptError("Количество и цена позиции должны быть положительными")
+        parsed.append((product_id, quantity, price))
+    return client_uuid, customer_id, doc_date, _merge_lines(parsed)
+
+
+def _merge_lines(items):
+    """Складывает строки одного товара: в документе товар может быть только одной позицией"""
+    merged = {}
+    for product_id, quantity, price in items:
+        if product_id not in merged:
+            merged[product_id] = (quantity, price)
+            continue
+        total, known_price = merged[product_id]
+        if price is not None and known_price is not None and price != known_price:
+            raise ReceiptError(f"Товар {product_id} указан в чеке несколько раз с разной ценой")
+        merged[product_id] = (total + quantity, known_price if known_price is not None else price)
+    return [(product_id, quantity, price) for product_id, (quantity, price) in merged.items()]
+
+
+def sync_receipts(register, receipts):
+    """Записывает пачку чеков кассы register.
+
+    Возвращает список результатов в порядке чеков: status — created,
+    duplicate (чек уже принят раньше) или error с текстом ошибки.
+    Чеки, для которых не хватает остатка, отклоняются по очереди,
+    остальные чеки пачки записываются.
+    """
+    results = [{'uuid': str(data.get('uuid')) if isinstance(data, dict) else None} for data in receipts]
+    parsed = {}
+    for index, data in enumerate(receipts):
+        try:
+            parsed[index] = _parse_receipt(data)
+        except ReceiptError as error:
+            results[index].update(status='error', error=str(error))
+
+    with transaction.atomic():
+        uuids = [receipt[0] for receipt in parsed.values()]
+        accepted = dict(
+            SaleDocument.objects.filter(client_uuid__in=uuids).values_list('client_uuid', 'number')
+        )
+        product_ids = {item[0] for receipt in parsed.values() for item in receipt[3]}
+        recipes = KitComponent.recipes(product_ids)
+        component_ids = {component_id for recipe in recipes.values() for component_id, _ in recipe}
+        products = {
+            pk: (price, quantity - reserved)
+            for pk, price, quantity, reserved in Product.objects.filter(
+                pk__in=product_ids | component_ids
+            ).values_list('id', 'price', 'quantity', 'reserved')
+        }
+        customer_ids = set(
+            Customer.objects.filter(pk__in={receipt[1] for receipt in parsed.values()}).values_list('id', flat=True)
+        )
+
+        available = {pk: stock for pk, (_, stock) in products.items()}
+        deltas = defaultdict(int)
+        to_create = []
+        # повтор uuid внутри одной пачки тоже дубль: {индекс дубля: индекс первого чека}
+        repeated, first_index = {}, {}
+        for index, (client_uuid, customer_id, doc_date, items) in parsed.items():
+            result = results[index]
+            if client_uuid in accepted:
+                result.update(status='duplicate', number=accepted[client_uuid])
+                continue
+            if client_uuid in first_index:
+                repeated[index] = first_index[client_uuid]
+                continue
+            error = _check_receipt(customer_id, items, products, customer_ids, available, recipes)
+            if error:
+                result.update(status='error', error=error)
+                continue
+            for product_id, quantity in _needed(items, recipes).items():
+                available[product_id] -= quantity
+                deltas[product_id] -= quantity
+            first_index[client_uuid] = index
+            to_create.append((index, client_uuid, customer_id, doc_date, items))
+
+        if not to_create:
+            return _fill_repeated(results, repeated)
+
+        shift = register.open_shift()
+        numbers = register.allocate_numbers(len(to_create))
+        documents, document_items = [], []
+        for (index, client_uuid, customer_id, doc_date, items), number in zip(to_create, numbers):
+            lines = [
+                DocumentItem(product_id=product_id, quantity=quantity,
+                             price=products[product_id][0] if price is None else price)
+                for product_id, quantity, price in items
+            ]
+            document = SaleDocument(
+                type='cash',
+                number=number,
+                date=doc_date,
+                customer_id=customer_id,
+                register=register,
+                shift=shift,
+                cash_register=register.code,
+                client_uuid=client_uuid,
+                total=sum((line.total for line in lines), Decimal('0.00')),
+            )
+            documents.append(document)
+            document_items.append(lines)
+            results[index].update(status='created', number=number)
+
+        SaleDocument.objects.bulk_create(documents)
+        for document, lines in zip(documents, document_items):
+            for line in lines:
+                line.document = document
+        DocumentItem.objects.bulk_create([line for lines in document_items for line in lines])
+        Product.adjust_stock(quantity=deltas)
+
+        states = [(None, CustomerStats.document_state(document)) for document in documents]
+        CustomerStats.apply_changes(states)
+        Shift.apply_changes((None, Shift.document_state(document)) for document in documents)
+        # bulk_create не отправляет post_save
+        transaction.on_commit(partial(bump_data_version, 'sales'))
+    return _fill_repeated(results, repeated)
+
+
+def _fill_repeated(results, repeated):
+    for index, first in repeated.items():
+        if results[first]['status'] == 'created':
+            results[index].update(status='duplicate', number=results[first]['number'])
+        else:
+            results[index].update(status='error', error=results[first]['error'])
+    return results
+
+
+def _needed(items, recipes):
+    """Списание по позициям чека: {id товара: количество}, комплекты — комплектующими"""
+    quantities = defaultdict(int)
+    for product_id, quantity, _ in items:
+        quantities[product_id] += quantity
+    return KitComponent.expand(quantities, recipes)
+
+
+def _check_receipt(customer_id, items, products, customer_ids, available, recipes):
+    if customer_id not in customer_ids:
+        return "Покупатель не найден"
+    for product_id, _, _ in items:
+        if product_id not in products:
+            return f"Товар {product_id} не найден"
+    for product_id, quantity in _needed(items, recipes).items():
+        if quantity > available[product_id]:
+            return f"Недостаточно товара {product_id} на складе. Доступно: {available[product_id]}"
+    return None
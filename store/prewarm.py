@@ -0,0 +1,87 @@
+"""Прогрев процесса до форка воркеров.
+
+При STORE_PREWARM (см. StoreConfig.ready) в главном процессе заранее
+импортируются модули, которые иначе загружаются лениво при первом
+запросе, разбирается URLconf, компилируются шаблоны приложения и
+заполняются кэши каталога моделей: метаданные полей и связей, поля
+журнала изменений и версии групп данных кэша фрагментов. Воркеры,
+созданные fork() после этого (gunicorn --preload), получают все это
+готовым в общих страницах памяти (copy-on-write).
+
+Строки товаров не загружаются: ready() выполняется и до того, как
+база готова (migrate), а отдельного кэша товаров в процессе нет —
+данные кэшируются фрагментами шаблонов в общем кэше.
+"""
+import logging
+import time
+from importlib import import_module
+from pathlib import Path
+
+from django.apps import apps
+from django.template.loader import get_template
+from django.urls import get_resolver
+
+logger = logging.getLogger(__name__)
+
+PREWARM_MODULES = (
+    'numpy',
+    'store.analytics',
+    'store.forecast',
+    'store.importers',
+    'store.pos',
+    'store.api',
+    'store.views',
+)
+
+TEMPLATES_DIR = Path(__file__).resolve().parent / 'templates'
+
+
+def compile_templates():
+    """Компилирует шаблоны приложения в кэш загрузчика шаблонов"""
+    names = sorted(path.relative_to(TEMPLATES_DIR).as_posix() for path in TEMPLATES_DIR.rglob('*.html'))
+    compiled = 0
+    for name in names:
+        try:
+            get_template(name)
+        except Exception:
+            # шаблон с ошибкой не должен мешать запуску: она проявится при отрисовке
+            logger.warning("Не удалось скомпилировать шаблон %s", name, exc_info=True)
+        else:
+            compiled += 1
+    return compiled
+
+
+def warm_catalog_caches():
+    """Заполняет кэши метаданных моделей и версии групп данных; возвращает число моделей"""
+    from .audit import AUDITED_MODELS, audited_fields
+    from .cache import data_version
+    from .signals import MODEL_GROUPS
+
+    models = apps.get_app_config('store').get_models()
+    count = 0
+    for model in models:
+        # дерево связей и списки полей _meta строятся лениво при первом запросе
+        model._meta.get_fields()
+        model._meta.concrete_fields
+        count += 1
+    for model in AUDITED_MODELS:
+        audited_fields(model)
+    try:
+        data_version(sorted({group for groups in MODEL_GROUPS.values() for group in groups}))
+    except Exception:
+        # недоступный кэш фрагментов не должен мешать запуску
+        logger.warning("Не удалось прочитать версии данных кэша фрагментов", exc_info=True)
+    return count
+
+
+def prewarm():
+    started = time.perf_counter()
+    for name in PREWARM_MODULES:
+        import_module(name)
+    patterns = len(get_resolver().url_patterns)
+    templates = compile_templates()
+    models = warm_catalog_caches()
+    logger.info(
+        "Прогрев: модулей %d, маршрутов %d, шаблонов %d, моделей %d за %.0f мс",
+        len(PREWARM_MODULES), patterns, templates, models, (time.perf_counter() - started) * 1000
+    )
@@ -0,0 +1,61 @@
+"""Групповая переоценка каталога.
+
+Новые цены записываются в PriceHistory одним bulk_create с датой начала
+действия, после чего Product.price товаров, чья цена уже вступила в
+силу, обновляется одним UPDATE с подзапросом к истории. Вся переоценка —
+одна транзакция, save() отдельных товаров не вызывается. Цены с будущей
+датой применяются командой reprice --apply в день вступления в силу;
+документы берут цену на свою дату из истории (Product.prices_on).
+"""
+from decimal import ROUND_HALF_UP, Decimal
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F, Subquery
+from django.utils import timezone
+
+from .cache import bump_data_version
+from .models import PriceHistory, Product, prices_changed
+
+CENT = Decimal('0.01')
+
+
+def percent_prices(queryset, percent):
+    """Новые цены {id товара: цена} для товаров queryset с изменением на percent %"""
+    factor = 1 + Decimal(str(percent)) / 100
+    return {
+        product_id: (price * factor).quantize(CENT, rounding=ROUND_HALF_UP)
+        for product_id, price in queryset.values_list('id', 'price').order_by()
+    }
+
+
+def apply_due_prices(on_date=None):
+    """Записывает в Product.price цены, действующие на дату; возвращает число товаров"""
+    on_date = on_date or timezone.localdate()
+    due = PriceHistory.effective(on_date)
+    stale = Product.objects.annotate(due_price=Subquery(due, output_field=Product._meta.get_field('price'))).exclude(due_price=None).exclude(price=F('due_price'))
+    changes = {
+        pk: (old, new.quantize(CENT)) for pk, old, new in stale.values_list('id', 'price', 'due_price')
+    }
+    if not changes:
+        return 0
+    Product.objects.filter(pk__in=Subquery(stale.values('pk'))).update(
+        price=Subquery(due), updated_at=timezone.now()
+    )
+    prices_changed.send(sender=Product, changes=changes)
+    transaction.on_commit(partial(bump_data_version, 'catalog'))
+    return len(changes)
+
+
+def reprice(prices, effective_from=None, source=''):
+    """Переоценка {id товара: новая цена} с даты effective_from (по умолчанию сегодня).
+
+    Возвращает число товаров, у которых сразу изменилась текущая цена.
+    """
+    today = timezone.localdate()
+    effective_from = effective_from or today
+    with transaction.atomic():
+        PriceHistory.record(prices, effective_from, source)
+        if effective_from > today:
+            return 0
+        return apply_due_prices(today)
@@ -0,0 +1,33 @@
+ARCHIVE_DB = 'archive'
+
+# модели, которые живут в архивной базе (имена в нижнем регистре)
+ARCHIVE_MODELS = {
+    'archiveperiod',
+    'archivedsaledocument',
+    'archiveddocumentitem',
+    'archiveddailysales',
+    'stocksnapshot',
+}
+
+
+def is_archive_model(model):
+    return model._meta.app_label == 'store' and model._meta.model_name in ARCHIVE_MODELS
+
+
+class ArchiveRouter:
+    """Направляет модели архива закрытых периодов в базу 'archive'"""
+
+    def db_for_read(self, model, **hints):
+        return ARCHIVE_DB if is_archive_model(model) else None
+
+    def db_for_write(self, model, **hints):
+        return ARCHIVE_DB if is_archive_model(model) else None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return is_archive_model(type(obj1)) == is_archive_model(type(obj2))
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        is_archive = app_label == 'store' and model_name in ARCHIVE_MODELS
+        if db == ARCHIVE_DB:
+            return is_archive
+        return not is_archive
@@ -0,0 +1,92 @@
+"""Поиск для полей с автодополнением (api/search/<resource>/).
+
+Отдается не больше LIMIT первых совпадений. Поиск по префиксу —
+диапазон по индексу (name >= q AND name < q + '\U0010ffff'), а не
+LIKE 'q%', который SQLite выполняет перебором таблицы.
+"""
+from django.db.models import Q
+
+from .models import Customer, Invoice, SaleDocument, Shift
+
+LIMIT = 20
+
+
+def prefix_range(field, prefixes):
+    condition = Q()
+    for prefix in prefixes:
+        condition |= Q(**{f'{field}__gte': prefix, f'{field}__lt': prefix + '\U0010ffff'})
+    return condition
+
+
+def _name_prefixes(query):
+    # имена обычно с заглавной буквы, а вводят их строчными
+    return {query, query[:1].upper() + query[1:]}
+
+
+def _number_prefixes(query, prefixes):
+    # "15" ищется как "ТЧ-15", "ВР-15" и т.д., полный номер — как есть
+    if query[:1].isdigit():
+        return {f"{prefix}-{query}" for prefix in prefixes}
+    return {query, query.upper()}
+
+
+def _int(value):
+    return int(value) if value and value.isdigit() else None
+
+
+def search_customers(params):
+    query = params.get('q', '').strip()
+    qs = Customer.objects.only('id', 'name').order_by('name')
+    if params.get('company') == '1':
+        qs = qs.filter(is_company=True)
+    if query:
+        qs = qs.filter(prefix_range('name', _name_prefixes(query)))
+    return [{'id': customer.pk, 'text': customer.name} for customer in qs[:LIMIT]]
+
+
+def search_invoices(params):
+    query = params.get('q', '').strip()
+    qs = Invoice.objects.only('id', 'number', 'date', 'total').order_by('-id')
+    if params.get('paid') == '1':
+        qs = qs.filter(is_paid=True)
+    if _int(params.get('customer')):
+        qs = qs.filter(customer_id=_int(params['customer']))
+    if query:
+        qs = qs.filter(prefix_range('number', _number_prefixes(query, ['СЧ'])))
+    return [{'id': invoice.pk, 'text': f"{invoice}, {invoice.total} руб."} for invoice in qs[:LIMIT]]
+
+
+def search_documents(params):
+    query = params.get('q', '').strip()
+    types = [t for t in params.get('types', '').split(',') if t in SaleDocument.NUMBER_PREFIXES]
+    types = types or list(SaleDocument.NUMBER_PREFIXES)
+    qs = SaleDocument.objects.filter(type__in=types).only('id', 'type', 'number', 'date', 'total').order_by('-id')
+    if _int(params.get('customer')):
+        qs = qs.filter(customer_id=_int(params['customer']))
+    if query:
+        prefixes = [SaleDocument.NUMBER_PREFIXES[t] for t in types]
+        qs = qs.filter(prefix_range('number', _number_prefixes(query, prefixes)))
+    return [
+        {'id': document.pk, 'text': f"{document} от {document.date:%d.%m.%Y}, {document.total} руб."}
+        for document in qs[:LIMIT]
+    ]
+
+
+def search_shifts(params):
+    query = params.get('q', '').strip()
+    qs = Shift.objects.select_related('register').only('id', 'number', 'register__code').order_by('-opened_at')
+    if _int(params.get('register')):
+        qs = qs.filter(register_id=_int(params['register']))
+    if query.isdigit():
+        qs = qs.filter(number=int(query))
+    elif query:
+        qs = qs.filter(prefix_range('register__code', {query, query.upper()}))
+    return [{'id': shift.pk, 'text': str(shift)} for shift in qs[:LIMIT]]
+
+
+SEARCHES = {
+    'customers': search_customers,
+    'invoices': search_invoices,
+    'documents': search_documents,
+    'shifts': search_shifts,
+}
@@ -0,0 +1,82 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+
+from . import audit
+from .cache import bump_data_version
+from .models import (
+    Customer, DocumentItem, Invoice, InvoiceItem, Product, SaleDocument, StockReservation, item_deleted,
+    prices_changed, stock_changed,
+)
+
+# группы данных, версии которых меняет запись модели
+MODEL_GROUPS = {
+    SaleDocument: ('sales',),
+    DocumentItem: ('sales',),
+    Invoice: ('invoices',),
+    InvoiceItem: ('invoices',),
+    Customer: ('customers',),
+    Product: ('catalog',),
+}
+
+# позиции документа и счета: {модель владельца: (модель позиции, поле владельца)}
+ITEM_MODELS = {SaleDocument: (DocumentItem, 'document'), Invoice: (InvoiceItem, 'invoice')}
+
+
+def delete_signal(model):
+    # удаление позиции сообщает item_deleted, а не post_delete: с обработчиками
+    # post_delete Django загружал бы и удалял позиции удаляемого документа по одной
+    return item_deleted if model in (DocumentItem, InvoiceItem) else post_delete
+
+
+def data_changed(sender, **kwargs):
+    # после фиксации: иначе фрагмент по старым данным попал бы в кэш под новой версией
+    transaction.on_commit(partial(bump_data_version, *MODEL_GROUPS[sender]))
+
+
+for model in MODEL_GROUPS:
+    post_save.connect(data_changed, sender=model, dispatch_uid=f'store_data_version_{model.__name__}')
+    delete_signal(model).connect(data_changed, sender=model, dispatch_uid=f'store_data_version_{model.__name__}')
+
+
+# резервы удаляемого счета удаляются каскадом, минуя StockReservation.release,
+# поэтому счетчики резерва товаров снимаются до удаления (и для queryset.delete() из админки)
+def release_invoice_reservations(sender, instance, **kwargs):
+    StockReservation.release_invoices([instance.pk])
+
+
+pre_delete.connect(release_invoice_reservations, sender=Invoice, dispatch_uid='store_release_invoice_reservations')
+
+
+# журнал изменений
+def audit_save(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        audit.record_save(instance, created)
+
+
+def audit_delete(sender, instance, **kwargs):
+    audit.record_delete(instance)
+
+
+def audit_cascade(sender, instance, **kwargs):
+    # позиции удаляются каскадом одним DELETE — записываем их одним SELECT
+    model, field = ITEM_MODELS[sender]
+    audit.record_cascade(model, model.objects.filter(**{field: instance}))
+
+
+def audit_stock(sender, deltas, **kwargs):
+    audit.record_stock(deltas)
+
+
+def audit_prices(sender, changes, **kwargs):
+    audit.record_prices(changes)
+
+
+for model in audit.AUDITED_MODELS:
+    post_save.connect(audit_save, sender=model, dispatch_uid=f'store_audit_save_{model.__name__}')
+    delete_signal(model).connect(audit_delete, sender=model, dispatch_uid=f'store_audit_delete_{model.__name__}')
+for model in ITEM_MODELS:
+    pre_delete.connect(audit_cascade, sender=model, dispatch_uid=f'store_audit_cascade_{model.__name__}')
+stock_changed.connect(audit_stock, sender=Product, dispatch_uid='store_audit_stock')
+prices_changed.connect(audit_prices, sender=Product, dispatch_uid='store_audit_prices')
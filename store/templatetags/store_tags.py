@@ -0,0 +1,56 @@
+import uuid
+
+from django import template
+from django.conf import settings
+from django.utils.html import format_html
+
+from ..cache import fragment_cache, fragment_key, record_lookup
+
+register = template.Library()
+
+
+@register.simple_tag
+def idempotency_key_field():
+    """Скрытое поле с ключом идемпотентности: повторная отправка формы не создаст дубль"""
+    return format_html('<input type="hidden" name="idempotency_key" value="{}">', uuid.uuid4().hex)
+
+
+class FragmentCacheNode(template.Node):
+    def __init__(self, nodelist, name, groups, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.groups = groups
+        self.vary_on = vary_on
+
+    def render(self, context):
+        name = self.name.resolve(context)
+        groups = [group for group in self.groups.resolve(context).split(',') if group]
+        key = fragment_key(name, groups, [value.resolve(context) for value in self.vary_on])
+
+        cache = fragment_cache()
+        content = cache.get(key)
+        record_lookup(name, content is not None)
+        if content is None:
+            content = self.nodelist.render(context)
+            cache.set(key, content, settings.STORE_FRAGMENT_CACHE_TIMEOUT)
+        return content
+
+
+@register.tag
+def cache_fragment(parser, token):
+    """{% cache_fragment 'имя' 'группа1,группа2' [значения vary_on...] %}...{% endcache_fragment %}
+
+    Фрагмент перестраивается при изменении версии любой из групп
+    данных (см. store.cache) или значений vary_on.
+    """
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' требует имя фрагмента и группы данных")
+    nodelist = parser.parse(('endcache_fragment',))
+    parser.delete_first_token()
+    return FragmentCacheNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        parser.compile_filter(bits[2]),
+        [parser.compile_filter(bit) for bit in bits[3:]],
+    )
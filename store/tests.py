@@ -1,3 +1,1024 @@
-from django.test import TestCase
+import tempfile
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO
+from pathlib import Path
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, OperationalError, connection, transaction
+from django.db.models import F
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import archive, audit, facts, pivot
+from .analytics import product_analytics
+from .api import decode_cursor, encode_cursor
+from .archive import close_period
+from .cache import VERSION_KEY, data_version
+from .facts import export_facts
+from .forecast import LONG_WINDOW, compute_forecast, update_daily_sales
+from .forms import SalesReportForm
+from .importers import import_catalog, iter_upload_rows, pay_bank_statement
+from .models import (
+    ArchivedDocumentItem, ArchivedSaleDocument, AuditEntry, CashRegister, Customer, DocumentItem, IdempotencyKey,
+    Invoice, InvoiceItem, KitComponent, PriceHistory, Product, ProductDailySales, SaleDocument, SalesCubeCell, Shift,
+    StockForecast, Stocktake, StockReservation,
+)
+from .pos import sync_receipts
+from .prewarm import warm_catalog_caches
+from .pricing import apply_due_prices, reprice
+from .views import _sales_comparison_data
+
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+# кэш фрагментов тестов — в памяти, а не в каталоге проекта
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'fragments': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-fragments'},
+}
+
+
+def make_product(name='Товар', price=100, quantity=10, **kwargs):
+    return Product.objects.create(name=name, price=price, quantity=quantity, **kwargs)
+
+
+def make_invoice(customer, items):
+    """Неоплаченный счет с позициями [(товар, количество)]"""
+    invoice = Invoice.objects.create(customer=customer)
+    for product, quantity in items:
+        InvoiceItem.objects.create(invoice=invoice, product=product, quantity=quantity, price=product.price)
+    invoice.refresh_from_db()
+    return invoice
+
+
+class InvoicePaymentTests(TestCase):
+    databases = {'default', 'archive'}
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name='Покупатель')
+        self.product = make_product(quantity=10)
+
+    def test_sale_is_created_once_after_period_closed(self):
+        invoice = make_invoice(self.customer, [(self.product, 2)])
+        invoice.is_paid = True
+        invoice.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 8)
+
+        # продажа по счету уходит в архив, сам счет остается в оперативной базе
+        close_period(timezone.localdate() + timedelta(days=1))
+        self.assertFalse(SaleDocument.objects.filter(invoice=invoice).exists())
+        self.assertTrue(ArchivedSaleDocument.objects.filter(invoice_id=invoice.pk).exists())
+
+        invoice.refresh_from_db()
+        invoice.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 8)
+        self.assertFalse(SaleDocument.objects.filter(invoice=invoice).exists())
+
+    def test_resaving_paid_invoice_does_not_create_sale(self):
+        invoice = make_invoice(self.customer, [(self.product, 2)])
+        invoice.is_paid = True
+        invoice.save()
+        invoice.save()
+        self.assertEqual(SaleDocument.objects.filter(invoice=invoice).count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 8)
+
+
+class InvoiceReservationTests(TestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(name='Покупатель')
+        self.product = make_product(quantity=10)
+
+    def test_deleting_invoice_releases_reservations(self):
+        invoice = make_invoice(self.customer, [(self.product, 3)])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved, 3)
+
+        invoice.delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved, 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_queryset_delete_releases_reservations(self):
+        second = make_product(name='Второй товар')
+        make_invoice(self.customer, [(self.product, 3), (second, 1)])
+        make_invoice(self.customer, [(self.product, 2)])
+
+        Invoice.objects.all().delete()
+        self.assertEqual(
+            dict(Product.objects.values_list('id', 'reserved')), {self.product.pk: 0, second.pk: 0}
+        )
+
+
+class ExpiredReservationTests(TestCase):
+    databases = {'default', 'archive'}
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name='Покупатель')
+        self.product = make_product(quantity=5)
+        self.invoice = make_invoice(self.customer, [(self.product, 3)])
+        StockReservation.release_expired(now=timezone.now() + timedelta(days=365))
+
+    def test_payment_uses_free_stock(self):
+        self.invoice.mark_paid()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.quantity, self.product.reserved), (2, 0))
+
+    def test_payment_without_free_stock_is_rejected(self):
+        other = make_invoice(self.customer, [(self.product, 3)])
+        with self.assertRaises(ValidationError):
+            self.invoice.mark_paid()
+        self.assertFalse(Invoice.objects.get(pk=self.invoice.pk).is_paid)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.quantity, self.product.reserved), (5, 3))
+
+        # оплата счета с действующим резервом проходит
+        other.mark_paid()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.quantity, self.product.reserved), (2, 0))
+
+    def test_bank_statement_reports_rejected_invoice(self):
+        other = make_invoice(self.customer, [(self.product, 3)])
+        statement = f"number;amount\n{self.invoice.number};300\n{other.number};300\n".encode()
+        report = pay_bank_statement(statement)
+        self.assertEqual(report['paid'], 1)
+        self.assertEqual([line_no for line_no, _, _ in report['unmatched']], [2])
+        self.assertEqual(list(Invoice.objects.filter(is_paid=True).values_list('pk', flat=True)), [other.pk])
+
+class ProductSaveTests(TestCase):
+    def setUp(self):
+        self.product = make_product(quantity=10)
+
+    def test_save_keeps_concurrent_reservation(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        Product.adjust_stock(reserved={self.product.pk: 3})
+
+        stale.name = 'Новое название'
+        stale.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.name, 'Новое название')
+        self.assertEqual(self.product.reserved, 3)
+        self.assertEqual(stale.reserved, 3)
+
+    def test_quantity_edit_is_applied_as_delta(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        version = stale.version
+        Product.adjust_stock(quantity={self.product.pk: -2})
+
+        stale.quantity += 5
+        stale.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 13)
+        self.assertGreater(self.product.version, version + 1)
+        self.assertEqual(stale.quantity, 13)
+
+
+class KitInvoiceTests(TestCase):
+    databases = {'default', 'archive'}
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name='Покупатель')
+        self.cpu = make_product(name='Процессор', quantity=5)
+        self.ram = make_product(name='Память', quantity=10)
+        self.kit = make_product(name='Готовый ПК', price=1000, quantity=0)
+        KitComponent.objects.create(kit=self.kit, component=self.cpu, quantity=1)
+        KitComponent.objects.create(kit=self.kit, component=self.ram, quantity=2)
+        self.kit.refresh_from_db()
+
+    def stock(self):
+        """Остатки и резервы {id товара: значение}"""
+        return (
+            dict(Product.objects.values_list('id', 'quantity')),
+            dict(Product.objects.values_list('id', 'reserved')),
+        )
+
+    def test_kit_reservation_and_payment_use_components(self):
+        self.assertEqual(self.kit.available_quantity(), 5)
+        invoice = make_invoice(self.customer, [(self.kit, 2)])
+        quantities, reserved = self.stock()
+        self.assertEqual(reserved, {self.cpu.pk: 2, self.ram.pk: 4, self.kit.pk: 0})
+        self.kit.refresh_from_db()
+        self.assertEqual(self.kit.available_quantity(), 3)
+
+        invoice.mark_paid()
+        quantities, reserved = self.stock()
+        self.assertEqual(quantities, {self.cpu.pk: 3, self.ram.pk: 6, self.kit.pk: 0})
+        self.assertEqual(reserved, {self.cpu.pk: 0, self.ram.pk: 0, self.kit.pk: 0})
+
+    def test_kit_reservation_beyond_components_is_rejected(self):
+        with self.assertRaisesMessage(ValidationError, "Доступно: 5"):
+            make_invoice(self.customer, [(self.kit, 6)])
+
+    def test_deleting_kit_invoice_releases_components(self):
+        invoice = make_invoice(self.customer, [(self.kit, 2)])
+        invoice.delete()
+        _, reserved = self.stock()
+        self.assertEqual(reserved, {self.cpu.pk: 0, self.ram.pk: 0, self.kit.pk: 0})
+
+
+class ReceiptSyncTests(TestCase):
+    databases = {'default', 'archive'}
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name='Покупатель')
+        self.product = make_product(quantity=10)
+        self.register = CashRegister.objects.create(code='K1', name='Касса 1')
+
+    def receipt(self, *items):
+        return {
+            'uuid': str(uuid.uuid4()),
+            'customer': self.customer.pk,
+            'items': [{'product': self.product.pk, 'quantity': quantity, 'price': price} for quantity, price in items],
+        }
+
+    def test_repeated_product_lines_are_merged(self):
+        results = sync_receipts(self.register, [self.receipt((1, None), (2, None)), self.receipt((1, None))])
+        self.assertEqual([result['status'] for result in results], ['created', 'created'])
+
+        document = SaleDocument.objects.get(number=results[0]['number'])
+        self.assertEqual(list(document.items.values_list('quantity', flat=True)), [3])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 6)
+
+    def test_conflicting_prices_reject_only_that_receipt(self):
+        results = sync_receipts(self.register, [self.receipt((1, '90'), (1, '80')), self.receipt((1, None))])
+        self.assertEqual([result['status'] for result in results], ['error', 'created'])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 9)
+
+    def test_batch_sent_twice_is_not_written_again(self):
+        batch = [self.receipt((1, None)), self.receipt((2, None))]
+        first = sync_receipts(self.register, batch)
+        second = sync_receipts(self.register, batch)
+        self.assertEqual([result['status'] for result in second], ['duplicate', 'duplicate'])
+        self.assertEqual([result['number'] for result in second], [result['number'] for result in first])
+        self.assertEqual(SaleDocument.objects.count(), 2)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 7)
+
+    def test_uuid_repeated_within_batch(self):
+        receipt = self.receipt((1, None))
+        results = sync_receipts(self.register, [receipt, dict(receipt)])
+        self.assertEqual([result['status'] for result in results], ['created', 'duplicate'])
+        self.assertEqual(results[0]['number'], results[1]['number'])
+        self.assertEqual(SaleDocument.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 9)
+
+    def test_receipt_beyond_stock_is_rejected_rest_written(self):
+        results = sync_receipts(
+            self.register, [self.receipt((6, None)), self.receipt((6, None)), self.receipt((4, None))]
+        )
+        self.assertEqual([result['status'] for result in results], ['created', 'error', 'created'])
+        self.assertIn('Недостаточно', results[1]['error'])
+        self.assertEqual(SaleDocument.objects.count(), 2)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 0)
+
+    def test_receipt_date_defaults_to_local_date(self):
+        with mock.patch('django.utils.timezone.localdate', return_value=timezone.now().date() - timedelta(days=1)):
+            results = sync_receipts(self.register, [self.receipt((1, None))])
+        document = SaleDocument.objects.get(number=results[0]['number'])
+        self.assertEqual(document.date, timezone.now().date() - timedelta(days=1))
+
+
+@override_settings(STORE_FACTS_DIR=Path(tempfile.gettempdir()) / 'store-test-facts-missing')
+class ProductAnalyticsTests(TestCase):
+    databases = {'default', 'archive'}
+
+    def setUp(self):
+        customer = Customer.objects.create(name='Покупатель')
+        product = make_product(quantity=10)
+        document = SaleDocument.objects.create(type='cash', customer=customer, cash_register='1')
+        DocumentItem.objects.create(document=document, product=product, quantity=1, price=product.price)
+
+    def test_end_date_before_first_sale(self):
+        end_date = timezone.localdate() - timedelta(days=30)
+        data = product_analytics(end_date=end_date)
+        self.assertEqual(data['start_date'], end_date)
+        self.assertEqual(len(data['daily']), 1)
+        self.assertEqual(data['top_by_revenue'], [])
+
+    def test_api_with_early_end_date(self):
+        response = self.client.get(reverse('api_product_analytics'), {'end_date': '2000-01-01'})
+        self.assertEqual(response.status_code, 200)
+
+
+class ShiftReturnTests(TestCase):
+    databases = {'default', 'archive'}
+
+    def test_return_counts_in_register_shift(self):
+        customer = Customer.objects.create(name='Покупатель')
+        product = make_product(quantity=10)
+        register = CashRegister.objects.create(code='K1', name='Касса 1')
+        sale = SaleDocument.objects.create(type='cash', customer=customer, register=register)
+        DocumentItem.objects.create(document=sale, product=product, quantity=2, price=product.price)
+        sale.update_total()
+
+        refund = SaleDocument.objects.create(type='return', customer=customer, original_sale=sale)
+        DocumentItem.objects.create(document=refund, product=product, quantity=1, price=product.price)
+        refund.update_total()
+
+        self.assertEqual((refund.register_id, refund.shift_id), (register.pk, sale.shift_id))
+        shift = Shift.objects.get(pk=sale.shift_id)
+        self.assertEqual((shift.sales_count, shift.sales_total), (1, 200))
+        self.assertEqual((shift.returns_count, shift.returns_total), (1, 100))
+
+
+class SaleStockTests(TestCase):
+    databases = {'default', 'archive'}
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name='Покупатель')
+        self.product = make_product(quantity=5, reserved=3)
+
+    def sell(self, doc_type, quantity):
+        document = SaleDocument.objects.create(type=doc_type, customer=self.customer)
+        DocumentItem.objects.bulk_create([
+            DocumentItem(document=document, product=self.product, quantity=quantity, price=self.product.price)
+        ])
+        document.update_product_quantities()
+
+    def test_sale_beyond_available_is_rejected(self):
+        with self.assertRaises(ValidationError):
+            self.sell('cash', 3)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.quantity, self.product.version), (5, 0))
+
+    def test_sale_and_return_bump_version(self):
+        self.sell('cash', 2)
+        self.sell('return', 1)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.quantity, self.product.version), (4, 2))
+
+
+class StockLockingTests(TestCase):
+    def setUp(self):
+        self.product = make_product(quantity=5, reserved=2)
+        self.check_stock = Product._check_stock
+
+    def concurrent_write(self, times):
+        """_check_stock, после которого строку успевает изменить другой процесс"""
+        calls = []
+
+        def check_stock(product_id, *args):
+            self.check_stock(product_id, *args)
+            if len(calls) < times:
+                calls.append(product_id)
+                Product.objects.filter(pk=product_id).update(quantity=F('quantity') - 1, version=F('version') + 1)
+        return mock.patch.object(Product, '_check_stock', side_effect=check_stock)
+
+    def test_version_conflict_is_retried(self):
+        with self.concurrent_write(times=1):
+            attempts = Product.change_quantity(self.product.pk, -1, check_available=True)
+        self.assertEqual(attempts, 2)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.quantity, self.product.version), (3, 2))
+
+    @override_settings(STORE_STOCK_MAX_RETRIES=3)
+    def test_out_of_retries(self):
+        with self.concurrent_write(times=3), self.assertRaises(ValidationError):
+            Product.change_quantity(self.product.pk, -1)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.quantity, self.product.version), (2, 3))
+
+    @override_settings(STORE_STOCK_LOCKING='pessimistic')
+    def test_pessimistic_mode(self):
+        self.assertEqual(Product.change_stock({self.product.pk: -3}, check_available=True), 1)
+        with self.assertRaises(ValidationError):
+            Product.change_quantity(self.product.pk, -1, check_available=True)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.quantity, self.product.version), (2, 1))
+
+    def test_stocktake_in_both_modes(self):
+        other = make_product(name='Другой', quantity=4)
+        for mode, counted in (('optimistic', 7), ('pessimistic', 6)):
+            with self.subTest(mode=mode), override_settings(STORE_STOCK_LOCKING=mode):
+                stocktake = Stocktake.from_counts({self.product.pk: counted, other.pk: 4})
+                self.assertEqual(stocktake.post(), 1)
+                self.product.refresh_from_db()
+                self.assertEqual(self.product.quantity, counted)
+
+
+class AuditWriterTests(TestCase):
+    def test_batch_is_kept_while_database_is_locked(self):
+        entries = [AuditEntry(model='product', object_id=1, action='stock', changes={'quantity': -1})]
+        with mock.patch.object(AuditEntry.objects, 'bulk_create', side_effect=OperationalError('database is locked')):
+            self.assertEqual(audit.flush(retries=1), 0)
+            audit._queue.put(entries[0])
+            self.assertEqual(audit.flush(retries=1), 0)
+        self.assertFalse(AuditEntry.objects.exists())
+
+        self.assertEqual(audit.flush(), 1)
+        self.assertEqual(AuditEntry.objects.filter(model='product', action='stock').count(), 1)
+
+
+    def test_permanent_error_does_not_block_log(self):
+        entry = AuditEntry(model='product', object_id=1, action='stock', changes={'quantity': -1})
+        audit._queue.put(entry)
+        error = OperationalError('no such table: store_auditentry')
+        with mock.patch.object(AuditEntry.objects, 'bulk_create', side_effect=error), self.assertLogs(audit.logger):
+            audit.flush(retries=1)
+        self.assertFalse(audit._postponed)
+
+        audit._queue.put(AuditEntry(model='product', object_id=2, action='stock', changes={'quantity': 1}))
+        self.assertEqual(audit.flush(), 1)
+        self.assertEqual(list(AuditEntry.objects.values_list('object_id', flat=True)), [2])
+
+    @mock.patch.object(audit, 'WRITE_RETRIES', 3)
+    @mock.patch.object(audit, 'FLUSH_INTERVAL', 0)
+    def test_locked_batch_is_dropped_after_retries(self):
+        audit._queue.put(AuditEntry(model='product', object_id=1, action='stock', changes={'quantity': -1}))
+        error = OperationalError('database is locked')
+        with mock.patch.object(AuditEntry.objects, 'bulk_create', side_effect=error) as bulk_create:
+            with self.assertLogs(audit.logger, 'ERROR'):
+                audit.flush(retries=10)
+        self.assertEqual(bulk_create.call_count, 3)
+        self.assertFalse(audit._postponed)
+
+
+@override_settings(STORE_AUDIT_ASYNC=False)
+class AuditLogTests(TestCase):
+    databases = {'default', 'archive'}
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name='Покупатель')
+        self.product = make_product(quantity=10)
+        self.document = SaleDocument.objects.create(type='cash', customer=self.customer, cash_register='1')
+        DocumentItem.objects.create(document=self.document, product=self.product, quantity=2, price=100)
+
+    def test_update_is_compared_with_loaded_row(self):
+        item = DocumentItem.objects.get(document=self.document)
+        self.assertNotIn('_audit_state', item.__dict__)
+        item.quantity = 3
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+        entry = AuditEntry.objects.get(model='documentitem', action='update')
+        self.assertEqual(entry.changes, {'quantity': [2, 3]})
+
+    def test_document_items_are_deleted_in_one_query(self):
+        item_id = self.document.items.get().pk
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            SaleDocument.objects.get(pk=self.document.pk).delete()
+        item_deletes = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('DELETE') and 'store_documentitem' in query['sql']
+        ]
+        self.assertEqual(len(item_deletes), 1)
+        self.assertIn('document_id', item_deletes[0])
+        self.assertTrue(AuditEntry.objects.filter(model='documentitem', object_id=item_id, action='delete').exists())
+
+
+class DailySalesTests(TestCase):
+    databases = {'default', 'archive'}
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name='Покупатель')
+        self.product = make_product(quantity=100)
+        self.today = timezone.localdate()
+
+    def sell(self, quantity, days_ago):
+        document = SaleDocument.objects.create(
+            type='cash', customer=self.customer, cash_register='1', date=self.today - timedelta(days=days_ago)
+        )
+        DocumentItem.objects.create(document=document, product=self.product, quantity=quantity, price=100)
+        return document
+
+    def daily(self):
+        return dict(ProductDailySales.objects.filter(product=self.product).values_list('date', 'quantity'))
+
+    def test_edits_and_deletes_in_window_are_picked_up(self):
+        kept = self.sell(2, days_ago=1)
+        removed = self.sell(5, days_ago=2)
+        update_daily_sales(today=self.today)
+        self.assertEqual(self.daily(), {self.today - timedelta(days=1): 2, self.today - timedelta(days=2): 5})
+
+        item = kept.items.get()
+        item.quantity = 3
+        item.save()
+        removed.delete()
+        update_daily_sales(today=self.today)
+        self.assertEqual(self.daily(), {self.today - timedelta(days=1): 3})
+
+    def test_archived_sales_stay_in_window(self):
+        self.sell(4, days_ago=3)
+        close_period(self.today - timedelta(days=1))
+        self.assertFalse(SaleDocument.objects.exists())
+
+        update_daily_sales(today=self.today)
+        self.assertEqual(self.daily(), {self.today - timedelta(days=3): 4})
+        update_daily_sales(full=True, today=self.today)
+        self.assertEqual(self.daily(), {self.today - timedelta(days=3): 4})
+
+
+@override_settings(CACHES=LOCMEM_CACHES, STORE_AUDIT_ASYNC=False)
+class DataVersionTests(TestCase):
+    def test_version_is_bumped_after_commit(self):
+        before = data_version(['catalog', 'sales'])
+        with self.captureOnCommitCallbacks() as callbacks:
+            make_product()
+            self.assertEqual(data_version(['catalog', 'sales']), before)
+        for callback in callbacks:
+            callback()
+        catalog, sales = data_version(['catalog', 'sales']).split('.')
+        self.assertEqual((int(catalog), sales), (int(before.split('.')[0]) + 1, before.split('.')[1]))
+
+    def test_prewarm_creates_versions(self):
+        self.assertGreater(warm_catalog_caches(), 0)
+        keys = [VERSION_KEY.format(group) for group in ('catalog', 'customers', 'invoices', 'sales')]
+        self.assertEqual(len(caches['fragments'].get_many(keys)), 4)
+
+    def test_rolled_back_write_keeps_version(self):
+        before = data_version(['customers'])
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Customer.objects.create(name='Покупатель')
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(data_version(['customers']), before)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, STORE_AUDIT_ASYNC=False)
+class DetailFragmentTests(TestCase):
+    databases = {'default', 'archive'}
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name='Покупатель')
+        self.product = make_product(name='Ноутбук')
+        self.invoice = make_invoice(self.customer, [(self.product, 1)])
+        self.document = SaleDocument.objects.create(type='cashless', customer=self.customer)
+        DocumentItem.objects.create(document=self.document, product=self.product, quantity=1, price=100)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode(), len(queries)
+
+    def test_hit_and_miss_queries(self):
+        for url in (reverse('invoice_detail', args=[self.invoice.pk]), reverse('detail', args=[self.document.pk])):
+            with self.subTest(url=url):
+                content, misses = self.get(url)
+                self.assertIn('Ноутбук', content)
+                self.assertEqual((misses, self.get(url)[1]), (2, 1))
+
+    def test_renamed_customer_and_product_rebuild_fragment(self):
+        for url in (reverse('invoice_detail', args=[self.invoice.pk]), reverse('detail', args=[self.document.pk])):
+            self.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.name = 'Новый покупатель'
+            self.customer.save()
+            self.product.name = 'Ультрабук'
+            self.product.save()
+        for url in (reverse('invoice_detail', args=[self.invoice.pk]), reverse('detail', args=[self.document.pk])):
+            with self.subTest(url=url):
+                content, queries = self.get(url)
+                self.assertIn('Новый покупатель', content)
+                self.assertIn('Ультрабук', content)
+                self.assertEqual(queries, 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CreateSaleDocumentTests(TestCase):
+    databases = {'default', 'archive'}
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name='Покупатель')
+        self.product = make_product(quantity=5, reserved=2)
+
+    def post(self, quantity):
+        return self.client.post(reverse('create_sale_document', args=['cashless']), {
+            'customer': self.customer.pk,
+            'date': timezone.localdate().isoformat(),
+            'items-TOTAL_FORMS': 1,
+            'items-INITIAL_FORMS': 0,
+            'items-0-product': self.product.pk,
+            'items-0-quantity': quantity,
+        })
+
+    def test_sale_is_created(self):
+        self.assertEqual(self.post(3).status_code, 302)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 2)
+        self.assertEqual(SaleDocument.objects.get().total, 300)
+
+    def test_item_beyond_available_is_rejected_by_form(self):
+        response = self.post(4)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Доступно: 3')
+        self.assertFalse(SaleDocument.objects.exists())
+
+    def test_stock_error_rolls_back_document(self):
+        # остаток продали между проверкой формы и списанием
+        with mock.patch.object(Product, 'available_quantity', return_value=10):
+            response = self.post(4)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(SaleDocument.objects.exists())
+        self.assertFalse(DocumentItem.objects.exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 5)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class IdempotencyTests(TestCase):
+    databases = {'default', 'archive'}
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name='Покупатель')
+        self.product = make_product(quantity=10)
+
+    def post(self, quantity, key='key-1', client=None):
+        return (client or self.client).post(reverse('create_sale_document', args=['cash']), {
+            'customer': self.customer.pk,
+            'date': timezone.localdate().isoformat(),
+            'idempotency_key': key,
+            'items-TOTAL_FORMS': 1,
+            'items-INITIAL_FORMS': 0,
+            'items-0-product': self.product.pk,
+            'items-0-quantity': quantity,
+        })
+
+    def test_replay_returns_stored_response(self):
+        first = self.post(2)
+        self.assertEqual(first.status_code, 302)
+        self.assertFalse(first.has_header('Idempotent-Replayed'))
+        replay = self.post(2)
+        self.assertEqual((replay.status_code, replay['Location']), (302, first['Location']))
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(SaleDocument.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 8)
+
+    def test_same_key_with_other_data_is_rejected(self):
+        self.post(2)
+        self.assertEqual(self.post(3).status_code, 422)
+        self.assertEqual(SaleDocument.objects.count(), 1)
+
+    def test_request_in_flight(self):
+        IdempotencyKey.objects.create(key='key-1', fingerprint='')
+        self.assertEqual(self.post(2).status_code, 409)
+        self.assertFalse(SaleDocument.objects.exists())
+
+    def test_server_error_releases_key(self):
+        client = Client(raise_request_exception=False)
+        with mock.patch.object(SaleDocument, 'update_product_quantities', side_effect=RuntimeError):
+            self.assertEqual(self.post(2, client=client).status_code, 500)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.post(2).status_code, 302)
+        self.assertEqual(SaleDocument.objects.count(), 1)
+
+class PayManyTests(TestCase):
+    databases = {'default', 'archive'}
+
+    def queries_to_pay(self, count, lines):
+        customer = Customer.objects.create(name=f'Покупатель {count}')
+        products = [make_product(name=f'Товар {count}-{i}', quantity=100) for i in range(lines)]
+        invoices = [make_invoice(customer, [(product, 1) for product in products]) for _ in range(count)]
+        with CaptureQueriesContext(connection) as queries:
+            sales = Invoice.pay_many([invoice.pk for invoice in invoices])
+        self.assertEqual(len(sales), count)
+        self.assertEqual(DocumentItem.objects.filter(document__in=sales).count(), count * lines)
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_invoices(self):
+        self.assertEqual(self.queries_to_pay(2, 1), self.queries_to_pay(6, 3))
+
+
+class ForecastTests(TestCase):
+    def test_days_left_use_available_stock(self):
+        product = make_product(quantity=10, reserved=6)
+        cpu = make_product(name='Процессор', quantity=5)
+        ram = make_product(name='Память', quantity=10)
+        kit = make_product(name='Готовый ПК', quantity=0)
+        KitComponent.objects.create(kit=kit, component=cpu, quantity=1)
+        KitComponent.objects.create(kit=kit, component=ram, quantity=2)
+
+        today = timezone.localdate()
+        ProductDailySales.objects.bulk_create([
+            ProductDailySales(product=sold, date=today - timedelta(days=days_ago), quantity=1)
+            for sold in (product, kit)
+            for days_ago in range(1, LONG_WINDOW + 1)
+        ])
+        compute_forecast()
+        days_left = dict(StockForecast.objects.values_list('product_id', 'days_left'))
+        self.assertEqual((days_left[product.pk], days_left[kit.pk]), (4, 5))
+
+
+class ApiListTests(TestCase):
+    def setUp(self):
+        self.products = [make_product(name=f'Товар {i}') for i in range(5)]
+
+    def test_cursor_pages_cover_list_once(self):
+        seen = []
+        url = reverse('api_products') + '?limit=2&fields=name'
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page['results']), 2)
+            seen.extend(row['id'] for row in page['results'])
+            url = page['next']
+        self.assertEqual(seen, sorted((product.pk for product in self.products), reverse=True))
+
+    def test_cursor_keeps_filters(self):
+        page = self.client.get(reverse('api_products'), {'limit': 1, 'fields': 'name,price'}).json()
+        self.assertIn('fields=name%2Cprice', page['next'])
+        self.assertEqual(decode_cursor(page['next'].rsplit('cursor=', 1)[1]), self.products[-1].pk)
+
+    def test_bad_cursor_is_rejected(self):
+        for cursor in ('not-a-cursor!', encode_cursor('abc'), '%%%'):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse('api_products'), {'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+
+class ClosePeriodTests(TestCase):
+    databases = {'default', 'archive'}
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name='Покупатель')
+        self.product = make_product(quantity=100)
+        self.today = timezone.localdate()
+        for days_ago in (30, 20, 10, 0):
+            document = SaleDocument.objects.create(
+                type='cash', customer=self.customer, cash_register='1', date=self.today - timedelta(days=days_ago)
+            )
+            DocumentItem.objects.create(document=document, product=self.product, quantity=1, price=100)
+
+    def test_rerun_after_interruption(self):
+        cutoff = self.today - timedelta(days=5)
+        with mock.patch.object(archive, '_delete_rows', side_effect=DatabaseError('прервано')):
+            with self.assertRaises(DatabaseError):
+                close_period(cutoff, batch_size=2)
+        # пачка уже в архиве, но еще в оперативной базе
+        self.assertEqual(ArchivedSaleDocument.objects.count(), 2)
+        self.assertEqual(SaleDocument.objects.count(), 4)
+
+        self.assertEqual(close_period(cutoff, batch_size=2), (3, 3))
+        self.assertEqual(SaleDocument.objects.count(), 1)
+        self.assertEqual(ArchivedSaleDocument.objects.count(), 3)
+        self.assertEqual(ArchivedDocumentItem.objects.count(), 3)
+        self.assertEqual(archive.archived_total(['cash']), 300)
+        self.assertEqual(archive.archive_boundary(), cutoff)
+
+    def test_merged_results_pages_across_databases(self):
+        close_period(self.today - timedelta(days=15))
+        merged = archive.MergedResults(
+            [
+                SaleDocument.objects.order_by('-date', '-id').values('number', 'date'),
+                ArchivedSaleDocument.objects.order_by('-date', '-id').values('number', 'date'),
+            ],
+            key=lambda row: -row['date'].toordinal(),
+        )
+        self.assertEqual(len(merged), 4)
+        dates = [row['date'] for row in merged[0:2]] + [row['date'] for row in merged[2:4]]
+        self.assertEqual(dates, [self.today - timedelta(days=days) for days in (0, 10, 20, 30)])
+
+
+class FactsExportTests(TestCase):
+    databases = {'default', 'archive'}
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        override = override_settings(STORE_FACTS_DIR=self.directory)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.customer = Customer.objects.create(name='Покупатель')
+        self.products = [make_product(name=f'Товар {i}', quantity=100) for i in range(5)]
+        self.sell(5)
+
+    def sell(self, count):
+        document = SaleDocument.objects.create(type='cash', customer=self.customer, cash_register='1')
+        DocumentItem.objects.bulk_create([
+            DocumentItem(document=document, product=product, quantity=1, price=100) for product in self.products[:count]
+        ])
+
+    def item_ids(self):
+        return list(DocumentItem.objects.order_by('id').values_list('id', flat=True))
+
+    def test_export_resumes_after_half_written_tail(self):
+        self.assertEqual(export_facts(chunk_size=2), (5, 5))
+        self.sell(3)
+        with mock.patch.object(facts, '_write_meta', side_effect=OSError('прервано')):
+            with self.assertRaises(OSError):
+                export_facts(chunk_size=2)
+        # строка дописана, но не учтена в meta.json; в одной колонке — обрывок значения
+        self.assertEqual(facts.read_meta()['count'], 5)
+        with open(self.directory / 'qty.bin', 'ab') as file:
+            file.write(b'\x01\x02\x03')
+
+        self.assertEqual(export_facts(chunk_size=2), (3, 8))
+        columns = facts.open_facts()
+        self.assertEqual(columns['id'].tolist(), self.item_ids())
+        self.assertEqual(columns['qty'].tolist(), [1] * 8)
+
+    def test_chunks_include_items_after_snapshot(self):
+        export_facts()
+        self.sell(2)
+        ids = [int(item_id) for chunk in facts.iter_fact_chunks(chunk_size=3) for item_id in chunk['id']]
+        self.assertEqual(ids, self.item_ids())
+
+
+class SalesCubeTests(TestCase):
+    databases = {'default', 'archive'}
+
+    def setUp(self):
+        self.customers = [Customer.objects.create(name=f'Покупатель {i}') for i in range(2)]
+        self.products = [make_product(name=f'Товар {i}', quantity=100) for i in range(3)]
+        self.today = timezone.localdate()
+
+    def sell(self, doc_type, customer, days_ago, lines):
+        document = SaleDocument.objects.create(
+            type=doc_type, customer=customer, cash_register='1', date=self.today - timedelta(days=days_ago)
+        )
+        for product, quantity in lines:
+            DocumentItem.objects.create(document=document, product=product, quantity=quantity, price=product.price)
+
+    def cells(self):
+        return sorted(SalesCubeCell.objects.values_list(
+            'date', 'type', 'product_id', 'customer_id', 'quantity', 'amount', 'lines'
+        ))
+
+    @mock.patch.object(pivot, 'CHUNK_SIZE', 2)
+    def test_incremental_refresh_matches_full_rebuild(self):
+        first, second, third = self.products
+        self.sell('cash', self.customers[0], 20, [(first, 1), (second, 2)])
+        self.sell('cash', self.customers[1], 3, [(first, 1)])
+        self.assertEqual(pivot.refresh_cube(), 3)
+
+        # новые позиции попадают и в уже существующие ячейки, и в новые
+        self.sell('cash', self.customers[0], 20, [(first, 2), (third, 1)])
+        self.sell('return', self.customers[1], 3, [(first, 1)])
+        self.sell('cashless', self.customers[1], 0, [(second, 5), (third, 1), (first, 1)])
+        # две позиции ушли в архив раньше, чем попали в куб
+        close_period(self.today - timedelta(days=10))
+        self.assertEqual(pivot.refresh_cube(), 6)
+        incremental = self.cells()
+
+        pivot.refresh_cube(full=True)
+        self.assertEqual(incremental, self.cells())
+        old_cell = (self.today - timedelta(days=20), 'cash', first.pk, self.customers[0].pk)
+        self.assertEqual([cell[4:] for cell in incremental if cell[:4] == old_cell], [(3, 300, 2)])
+
+
+class SalesComparisonTests(TestCase):
+    databases = {'default', 'archive'}
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name='Покупатель')
+        self.product = make_product(quantity=100)
+        self.today = timezone.localdate()
+
+    def day(self, days_ago):
+        return self.today - timedelta(days=days_ago)
+
+    def sell(self, days_ago, total, doc_type='cash'):
+        SaleDocument.objects.create(
+            type=doc_type, customer=self.customer, cash_register='1', total=total,
+            date=self.today - timedelta(days=days_ago),
+        )
+
+    def compare(self, start, end, compare_start, compare_end):
+        form = SalesReportForm({
+            'report_type': 'cash',
+            'start_date': start, 'end_date': end,
+            'compare': 'custom', 'compare_start_date': compare_start, 'compare_end_date': compare_end,
+        })
+        self.assertTrue(form.is_valid(), form.errors)
+        return _sales_comparison_data(form)['rows'][0]
+
+    def test_periods_of_different_length_across_archive(self):
+        for days_ago, total in ((40, 10), (38, 20), (36, 40), (2, 100), (0, 200)):
+            self.sell(days_ago, total)
+        self.sell(39, 1000, doc_type='return')
+        close_period(self.today - timedelta(days=20))
+        day = self.day
+
+        # три дня отчета против пяти архивных дней сравнения
+        row = self.compare(day(2), day(0), day(40), day(36))
+        self.assertEqual((row['current'], row['previous']), (300, 70))
+        self.assertEqual(
+            [(d['date'], d['compare_date'], d['current'], d['previous']) for d in row['dates']],
+            [(day(2), day(40), 100, 10), (day(0), day(38), 200, 20), (None, day(36), 0, 40)],
+        )
+
+        # и наоборот: короткий период сравнения
+        row = self.compare(day(40), day(36), day(2), day(0))
+        self.assertEqual((row['current'], row['previous']), (70, 300))
+        self.assertEqual(row['dates'][-1]['compare_date'], None)
+
+
+class SearchTests(TestCase):
+    databases = {'default', 'archive'}
+
+    def search(self, resource, **params):
+        response = self.client.get(reverse('api_search', args=[resource]), params)
+        self.assertEqual(response.status_code, 200)
+        return [row['text'] for row in response.json()['results']]
+
+    def test_customer_prefix_with_capitalised_names(self):
+        for name in ('Иванов', 'Иванова', 'Петров', 'ООО Иван-Чай', 'иванько'):
+            Customer.objects.create(name=name)
+        self.assertEqual(self.search('customers', q='иван'), ['Иванов', 'Иванова', 'иванько'])
+        self.assertEqual(self.search('customers', q='Иванов'), ['Иванов', 'Иванова'])
+        self.assertEqual(self.search('customers', q=' петр '), ['Петров'])
+        self.assertEqual(self.search('customers', q='чай'), [])
+
+    def test_document_number_prefix(self):
+        customer = Customer.objects.create(name='Покупатель')
+        document = SaleDocument.objects.create(type='cash', customer=customer, cash_register='1')
+        number = document.number
+        self.assertEqual(len(self.search('documents', q=number.lower(), types='cash')), 1)
+        self.assertEqual(len(self.search('documents', q=number.split('-')[-1], types='cash')), 1)
+        self.assertEqual(self.search('documents', q=number, types='return'), [])
+
+
+@override_settings(STORE_AUDIT_ASYNC=False)
+class RepriceTests(TestCase):
+    def test_future_price_applies_on_effective_date(self):
+        product = make_product(price=100)
+        other = make_product(name='Другой', price=50)
+        today = timezone.localdate()
+        effective = today + timedelta(days=3)
+
+        self.assertEqual(reprice({product.pk: Decimal('120.00')}, effective_from=effective), 0)
+        product.refresh_from_db()
+        self.assertEqual(product.price, 100)
+        self.assertEqual(Product.prices_on([product.pk, other.pk], today), {product.pk: 100, other.pk: 50})
+        self.assertEqual(Product.prices_on([product.pk], effective)[product.pk], 120)
+
+        self.assertEqual(apply_due_prices(effective - timedelta(days=1)), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(apply_due_prices(effective), 1)
+        product.refresh_from_db()
+        self.assertEqual(product.price, 120)
+        self.assertEqual(apply_due_prices(effective), 0)
+        # цена на дату раньше переоценки остается прежней
+        self.assertEqual(Product.prices_on([product.pk], today)[product.pk], 100)
+        self.assertEqual(
+            AuditEntry.objects.filter(model='product', object_id=product.pk, action='update').last().changes,
+            {'price': ['100.00', '120.00']},
+        )
+
+
+class CatalogImportTests(TestCase):
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.product = make_product(name='Мышь', price=100, quantity=2, sku='A1')
+        PriceHistory.objects.create(product=self.product, price=90, effective_from=self.today - timedelta(days=30))
+        PriceHistory.objects.create(product=self.product, price=100, effective_from=self.today - timedelta(days=10))
+
+    def xlsx(self, rows):
+        workbook = Workbook()
+        for row in rows:
+            workbook.active.append(row)
+        data = BytesIO()
+        workbook.save(data)
+        data.seek(0)
+        return data
+
+    def check_upsert(self, rows):
+        report = import_catalog(rows)
+        self.assertEqual((report['inserted'], report['updated'], report['unmatched']), (1, 1, []))
+
+        self.product.refresh_from_db()
+        self.assertEqual(
+            (self.product.name, self.product.price, self.product.quantity), ('Мышь беспроводная', 110, 7)
+        )
+        history = list(self.product.price_history.order_by('effective_from').values_list('effective_from', 'price'))
+        self.assertEqual(history, [
+            (self.today - timedelta(days=30), 90), (self.today - timedelta(days=10), 100), (self.today, 110),
+        ])
+        self.assertEqual(Product.prices_on([self.product.pk], self.today - timedelta(days=20))[self.product.pk], 90)
+        new = Product.objects.get(sku='B2')
+        self.assertEqual(list(new.price_history.values_list('price', flat=True)), [50])
+
+    def test_csv_upsert_keeps_price_history(self):
+        data = BytesIO('артикул;наименование;цена;количество\nA1;Мышь беспроводная;110;5\nB2;Коврик;50;3\n'.encode())
+        self.check_upsert(list(iter_upload_rows(data, 'catalog.csv')))
+
+    @skipIf(Workbook is None, "нужен пакет openpyxl")
+    def test_xlsx_upsert_keeps_price_history(self):
+        data = self.xlsx([
+            ('sku', 'name', 'price', 'qty'), ('A1', 'Мышь беспроводная', 110, 5), ('B2', 'Коврик', 50, 3),
+        ])
+        self.check_upsert(list(iter_upload_rows(data, 'catalog.xlsx')))
+
+        # повторная загрузка того же файла не меняет цены и историю
+        data.seek(0)
+        report = import_catalog(iter_upload_rows(data, 'catalog.xlsx'))
+        self.assertEqual(report['inserted'], 0)
+        self.assertEqual(PriceHistory.objects.filter(product=self.product).count(), 3)
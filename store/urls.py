@@ -8,22 +8,49 @@ urlpatterns = [
     # Списки
     path('customer_list/', views.CustomerListView.as_view(), name='customers'),
     path('product_list/', views.ProductListView.as_view(), name='products'),
+    path('products/import/', views.import_products, name='import_products'),
+    path('stocktakes/', views.StocktakeListView.as_view(), name='stocktakes'),
+    path('stocktakes/create/', views.create_stocktake, name='create_stocktake'),
+    path('stocktakes/<int:pk>/', views.StocktakeDetailView.as_view(), name='stocktake_detail'),
+    path('stocktakes/<int:pk>/post/', views.post_stocktake, name='post_stocktake'),
 
     # Счета на оплату
     path('invoices/create/', views.create_invoice, name='invoice_form'),
-    #path('invoices/<int:pk>/', views.InvoiceDetailView.as_view(), name='detail'),
+    path('invoices/<int:pk>/', views.InvoiceDetailView.as_view(), name='invoice_detail'),
     path('invoices/<int:pk>/mark_paid/', views.mark_invoice_paid, name='mark_invoice_paid'),
+    path('invoices/pay_statement/', views.pay_invoices_from_statement, name='pay_invoices_from_statement'),
 
     # Документы продаж
     path('sale_documents/create/<str:doc_type>/', views.create_sale_document, name='create_sale_document'),
     path('sale_documents/<int:pk>/', views.SaleDocumentDetailView.as_view(), name='detail'),
 
+    # Кассы и смены
+    path('registers/', views.CashRegisterListView.as_view(), name='registers'),
+    path('registers/<int:pk>/open_shift/', views.open_shift, name='open_shift'),
+    path('shifts/<int:pk>/', views.ShiftDetailView.as_view(), name='shift_detail'),
+    path('shifts/<int:pk>/close/', views.close_shift, name='close_shift'),
+
     # Отчеты
     path('reports/sales/', views.sales_report, name='sales_report'),
+    path('reports/products/', views.product_analytics, name='product_analytics'),
+    path('audit/', views.AuditLogView.as_view(), name='audit_log'),
+    path('reports/pivot/', views.pivot_report, name='pivot_report'),
+    path('reports/reorder/', views.ReorderReportView.as_view(), name='reorder_report'),
 
     # API
     path('api/products/<int:product_id>/price/', views.get_product_price, name='get_product_price'),
     path('api/customers/<int:customer_id>/invoices/', views.get_customer_invoices, name='get_customer_invoices'),
+    path('api/search/<str:resource>/', views.api_search, name='api_search'),
+    path('api/analytics/products/', views.api_product_analytics, name='api_product_analytics'),
+    path('api/pos/receipts/', views.api_pos_receipts, name='api_pos_receipts'),
+    path('api/documents/', views.api_list, {'resource': 'documents'}, name='api_documents'),
+    path('api/documents/<int:pk>/', views.api_detail, {'resource': 'documents'}, name='api_document'),
+    path('api/invoices/', views.api_list, {'resource': 'invoices'}, name='api_invoices'),
+    path('api/invoices/<int:pk>/', views.api_detail, {'resource': 'invoices'}, name='api_invoice'),
+    path('api/customers/', views.api_list, {'resource': 'customers'}, name='api_customers'),
+    path('api/customers/<int:pk>/', views.api_detail, {'resource': 'customers'}, name='api_customer'),
+    path('api/products/', views.api_list, {'resource': 'products'}, name='api_products'),
+    path('api/products/<int:pk>/', views.api_detail, {'resource': 'products'}, name='api_product'),
 
     # Журнал
     path('journal/', views.DocumentListView.as_view(), name='document_list'),
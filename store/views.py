@@ -1,30 +1,52 @@
+import heapq
+import json
 from datetime import timedelta, datetime
 from decimal import Decimal
 
+from django.conf import settings
 from django.contrib import messages
-from django.db.models import Sum, ProtectedError, Case, When, F
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Sum, ProtectedError, Case, When, F, Prefetch, Q
 from django.forms import inlineformset_factory
-from django.http import JsonResponse, HttpResponseRedirect
+from django.http import JsonResponse, HttpResponseRedirect, QueryDict
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse_lazy
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.views.generic import ListView, DetailView, UpdateView, DeleteView
 from collections import defaultdict
 
+from . import api, audit, pivot, search
+from .archive import MergedResults, archived_total, reaches_archive
+from .cache import data_version
 from .forms import (
     InvoiceForm, InvoiceItemForm,
-    SaleDocumentForm, DocumentItemForm, SalesReportForm
+    SaleDocumentForm, SaleDocumentEditForm, DocumentItemForm, SalesReportForm, ProductAnalyticsForm,
+    BankStatementForm, PivotReportForm, ProductImportForm, StocktakeForm
+)
+from .importers import import_catalog, iter_upload_rows, pay_bank_statement, read_stocktake_counts
+from .pos import MAX_BATCH_SIZE, sync_receipts
+from .models import (
+    Customer, Product, Invoice, SaleDocument, DocumentItem, InvoiceItem, StockForecast,
+    CashRegister, Shift, ArchivedSaleDocument, ArchivedDailySales, AuditEntry, Stocktake
 )
-from .models import Customer, Product, Invoice, SaleDocument, DocumentItem, InvoiceItem
 
 from django.db.models import Value, CharField
 from django.db.models.functions import Concat
 from django.core.paginator import Paginator
-from django.db.models import IntegerField
+from django.db.models import BooleanField, IntegerField
 from django.db.models.functions import Cast, Substr
 
 
 def home(request):
+    # показатели считаются, только если фрагмент панели не найден в кэше
+    return render(request, 'store/dashboard.html', {'stats': SimpleLazyObject(_dashboard_stats)})
+
+
+def _dashboard_stats():
     today = timezone.now().date()
     week_ago = today - timedelta(days=7)
     month_ago = today - timedelta(days=30)
@@ -41,16 +63,20 @@ def home(request):
         total=Sum('total')
     )['total'] or Decimal('0.00')
 
-    context = {
-        'stats': {
-            'sales_today': sales_today,
-            'sales_week': sales_week,
-            'sales_month': sales_month,
-            'total_sales_amount': total_sales_amount,
-            'total_returns_amount': total_returns_amount,
-        }
+    # закрытые периоды — по дневным итогам архива
+    sales_types = ['cash', 'cashless']
+    sales_week += archived_total(sales_types, week_ago)
+    sales_month += archived_total(sales_types, month_ago)
+    total_sales_amount += archived_total(sales_types)
+    total_returns_amount += archived_total(['return'])
+
+    return {
+        'sales_today': sales_today,
+        'sales_week': sales_week,
+        'sales_month': sales_month,
+        'total_sales_amount': total_sales_amount,
+        'total_returns_amount': total_returns_amount,
     }
-    return render(request, 'store/dashboard.html', context)
 
 
 # Базовые представления
@@ -60,6 +86,50 @@ class CustomerListView(ListView):
     context_object_name = 'customers'
     paginate_by = 20
 
+    # Сортировки по накопленной статистике (все поля проиндексированы)
+    SORTS = {
+        'revenue': '-stats__revenue',
+        'returns': '-stats__returns_total',
+        'documents': '-stats__document_count',
+        'first_purchase': 'stats__first_purchase',
+        'last_purchase': '-stats__last_purchase',
+        'lapsed': 'stats__last_purchase',
+    }
+
+    def get_queryset(self):
+        qs = Customer.objects.select_related('stats')
+
+        sort = self.request.GET.get('sort')
+        min_revenue = self.request.GET.get('min_revenue')
+        last_before = self.request.GET.get('last_before')
+        last_after = self.request.GET.get('last_after')
+
+        # фильтрация и сортировка по статистике затрагивают только покупателей с продажами
+        if sort in self.SORTS or min_revenue or last_before or last_after:
+            qs = qs.filter(stats__isnull=False)
+
+        if min_revenue:
+            try:
+                qs = qs.filter(stats__revenue__gte=Decimal(min_revenue))
+            except ArithmeticError:
+                pass
+
+        if last_before:
+            try:
+                qs = qs.filter(stats__last_purchase__lt=datetime.strptime(last_before, '%Y-%m-%d'))
+            except ValueError:
+                pass
+
+        if last_after:
+            try:
+                qs = qs.filter(stats__last_purchase__gte=datetime.strptime(last_after, '%Y-%m-%d'))
+            except ValueError:
+                pass
+
+        if sort in self.SORTS:
+            return qs.order_by(self.SORTS[sort], 'id')
+        return qs.order_by('name', 'id')
+
 
 class ProductListView(ListView):
     model = Product
@@ -68,6 +138,116 @@ class ProductListView(ListView):
     paginate_by = 20
 
 
+def import_products(request):
+    report = None
+    if request.method == 'POST':
+        form = ProductImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            try:
+                report = import_catalog(
+                    iter_upload_rows(upload, upload.name), dry_run=form.cleaned_data['dry_run']
+                )
+            except ValueError as exc:
+                form.add_error('file', str(exc))
+            else:
+                messages.success(
+                    request,
+                    f"Добавлено товаров: {report['inserted']}, обновлено: {report['updated']}, "
+                    f"отклонено строк: {len(report['unmatched'])}"
+                )
+    else:
+        form = ProductImportForm()
+
+    return render(request, 'store/products/import.html', {
+        'form': form,
+        'report': report,
+    })
+
+
+# Инвентаризация
+
+
+class StocktakeListView(ListView):
+    model = Stocktake
+    template_name = 'store/stocktakes/list.html'
+    context_object_name = 'stocktakes'
+    paginate_by = 20
+
+
+def create_stocktake(request):
+    errors = []
+    if request.method == 'POST':
+        form = StocktakeForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            try:
+                counts, errors = read_stocktake_counts(iter_upload_rows(upload, upload.name))
+            except ValueError as exc:
+                form.add_error('file', str(exc))
+            else:
+                if counts:
+                    stocktake = Stocktake.from_counts(
+                        counts, full=form.cleaned_data['full'], comment=form.cleaned_data['comment']
+                    )
+                    messages.success(request, f"{stocktake}: товаров в пересчете {len(counts)}")
+                    if not errors:
+                        return redirect(stocktake)
+                else:
+                    form.add_error('file', "В файле нет ни одного найденного товара")
+    else:
+        form = StocktakeForm()
+
+    return render(request, 'store/stocktakes/create.html', {
+        'form': form,
+        'errors': errors,
+    })
+
+
+class StocktakeDetailView(DetailView):
+    """Строки инвентаризации; у черновика расхождение считается с текущим остатком"""
+    model = Stocktake
+    template_name = 'store/stocktakes/detail.html'
+    context_object_name = 'stocktake'
+    paginate_by = 100
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        lines = self.object.lines.select_related('product')
+        if not self.object.is_posted:
+            lines = lines.annotate(
+                book=F('product__quantity'), diff=F('counted') - F('product__quantity')
+            )
+        else:
+            lines = lines.annotate(book=F('book_quantity'), diff=F('difference'))
+        if self.request.GET.get('differences'):
+            lines = lines.exclude(diff=0)
+        context['totals'] = lines.aggregate(
+            surplus=Sum(Case(When(diff__gt=0, then=F('diff')), default=0)),
+            shortage=Sum(Case(When(diff__lt=0, then=F('diff')), default=0)),
+        )
+        if self.object.full and not self.object.is_posted:
+            context['uncounted'] = Product.objects.exclude(
+                pk__in=self.object.lines.values('product_id')
+            ).exclude(quantity=0).count()
+        context['page_obj'] = Paginator(lines.order_by('product__name', 'id'), self.paginate_by).get_page(
+            self.request.GET.get('page')
+        )
+        return context
+
+
+def post_stocktake(request, pk):
+    stocktake = get_object_or_404(Stocktake, pk=pk)
+    if request.method == 'POST':
+        try:
+            changed = stocktake.post()
+        except ValidationError as exc:
+            messages.error(request, exc.message)
+        else:
+            messages.success(request, f"{stocktake} проведена, товаров с расхождением: {changed}")
+    return redirect(stocktake)
+
+
 # Счета на оплату
 def create_invoice(request):
     InvoiceItemFormSet = inlineformset_factory(
@@ -101,36 +281,110 @@ def create_invoice(request):
 
 
 class InvoiceDetailView(DetailView):
+    """Счет: один запрос при попадании в кэш фрагмента, два — при промахе"""
     model = Invoice
     template_name = 'store/invoices/detail.html'
     context_object_name = 'invoice'
 
+    def get_queryset(self):
+        return Invoice.objects.select_related('customer', 'sale_document')
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['items'] = self.object.items.all()
+        # ленивый запрос: выполняется, только если фрагмент не найден в кэше
+        context['items'] = self.object.items.select_related('product').order_by('id')
+        context['cache_timeout'] = settings.STORE_DETAIL_CACHE_TIMEOUT
+        # фрагмент показывает имена покупателя и товаров: их изменение тоже перестраивает его
+        context['data_version'] = data_version(['customers', 'catalog'])
         return context
 
 
 def mark_invoice_paid(request, pk):
     invoice = get_object_or_404(Invoice, pk=pk)
     if not invoice.is_paid:
-        invoice.is_paid = True
-        invoice.save()
-        messages.success(request, f"Счет №{invoice.number} помечен как оплаченный")
+        try:
+            invoice.mark_paid()
+        except ValidationError as e:
+            messages.error(request, " ".join(e.messages))
+        else:
+            messages.success(request, f"Счет №{invoice.number} помечен как оплаченный")
     return redirect('invoice_detail', pk=invoice.pk)
 
 
+def pay_invoices_from_statement(request):
+    report = None
+    if request.method == 'POST':
+        form = BankStatementForm(request.POST, request.FILES)
+        if form.is_valid():
+            report = pay_bank_statement(form.cleaned_data['statement'].read())
+            messages.success(request, f"Оплачено счетов: {report['paid']}")
+    else:
+        form = BankStatementForm()
+
+    return render(request, 'store/invoices/pay_statement.html', {
+        'form': form,
+        'report': report,
+    })
+
+
+# Кассы и смены
+
+
+class CashRegisterListView(ListView):
+    template_name = 'store/registers/list.html'
+    context_object_name = 'registers'
+
+    def get_queryset(self):
+        return CashRegister.objects.filter(is_active=True).prefetch_related(
+            Prefetch('shifts', queryset=Shift.objects.filter(closed_at__isnull=True), to_attr='open_shifts')
+        )
+
+
+def open_shift(request, pk):
+    register = get_object_or_404(CashRegister, pk=pk)
+    if request.method == 'POST':
+        shift = register.open_shift()
+        messages.success(request, f"Касса {register.code}: открыта смена №{shift.number}")
+    return redirect('registers')
+
+
+def close_shift(request, pk):
+    shift = get_object_or_404(Shift, pk=pk)
+    if request.method == 'POST' and shift.is_open:
+        shift.close()
+        messages.success(request, f"{shift} закрыта")
+    return redirect('shift_detail', pk=shift.pk)
+
+
+class ShiftDetailView(DetailView):
+    """Z-отчет: итоги смены хранятся в самой смене"""
+    model = Shift
+    template_name = 'store/registers/shift_detail.html'
+    context_object_name = 'shift'
+
+    def get_queryset(self):
+        return Shift.objects.select_related('register')
+
+
 # Документы продаж
 
 
 class SaleDocumentDetailView(DetailView):
+    """Документ: один запрос при попадании в кэш фрагмента, два — при промахе"""
     model = SaleDocument
     template_name = 'store/documents/detail.html'
     context_object_name = 'document'
 
+    def get_queryset(self):
+        return SaleDocument.objects.select_related('customer', 'invoice', 'original_sale', 'register')
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['items'] = self.object.items.all()
+        # ленивый запрос: выполняется, только если фрагмент не найден в кэше
+        context['items'] = self.object.items.select_related('product').order_by('id')
+        context['cache_timeout'] = settings.STORE_DETAIL_CACHE_TIMEOUT
+        # фрагмент показывает имена покупателя и товаров: их изменение тоже перестраивает его
+        context['data_version'] = data_version(['customers', 'catalog'])
         return context
 
 
@@ -143,7 +397,15 @@ TYPE_NAMES = {
 
 def sales_report(request):
     form = SalesReportForm(request.GET or None)
+    # отчет строится, только если фрагмент не найден в кэше
+    report = SimpleLazyObject(lambda: _sales_report_data(form))
+    return render(request, 'store/reports/sales_report.html', {
+        'form': form,
+        'report': report,
+    })
 
+
+def _sales_report_data(form):
     raw_report_data = defaultdict(lambda: {
         'total': Decimal('0.00'),
         'dates': defaultdict(lambda: {'total': Decimal('0.00'), 'documents': []})
@@ -166,6 +428,17 @@ def sales_report(request):
 
         docs = docs.order_by('type', 'date')
 
+        if reaches_archive(start_date):
+            # период захватывает закрытые годы — добавляем документы архива
+            archived = ArchivedSaleDocument.objects.order_by('type', 'date')
+            if report_type:
+                archived = archived.filter(type=report_type)
+            if start_date:
+                archived = archived.filter(date__gte=start_date)
+            if end_date:
+                archived = archived.filter(date__lte=end_date)
+            docs = heapq.merge(archived, docs, key=lambda doc: (doc.type, doc.date))
+
         for doc in docs:
             rd = raw_report_data[doc.type]
             rd['total'] += doc.total
@@ -198,21 +471,258 @@ def sales_report(request):
             'dates': dates_dict,
         })
 
-    context = {
-        'form': form,
-        'report_data': report_data,
+    return {
+        'rows': report_data,
         'overall_total': overall_total,
+        'comparison': _sales_comparison_data(form) if form.is_valid() else None,
+    }
+
+
+def _daily_totals(report_type, periods):
+    """Суммы документов {(тип, дата): сумма} за несколько периодов одним запросом"""
+    dates = Q()
+    for start_date, end_date in periods:
+        dates |= Q(date__range=(start_date, end_date))
+    totals = defaultdict(lambda: Decimal('0.00'))
+    sources = [SaleDocument.objects.filter(dates).values('type', 'date').annotate(total=Sum('total'))]
+    if reaches_archive(min(start_date for start_date, _ in periods)):
+        # закрытые периоды — по дневным итогам архива
+        sources.append(ArchivedDailySales.objects.filter(dates).values('type', 'date', 'total'))
+    for qs in sources:
+        if report_type:
+            qs = qs.filter(type=report_type)
+        for row in qs.order_by():
+            totals[(row['type'], row['date'])] += row['total']
+    return totals
+
+
+def _delta(current, previous):
+    return {
+        'current': current,
+        'previous': previous,
+        'delta': current - previous,
+        'percent': round((current - previous) * 100 / previous, 1) if previous else None,
+    }
+
+
+def _sales_comparison_data(form):
+    """Сравнение отчетного периода с периодом сравнения по типам и дням.
+
+    Дни сопоставляются по порядковому номеру в периоде: первый день
+    с первым днем и т.д.
+    """
+    compare_period = form.comparison_period()
+    if compare_period is None:
+        return None
+    start_date, end_date = form.cleaned_data['start_date'], form.cleaned_data['end_date']
+    compare_start, compare_end = compare_period
+    totals = _daily_totals(form.cleaned_data['report_type'], [(start_date, end_date), compare_period])
+
+    zero = Decimal('0.00')
+    days = max((end_date - start_date).days, (compare_end - compare_start).days) + 1
+    report_type = form.cleaned_data['report_type']
+    rows = []
+    for type_key in [report_type] if report_type else TYPE_NAMES:
+        dates = []
+        for offset in range(days):
+            day = start_date + timedelta(days=offset)
+            compare_day = compare_start + timedelta(days=offset)
+            # периоды разной длины: у более короткого дни заканчиваются раньше
+            day = day if day <= end_date else None
+            compare_day = compare_day if compare_day <= compare_end else None
+            current = totals.get((type_key, day), zero)
+            previous = totals.get((type_key, compare_day), zero)
+            if current or previous:
+                dates.append(dict(_delta(current, previous), date=day, compare_date=compare_day))
+
+        current = sum((day['current'] for day in dates), zero)
+        previous = sum((day['previous'] for day in dates), zero)
+        rows.append(dict(
+            _delta(current, previous),
+            type_key=type_key,
+            type_name=TYPE_NAMES.get(type_key, type_key),
+            dates=dates,
+        ))
+
+    return {
+        'start_date': start_date,
+        'end_date': end_date,
+        'compare_start_date': compare_start,
+        'compare_end_date': compare_end,
+        'rows': rows,
+        'overall': _delta(sum((row['current'] for row in rows), zero), sum((row['previous'] for row in rows), zero)),
     }
 
-    return render(request, 'store/reports/sales_report.html', context)
 
+def _product_analytics_data(form):
+    # NumPy загружается при первом отчете, а не при каждом импорте views
+    from . import analytics
+
+    data = None
+    if form.is_valid():
+        data = analytics.product_analytics(
+            start_date=form.cleaned_data['start_date'],
+            end_date=form.cleaned_data['end_date'],
+            window=form.cleaned_data['window'] or 30,
+            top=form.cleaned_data['top'] or 20,
+        )
+    return form, data
+
+
+def product_analytics(request):
+    form, data = _product_analytics_data(ProductAnalyticsForm(request.GET or None))
+    return render(request, 'store/reports/product_analytics.html', {
+        'form': form,
+        'analytics': data,
+    })
+
+
+class ReorderReportView(ListView):
+    """Товары, которые закончатся в ближайшие дни (по ночному прогнозу)"""
+    template_name = 'store/reports/reorder_report.html'
+    context_object_name = 'forecasts'
+    paginate_by = 50
+    default_horizon = 30
+
+    def get_horizon(self):
+        try:
+            return max(0, int(self.request.GET.get('days', self.default_horizon)))
+        except ValueError:
+            return self.default_horizon
+
+    def get_queryset(self):
+        return StockForecast.objects.filter(
+            days_left__lte=self.get_horizon()
+        ).select_related('product').order_by('days_left', 'product_id')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['horizon'] = self.get_horizon()
+        return context
+
+
+def _pivot_url(params, **changes):
+    """Адрес сводного отчета с измененными параметрами (None убирает параметр)"""
+    params = params.copy()
+    for name, value in changes.items():
+        if value is None:
+            params.pop(name, None)
+        else:
+            params[name] = value.isoformat() if hasattr(value, 'isoformat') else str(value)
+    return f"?{params.urlencode()}"
+
+
+def pivot_report(request):
+    """Сводный отчет по кубу продаж с детализацией и сверткой"""
+    defaults = {'rows': 'month', 'columns': 'type', 'measure': 'net'}
+    form = PivotReportForm(dict(defaults, **request.GET.dict()))
+    report = filters = roll_up_url = None
+    if form.is_valid():
+        data = form.cleaned_data
+        params = QueryDict(mutable=True)
+        for name, value in form.data.items():
+            params[name] = value
+        slices = {name: data[name] for name in pivot.SLICE_DIMENSIONS if data[name]}
+        report = pivot.pivot(
+            rows=data['rows'],
+            columns=data['columns'] or None,
+            measure=data['measure'],
+            start_date=data['start_date'],
+            end_date=data['end_date'],
+            slices=slices,
+        )
+
+        for row in report['rows']:
+            rows, drill = pivot.drill_down(data['rows'], row['key'])
+            if rows:
+                # неделя на границе выбранного периода не расширяет его
+                if data['start_date'] and drill.get('start_date'):
+                    drill['start_date'] = max(drill['start_date'], data['start_date'])
+                if data['end_date'] and drill.get('end_date'):
+                    drill['end_date'] = min(drill['end_date'], data['end_date'])
+                columns = '' if rows == data['columns'] else data['columns']
+                row['drill_url'] = _pivot_url(params, rows=rows, columns=columns, **drill)
+        if data['rows'] in pivot.ROLL_UP:
+            rows = pivot.ROLL_UP[data['rows']]
+            roll_up_url = _pivot_url(params, rows=rows, columns='' if rows == data['columns'] else data['columns'])
+
+        filters = [
+            {'label': f"{pivot.DIMENSIONS[name][0]}: {label}",
+             'url': _pivot_url(params, **{name: None})}
+            for name, label in pivot.slice_labels(slices).items()
+        ]
+        if data['start_date'] or data['end_date']:
+            filters.append({
+                'label': "Период: {} — {}".format(
+                    data['start_date'].strftime('%d.%m.%Y') if data['start_date'] else '…',
+                    data['end_date'].strftime('%d.%m.%Y') if data['end_date'] else '…',
+                ),
+                'url': _pivot_url(params, start_date=None, end_date=None),
+            })
+
+    return render(request, 'store/reports/pivot_report.html', {
+        'form': form,
+        'report': report,
+        'filters': filters,
+        'roll_up_url': roll_up_url,
+        'cube_updated_at': pivot.cube_updated_at(),
+    })
+
+
+class AuditLogView(ListView):
+    """Поиск по журналу изменений: объект (модель и id), период, пользователь"""
+    template_name = 'store/audit/list.html'
+    context_object_name = 'entries'
+    paginate_by = 50
+
+    def get_queryset(self):
+        params = self.request.GET
+        qs = AuditEntry.objects.order_by('-created_at', '-id')
+        if params.get('model') in self.model_names():
+            qs = qs.filter(model=params['model'])
+            if params.get('object_id', '').isdigit():
+                qs = qs.filter(object_id=int(params['object_id']))
+        date_from, date_to = self._parse_date('date_from'), self._parse_date('date_to')
+        if date_from:
+            qs = qs.filter(created_at__date__gte=date_from)
+        if date_to:
+            qs = qs.filter(created_at__date__lte=date_to)
+        if params.get('user'):
+            qs = qs.filter(user=params['user'])
+        return qs
+
+    def _parse_date(self, name):
+        try:
+            return datetime.strptime(self.request.GET.get(name, ''), '%Y-%m-%d').date()
+        except ValueError:
+            return None
+
+    @staticmethod
+    def model_names():
+        return {model._meta.model_name: model._meta.verbose_name for model in audit.AUDITED_MODELS}
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        models = {model._meta.model_name: model for model in audit.AUDITED_MODELS}
+        for entry in context['entries']:
+            entry.model_label = models[entry.model]._meta.verbose_name
+            fields = {field.attname: field.verbose_name for field in models[entry.model]._meta.concrete_fields}
+            entry.rows = [
+                {
+                    'field': fields.get(name, name),
+                    'old': value[0] if entry.action == 'update' else None,
+                    'new': value[1] if entry.action == 'update' else value,
+                }
+                for name, value in entry.changes.items()
+            ]
+        context['models'] = self.model_names()
+        return context
 
 
 # Вспомогательные API
 def get_product_price(request, product_id):
     product = get_object_or_404(Product, pk=product_id)
-    return JsonResponse({'price': str(product.price), 'quantity': product.quantity})
+    return JsonResponse({'price': str(product.price), 'quantity': product.available_quantity()})
 
 
 def get_customer_invoices(request, customer_id):
@@ -220,6 +730,60 @@ def get_customer_invoices(request, customer_id):
     invoices = customer.invoice_set.filter(is_paid=False).values('id', 'number', 'total')
     return JsonResponse(list(invoices), safe=False)
 
+
+def api_search(request, resource):
+    """Первые совпадения для полей с автодополнением: {"results": [{"id", "text"}]}"""
+    if resource not in search.SEARCHES:
+        return JsonResponse({'error': "Неизвестный справочник"}, status=404)
+    return JsonResponse({'results': search.SEARCHES[resource](request.GET)})
+
+
+@csrf_exempt
+@require_POST
+def api_pos_receipts(request):
+    """Пачка чеков кассового терминала: {"register": код, "receipts": [...]}"""
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': "Некорректный JSON"}, status=400)
+    if not isinstance(payload, dict):
+        return JsonResponse({'error': "Ожидается объект"}, status=400)
+
+    register = CashRegister.objects.filter(code=payload.get('register'), is_active=True).first()
+    if register is None:
+        return JsonResponse({'error': "Касса не найдена"}, status=404)
+    receipts = payload.get('receipts')
+    if not isinstance(receipts, list) or len(receipts) > MAX_BATCH_SIZE:
+        return JsonResponse({'error': f"receipts — список не длиннее {MAX_BATCH_SIZE} чеков"}, status=400)
+
+    return JsonResponse({'results': sync_receipts(register, receipts)})
+
+
+def api_product_analytics(request):
+    form, data = _product_analytics_data(ProductAnalyticsForm(request.GET))
+    if data is None:
+        return JsonResponse({'errors': form.errors}, status=400)
+    return JsonResponse(data)
+
+# REST API только для чтения
+def api_list(request, resource):
+    try:
+        data = api.list_objects(api.RESOURCES[resource], request.GET, request.path)
+    except ValidationError as error:
+        return JsonResponse({'error': error.messages}, status=400)
+    return JsonResponse(data)
+
+
+def api_detail(request, resource, pk):
+    try:
+        data = api.get_object(api.RESOURCES[resource], request.GET, pk)
+    except ValidationError as error:
+        return JsonResponse({'error': error.messages}, status=400)
+    if data is None:
+        return JsonResponse({'error': "Не найдено"}, status=404)
+    return JsonResponse(data)
+
+
 # Журнал
 class DocumentListView(ListView):
     template_name = 'store/documents/document_list.html'
@@ -227,53 +791,62 @@ class DocumentListView(ListView):
     paginate_by = 20
 
     def get_queryset(self):
-        qs = SaleDocument.objects.annotate(
-            doc_type=Case(
-                When(type='cash', then=Value('Наличный')),
-                When(type='cashless', then=Value('Безналичный')),
-                When(type='return', then=Value('Возврат')),
-                default=Value('Неизвестно'),
-                output_field=CharField()
-            ),
-            doc_number=Concat(Value('Документ №'), 'number', output_field=CharField()),
-            customer_name=F('customer__name'),
-            number_numeric=Cast(Substr('number', 4), IntegerField())
-        ).order_by('-date', 'type', 'number_numeric')
-
         # фильтрация
         doc_type = self.request.GET.get('type')
-        start_date = self.request.GET.get('start_date')
-        end_date = self.request.GET.get('end_date')
+        start_date = self._parse_date('start_date')
+        end_date = self._parse_date('end_date')
         customer = self.request.GET.get('customer')
 
-        if doc_type:
-            qs = qs.filter(type=doc_type)
-
-        if start_date:
-            try:
-                qs = qs.filter(date__gte=datetime.strptime(start_date, '%Y-%m-%d'))
-            except ValueError:
-                pass
-
-        if end_date:
-            try:
-                qs = qs.filter(date__lte=datetime.strptime(end_date, '%Y-%m-%d'))
-            except ValueError:
-                pass
-
-        if customer:
-            qs = qs.filter(customer__name__icontains=customer)
-
-        combined = list(qs.values(
-            'id', 'date', 'doc_type', 'doc_number', 'number_numeric', 'total', 'customer_name'
-        ))
-
-        return combined
+        def journal(model):
+            qs = model.objects.annotate(
+                doc_type=Case(
+                    When(type='cash', then=Value('Наличный')),
+                    When(type='cashless', then=Value('Безналичный')),
+                    When(type='return', then=Value('Возврат')),
+                    default=Value('Неизвестно'),
+                    output_field=CharField()
+                ),
+                doc_number=Concat(Value('Документ №'), 'number', output_field=CharField()),
+                number_numeric=Cast(Substr('number', 4), IntegerField()),
+                archived=Value(model is ArchivedSaleDocument, output_field=BooleanField()),
+            ).order_by('-date', 'type', 'number_numeric')
+            if model is SaleDocument:
+                qs = qs.annotate(customer_name=F('customer__name'))
+
+            if doc_type:
+                qs = qs.filter(type=doc_type)
+            if start_date:
+                qs = qs.filter(date__gte=start_date)
+            if end_date:
+                qs = qs.filter(date__lte=end_date)
+            if customer:
+                qs = qs.filter(customer_name__icontains=customer)
+
+            # ленивый запрос: строки страницы читаются, только если фрагмент не найден в кэше
+            return qs.values(
+                'id', 'type', 'date', 'doc_type', 'doc_number', 'number_numeric', 'total',
+                'customer_name', 'archived'
+            )
+
+        documents = journal(SaleDocument)
+        if not reaches_archive(start_date):
+            return documents
+        # период начинается в закрытом периоде — добавляем документы архива
+        return MergedResults(
+            [documents, journal(ArchivedSaleDocument)],
+            key=lambda row: (-row['date'].toordinal(), row['type'], row['number_numeric'] or 0),
+        )
+
+    def _parse_date(self, name):
+        try:
+            return datetime.strptime(self.request.GET.get(name, ''), '%Y-%m-%d').date()
+        except ValueError:
+            return None
 
 
 class SaleDocumentUpdateView(UpdateView):
     model = SaleDocument
-    fields = '__all__'
+    form_class = SaleDocumentEditForm
     template_name = 'store/documents/edit.html'
     success_url = reverse_lazy('document_list')
 
@@ -307,32 +880,44 @@ def create_sale_document(request, doc_type):
     )
 
     if request.method == 'POST':
-        form = SaleDocumentForm(request.POST)
-        formset = DocumentItemFormSet(request.POST, prefix='items')
+        form = SaleDocumentForm(request.POST, with_register=doc_type in ('cash', 'return'))
+        # позиции проверяют остаток по типу документа (DocumentItemForm.clean_quantity)
+        formset = DocumentItemFormSet(
+            request.POST, prefix='items', form_kwargs={'document': SaleDocument(type=doc_type)}
+        )
 
         if form.is_valid() and formset.is_valid():
-            document = form.save(commit=False)
-            document.type = doc_type
-            document.save()
-
-            instances = formset.save(commit=False)
-            for instance in instances:
-                instance.document = document
-                if not instance.price:
-                    instance.price = instance.product.price
-                instance.save()
-
-            document.update_total()
-            document.update_product_quantities()
-
-            msg = {
-                'cashless': 'Безналичная продажа',
-                'cash': 'Товарный чек',
-                'return': 'Возврат товара'
-            }[doc_type]
-
-            messages.success(request, f"{msg} №{document.number} успешно создан.")
-            return redirect('document_list')
+            try:
+                # документ, позиции и остатки — все или ничего: остаток могли
+                # успеть продать после проверки формы
+                with transaction.atomic():
+                    document = form.save(commit=False)
+                    document.type = doc_type
+                    document.register = form.cleaned_data.get('register')
+                    document.save()
+
+                    instances = formset.save(commit=False)
+                    # цены на дату документа для всех позиций одним запросом
+                    prices = Product.prices_on({instance.product_id for instance in instances}, document.date)
+                    for instance in instances:
+                        instance.document = document
+                        if not instance.price:
+                            instance.price = prices[instance.product_id]
+                        instance.save()
+
+                    document.update_total()
+                    document.update_product_quantities()
+            except ValidationError as e:
+                form.add_error(None, e)
+            else:
+                msg = {
+                    'cashless': 'Безналичная продажа',
+                    'cash': 'Товарный чек',
+                    'return': 'Возврат товара'
+                }[doc_type]
+
+                messages.success(request, f"{msg} №{document.number} успешно создан.")
+                return redirect('document_list')
     else:
         initial = {'type': doc_type}
         invoice_id = request.GET.get('invoice_id')
@@ -345,7 +930,7 @@ def create_sale_document(request, doc_type):
                 'total': invoice.total
             })
 
-        form = SaleDocumentForm(initial=initial)
+        form = SaleDocumentForm(initial=initial, with_register=doc_type in ('cash', 'return'))
         formset = DocumentItemFormSet(prefix='items')
 
     template = {